@@ -0,0 +1,108 @@
+-- Atomic, diff-based replace for keka_employee_leave_balances
+-- Run this in your Supabase SQL editor or psql
+
+-- Replace the leave balance table with the snapshot in p_rows, a JSON array of
+-- {keka_employee_id, leave_type, total_allocated, used, remaining, carry_forward}.
+-- Rows are matched on (keka_employee_id, leave_type): new keys are inserted,
+-- changed values updated, and keys missing from the snapshot deleted. Unchanged
+-- rows are left alone. The whole change set commits in this one transaction,
+-- so readers see either the previous balances or the new ones, never a gap.
+-- Rows for employees not yet in keka_employees are skipped rather than failing
+-- the foreign key. Returns the counts of each kind of change.
+CREATE OR REPLACE FUNCTION public.keka_replace_leave_balances(p_rows JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    v_now TIMESTAMPTZ := NOW();
+    v_inserted INTEGER := 0;
+    v_updated INTEGER := 0;
+    v_deleted INTEGER := 0;
+    v_skipped INTEGER := 0;
+    v_total INTEGER := 0;
+BEGIN
+    -- Serialize concurrent replaces (e.g. two workers running the same job)
+    PERFORM pg_advisory_xact_lock(hashtext('keka_replace_leave_balances'));
+
+    CREATE TEMP TABLE leave_balance_snapshot ON COMMIT DROP AS
+    SELECT DISTINCT ON (r.keka_employee_id, r.leave_type)
+        r.keka_employee_id,
+        r.leave_type,
+        COALESCE(r.total_allocated, 0) AS total_allocated,
+        COALESCE(r.used, 0) AS used,
+        COALESCE(r.remaining, 0) AS remaining,
+        COALESCE(r.carry_forward, 0) AS carry_forward
+    FROM jsonb_to_recordset(p_rows) AS r(
+        keka_employee_id VARCHAR(100),
+        leave_type VARCHAR(100),
+        total_allocated DECIMAL(10,2),
+        used DECIMAL(10,2),
+        remaining DECIMAL(10,2),
+        carry_forward DECIMAL(10,2)
+    )
+    WHERE r.keka_employee_id IS NOT NULL AND r.leave_type IS NOT NULL;
+
+    SELECT COUNT(*) INTO v_total FROM leave_balance_snapshot;
+
+    DELETE FROM leave_balance_snapshot s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM keka_employees e WHERE e.keka_employee_id = s.keka_employee_id
+    );
+    GET DIAGNOSTICS v_skipped = ROW_COUNT;
+
+    -- An empty snapshot would wipe every balance; treat it as a bad fetch instead
+    IF NOT EXISTS (SELECT 1 FROM leave_balance_snapshot) THEN
+        RAISE EXCEPTION 'Refusing to replace leave balances with an empty snapshot';
+    END IF;
+
+    DELETE FROM keka_employee_leave_balances b
+    WHERE NOT EXISTS (
+        SELECT 1 FROM leave_balance_snapshot s
+        WHERE s.keka_employee_id = b.keka_employee_id AND s.leave_type = b.leave_type
+    );
+    GET DIAGNOSTICS v_deleted = ROW_COUNT;
+
+    UPDATE keka_employee_leave_balances b
+    SET total_allocated = s.total_allocated,
+        used = s.used,
+        remaining = s.remaining,
+        carry_forward = s.carry_forward,
+        last_synced_at = v_now,
+        updated_at = v_now
+    FROM leave_balance_snapshot s
+    WHERE s.keka_employee_id = b.keka_employee_id
+      AND s.leave_type = b.leave_type
+      AND (b.total_allocated, b.used, b.remaining, b.carry_forward)
+          IS DISTINCT FROM (s.total_allocated, s.used, s.remaining, s.carry_forward);
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+
+    INSERT INTO keka_employee_leave_balances (
+        keka_employee_id, leave_type, total_allocated, used, remaining, carry_forward,
+        last_synced_at, updated_at
+    )
+    SELECT s.keka_employee_id, s.leave_type, s.total_allocated, s.used, s.remaining, s.carry_forward,
+           v_now, v_now
+    FROM leave_balance_snapshot s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM keka_employee_leave_balances b
+        WHERE b.keka_employee_id = s.keka_employee_id AND b.leave_type = s.leave_type
+    );
+    GET DIAGNOSTICS v_inserted = ROW_COUNT;
+
+    -- Unchanged rows were still confirmed by this sync
+    UPDATE keka_employee_leave_balances b
+    SET last_synced_at = v_now
+    FROM leave_balance_snapshot s
+    WHERE s.keka_employee_id = b.keka_employee_id
+      AND s.leave_type = b.leave_type
+      AND b.last_synced_at < v_now;
+
+    RETURN jsonb_build_object(
+        'inserted', v_inserted,
+        'updated', v_updated,
+        'deleted', v_deleted,
+        'unchanged', v_total - v_skipped - v_inserted - v_updated,
+        'skipped', v_skipped
+    );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+COMMENT ON FUNCTION public.keka_replace_leave_balances IS 'Atomically apply a leave balance snapshot as inserts, updates and deletes keyed by (employee, leave type)';
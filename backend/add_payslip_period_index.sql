@@ -0,0 +1,25 @@
+-- Add the (employee, period) index used to serve payslips from keka_employee_payslips
+-- Run this in your Supabase SQL editor or psql
+
+ALTER TABLE keka_employee_payslips ADD COLUMN IF NOT EXISTS pay_group_id VARCHAR(100);
+ALTER TABLE keka_employee_payslips ADD COLUMN IF NOT EXISTS period_year INTEGER;
+ALTER TABLE keka_employee_payslips ADD COLUMN IF NOT EXISTS period_month INTEGER;
+
+-- Backfill the period for rows written before these columns existed
+UPDATE keka_employee_payslips
+SET period_year = EXTRACT(YEAR FROM start_date)::INTEGER,
+    period_month = EXTRACT(MONTH FROM start_date)::INTEGER
+WHERE period_year IS NULL AND start_date IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_keka_employee_payslips_employee_period
+ON keka_employee_payslips(keka_employee_id, period_year, period_month);
+
+CREATE INDEX IF NOT EXISTS idx_keka_employee_payslips_pay_slip_id
+ON keka_employee_payslips(pay_slip_id);
+
+-- Insert payslips sync type if it doesn't exist
+INSERT INTO keka_sync_status (sync_type, sync_status, records_processed, records_failed)
+SELECT 'payslips', 'pending', 0, 0
+WHERE NOT EXISTS (
+    SELECT 1 FROM keka_sync_status WHERE sync_type = 'payslips'
+);
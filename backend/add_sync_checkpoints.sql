@@ -0,0 +1,11 @@
+-- Add per-run stage checkpoints to keka_sync_status
+-- Run this in your Supabase SQL editor or psql
+
+-- Scheduled runs (daily_sync, monthly_sync, full_sync) keep one row each:
+-- sync_cursor holds the run's start time and checkpoint the stages already
+-- completed, so a rerun after a failure or restart resumes from there.
+-- The payslips row uses it for the pay cycles whose registers were written
+-- in full, which later runs skip.
+ALTER TABLE keka_sync_status ADD COLUMN IF NOT EXISTS checkpoint JSONB;
+
+COMMENT ON COLUMN keka_sync_status.checkpoint IS 'For scheduled sync runs: {"completed": [...], "failed": [...]} stage names; for payslips: {"completed_cycles": [...]} pay cycle IDs';
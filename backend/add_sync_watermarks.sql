@@ -0,0 +1,10 @@
+-- Add the incremental sync watermark to keka_sync_status
+-- Run this in your Supabase SQL editor or psql
+
+-- Start time of the last successful incremental or repair sync. Attendance
+-- sync re-reads a few days before it; leave history asks Keka for requests
+-- modified since it.
+ALTER TABLE keka_sync_status ADD COLUMN IF NOT EXISTS sync_cursor TIMESTAMPTZ;
+
+COMMENT ON COLUMN keka_sync_status.sync_cursor IS 'Watermark for incremental syncs: start time of the last successful incremental or repair run';
+
@@ -1,10 +1,8 @@
 import os
-import time
-from collections import defaultdict
-from typing import Dict, List, Tuple
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import chat, auth, knowledge, feedback, hr, sync
+from app.routers import chat, auth, knowledge, feedback, hr, sync, keka_webhooks
+from app.services.rate_limit_service import rate_limit_service
 # Configuration is handled in utils/supabase_config.py
 
 app = FastAPI(
@@ -63,29 +61,38 @@ async def set_security_headers(request: Request, call_next):
         response.headers.setdefault("Strict-Transport-Security", "max-age=31536000; includeSubDomains")
     return response
 
-# Simple in-memory rate limiter for sensitive endpoints
-RATE_LIMITS: Dict[str, Tuple[int, int]] = {
-    "/api/auth/token": (30, 10 * 60),
-}
-rate_store: Dict[Tuple[str, str], List[float]] = defaultdict(list)
-
+# Sliding-window rate limits per route, shared across workers (see rate_limit_service)
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
-    if request.method == "OPTIONS":
-        return await call_next(request)
-    path = request.url.path
-    client_ip = (request.client.host if request.client else "unknown") or "unknown"
-    if path in RATE_LIMITS:
-        max_requests, window_seconds = RATE_LIMITS[path]
-        key = (client_ip, path)
-        now = time.time()
-        window_start = now - window_seconds
-        recent = [ts for ts in rate_store[key] if ts >= window_start]
-        rate_store[key] = recent
-        if len(recent) >= max_requests:
-            return Response(status_code=429, content="Too Many Requests")
-        rate_store[key].append(now)
-    return await call_next(request)
+    return await rate_limit_service.dispatch(request, call_next)
+
+# Release the pooled OpenAI connections on shutdown
+@app.on_event("shutdown")
+async def _close_llm_gateway():
+    from app.utils.llm_gateway import llm_gateway
+    await llm_gateway.aclose()
+
+# Open the shared Keka connection pool on startup, close it on shutdown
+@app.on_event("startup")
+async def _start_keka_http():
+    from app.utils.keka_http import keka_http
+    await keka_http.start()
+
+@app.on_event("shutdown")
+async def _close_keka_http():
+    from app.utils.keka_http import keka_http
+    await keka_http.aclose()
+
+# Fire scheduled Keka syncs from whichever worker holds the leader lease
+@app.on_event("startup")
+async def _start_keka_sync_cron():
+    from app.services.keka_sync_cron_service import keka_sync_cron_service
+    keka_sync_cron_service.start()
+
+@app.on_event("shutdown")
+async def _stop_keka_sync_cron():
+    from app.services.keka_sync_cron_service import keka_sync_cron_service
+    await keka_sync_cron_service.stop()
 
 # Include routers
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
@@ -94,6 +101,7 @@ app.include_router(knowledge.router, prefix="/api/knowledge", tags=["knowledge"]
 app.include_router(feedback.router, prefix="/api/v1", tags=["feedback"])
 app.include_router(hr.router, prefix="/api/hr", tags=["hr"])
 app.include_router(sync.router, prefix="/api/sync", tags=["sync"])
+app.include_router(keka_webhooks.router, prefix="/api/webhooks", tags=["webhooks"])
 
 @app.get("/")
 async def root():
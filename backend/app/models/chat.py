@@ -1,6 +1,7 @@
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
+from app.models.hr import HRChatContext
 
 class Message(BaseModel):
     role: str  # "user" or "assistant"
@@ -22,3 +23,11 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     message: str
     session_id: str
+
+class ChatRoute(BaseModel):
+    """Routing decision for a single chat turn"""
+    route: str  # "escalation", "hr_data", "faq", "knowledge", "open"
+    model: Optional[str] = None  # None means the turn is answered from a template, no LLM call
+    ticket_category: Optional[str] = None
+    issue: Optional[str] = None
+    hr_query: Optional[HRChatContext] = None  # detector result, reused when fetching HR context
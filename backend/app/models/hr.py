@@ -171,6 +171,7 @@ class HRChatContext(BaseModel):
     query_type: str  # "profile", "attendance", "leave", "payslip", "general"
     intent: Optional[str] = None
     entities: Optional[Dict[str, Any]] = None
+    category_scores: Optional[Dict[str, int]] = None  # distinct keyword hits per category
 
 class HRChatResponse(BaseModel):
     """Response for HR chat queries"""
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from sqlalchemy.orm import Session
 from app.db.database import get_db
 from app.models.chat import ChatRequest, ChatResponse, ChatSession
@@ -8,18 +8,24 @@ from typing import List
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 import asyncio
 from app.utils.supabase_chat_utils import supabase_admin_client
+from app.services.chat_admission_service import chat_admission_service
 
 router = APIRouter()
 
+def _guest_key(http_request: Request) -> str:
+    """Admission key for unauthenticated chat: the client IP"""
+    return f"ip:{http_request.client.host if http_request.client else 'unknown'}"
+
 # Add this new model for session messages
 class SessionMessageRequest(BaseModel):
     content: str
 
 # Add the public chat endpoint
 @router.post("/public", response_model=ChatResponse)
-async def chat_public(request: ChatRequest):
+async def chat_public(request: ChatRequest, http_request: Request):
     """
     Process a chat message and get a response without requiring authentication.
     
@@ -27,6 +33,8 @@ async def chat_public(request: ChatRequest):
     It provides the same functionality as the authenticated endpoint but doesn't
     require a JWT token.
     """
+    # Overload answers 429/503 rather than the friendly error below
+    ticket = await chat_admission_service.admit(_guest_key(http_request))
     # Process the chat request directly without checking authentication
     try:
         # Validate user ID - use guest ID if not provided
@@ -34,7 +42,8 @@ async def chat_public(request: ChatRequest):
             request.user_id = f"guest-{request.session_id}"
             
         # Process the request
-        response = await chat_service.process_chat_request(request)
+        with ticket.tracking():
+            response = await chat_service.process_chat_request(request)
         return response
     except Exception as e:
         # Log the error
@@ -45,6 +54,8 @@ async def chat_public(request: ChatRequest):
             response="I'm sorry, I encountered an error processing your request. Please try again later."
         )
         return error_response
+    finally:
+        ticket.release()
     
 # Add test routes first to ensure they're matched before the authenticated routes
 # Get test sessions (no auth)
@@ -105,6 +116,7 @@ async def get_test_session_messages(
 async def send_test_message(
     session_id: str,
     message: SessionMessageRequest,
+    http_request: Request,
 ):
     """Send a message to a session without requiring authentication (for testing)."""
     # Check if session exists
@@ -127,7 +139,12 @@ async def send_test_message(
         user_id="test-user"
     )
     
-    response = await chat_service.process_chat_request(request)
+    ticket = await chat_admission_service.admit(_guest_key(http_request))
+    try:
+        with ticket.tracking():
+            response = await chat_service.process_chat_request(request)
+    finally:
+        ticket.release()
     
     # Return user and assistant messages
     return {
@@ -145,8 +162,13 @@ async def chat(request: ChatRequest,
              current_user: dict = Depends(get_current_supabase_user)):
     """Process a chat message using the updated service."""
     request.user_id = current_user.get('id') 
-    # Call the main processing function which now uses Supabase
-    response = await chat_service.process_chat_request(request)
+    ticket = await chat_admission_service.admit(f"user:{request.user_id}")
+    try:
+        # Call the main processing function which now uses Supabase
+        with ticket.tracking():
+            response = await chat_service.process_chat_request(request)
+    finally:
+        ticket.release()
     return response
 
 @router.get("/sessions")
@@ -216,13 +238,17 @@ async def send_message_stream(
         user_id=supabase_user_id 
     )
     
+    # Admit before streaming starts so overload is a real 429/503, not an error chunk
+    ticket = await chat_admission_service.admit(f"user:{supabase_user_id}")
+    
     # Define the async generator function to pass to StreamingResponse
     async def stream_generator():
         print("--- Starting stream_generator ---") # Add log
         try:
-            async for chunk in chat_service.process_chat_request_stream(request, user_email=user_email):
-                # print(f"--- Yielding chunk: {chunk[:50]}... ---") # Comment out verbose chunk logging
-                yield chunk
+            with ticket.tracking():
+                async for chunk in chat_service.process_chat_request_stream(request, user_email=user_email):
+                    # print(f"--- Yielding chunk: {chunk[:50]}... ---") # Comment out verbose chunk logging
+                    yield chunk
         except HTTPException as e:
             # Handle potential HTTPExceptions raised by the service (like 404)
             print(f"Stream Error (HTTPException): {e.detail}") # Log
@@ -231,11 +257,14 @@ async def send_message_stream(
             # Handle other unexpected errors
             print(f"Stream Error (Unexpected): {e}") # Log
             yield "Sorry, an unexpected error occurred during streaming."
+        finally:
+            ticket.release()
         print("--- Finished stream_generator ---") # Add log
 
     # Return the StreamingResponse
     print("--- Returning StreamingResponse --- ") # Add log
-    return StreamingResponse(stream_generator(), media_type="text/plain")
+    # The background release covers a client that disconnects before the stream starts
+    return StreamingResponse(stream_generator(), media_type="text/plain", background=BackgroundTask(ticket.release))
 
 @router.delete("/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_session(
@@ -337,3 +366,12 @@ async def weekly_qa_report(
             "qas": qas
         })
     return {"start": start_dt.isoformat(), "end": end_dt.isoformat(), "results": report}
+
+@router.get("/admission/health")
+async def chat_admission_health():
+    """Chat admission control: slots in use, queue depth and refusals"""
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "admission": chat_admission_service.get_stats()
+    }
@@ -13,7 +13,11 @@ from app.models.hr import (
     Payslip, Holiday, KekaMCPResponse, ApplyLeaveRequest, LeaveHistoryRequest,
     AttendanceRequest, PayslipRequest, HolidayRequest, LeaveBalanceRequest
 )
-from app.services.hr_data_service_direct import hr_data_service_direct as hr_data_service
+from app.services.hr_data_service_direct import HRDataServiceDirect, hr_data_service_direct as hr_data_service
+from app.services.keka_api_token_manager import keka_api_token_manager
+from app.services.keka_client import keka_client
+from app.services.keka_request_scheduler import keka_request_scheduler
+from app.services.hr_read_cache_service import hr_read_cache_service
 from app.utils.auth_utils import get_current_supabase_user
 import logging
 
@@ -32,6 +36,13 @@ def get_user_email(current_user: dict = Depends(get_current_supabase_user)) -> s
         )
     return email
 
+def get_hr_service(user_email: str = Depends(get_user_email)) -> HRDataServiceDirect:
+    """Request-scoped HR data service bound to the authenticated user"""
+    try:
+        return hr_data_service.for_user(user_email)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
+
 # Test endpoint without authentication
 @router.get("/test-profile")
 async def test_profile():
@@ -39,8 +50,8 @@ async def test_profile():
     try:
         # Use a test email from our database
         test_email = "sunhith.reddy@othainsoft.com"
-        hr_data_service.set_authenticated_user(test_email)
-        profile = await hr_data_service.get_my_profile()
+        hr_service = hr_data_service.for_user(test_email)
+        profile = await hr_service.get_my_profile()
         return {"success": True, "data": profile}
     except Exception as e:
         logger.error(f"Test profile failed: {str(e)}")
@@ -52,8 +63,8 @@ async def test_leave_balances():
     try:
         # Use a test email from our database
         test_email = "sunhith.reddy@othainsoft.com"
-        hr_data_service.set_authenticated_user(test_email)
-        balances = await hr_data_service.get_my_leave_balances()
+        hr_service = hr_data_service.for_user(test_email)
+        balances = await hr_service.get_my_leave_balances()
         return {"success": True, "data": balances}
     except Exception as e:
         logger.error(f"Test leave balances failed: {str(e)}")
@@ -65,8 +76,8 @@ async def test_leave_requests():
     try:
         # Use a test email from our database
         test_email = "sunhith.reddy@othainsoft.com"
-        hr_data_service.set_authenticated_user(test_email)
-        requests = await hr_data_service.get_my_leave_requests()
+        hr_service = hr_data_service.for_user(test_email)
+        requests = await hr_service.get_my_leave_requests()
         return {"success": True, "data": requests}
     except Exception as e:
         logger.error(f"Test leave requests failed: {str(e)}")
@@ -123,11 +134,13 @@ async def get_my_employee_id(user_email: str = Depends(get_user_email)):
         )
 
 @router.get("/profile", response_model=EmployeeProfile)
-async def get_my_profile(user_email: str = Depends(get_user_email)):
+async def get_my_profile(
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
+):
     """Get the authenticated user's employee profile"""
     try:
-        hr_data_service.set_authenticated_user(user_email)
-        profile = await hr_data_service.get_my_profile()
+        profile = await hr_service.get_my_profile()
         return profile
     except Exception as e:
         logger.error(f"Failed to fetch profile for {user_email}: {str(e)}")
@@ -137,11 +150,13 @@ async def get_my_profile(user_email: str = Depends(get_user_email)):
         )
 
 @router.get("/profile/raw")
-async def get_my_raw_profile(user_email: str = Depends(get_user_email)):
+async def get_my_raw_profile(
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
+):
     """Get the authenticated user's raw profile data from Keka"""
     try:
-        hr_data_service.set_authenticated_user(user_email)
-        raw_data = await hr_data_service.get_my_raw_profile()
+        raw_data = await hr_service.get_my_raw_profile()
         return raw_data
     except Exception as e:
         logger.error(f"Failed to fetch raw profile for {user_email}: {str(e)}")
@@ -154,12 +169,12 @@ async def get_my_raw_profile(user_email: str = Depends(get_user_email)):
 @router.get("/leave/balances", response_model=List[LeaveBalance])
 async def get_my_leave_balances(
     leave_type: Optional[str] = None,
-    user_email: str = Depends(get_user_email)
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
 ):
     """Get leave balances for the authenticated user"""
     try:
-        hr_data_service.set_authenticated_user(user_email)
-        balances = await hr_data_service.get_my_leave_balances(leave_type)
+        balances = await hr_service.get_my_leave_balances(leave_type)
         return balances
     except Exception as e:
         logger.error(f"Failed to fetch leave balances for {user_email}: {str(e)}")
@@ -169,11 +184,13 @@ async def get_my_leave_balances(
         )
 
 @router.get("/leave/requests")
-async def get_my_leave_requests(user_email: str = Depends(get_user_email)):
+async def get_my_leave_requests(
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
+):
     """Get leave requests for the authenticated user"""
     try:
-        hr_data_service.set_authenticated_user(user_email)
-        requests = await hr_data_service.get_my_leave_requests()
+        requests = await hr_service.get_my_leave_requests()
         return {"success": True, "data": requests}
     except Exception as e:
         logger.error(f"Failed to fetch leave requests for {user_email}: {str(e)}")
@@ -200,12 +217,12 @@ async def get_leave_types():
 async def get_my_leave_history(
     from_date: Optional[date] = None,
     to_date: Optional[date] = None,
-    user_email: str = Depends(get_user_email)
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
 ):
     """Get leave history for the authenticated user"""
     try:
-        hr_data_service.set_authenticated_user(user_email)
-        history = await hr_data_service.get_my_leave_history(from_date, to_date)
+        history = await hr_service.get_my_leave_history(from_date, to_date)
         return history
     except Exception as e:
         logger.error(f"Failed to fetch leave history for {user_email}: {str(e)}")
@@ -217,12 +234,11 @@ async def get_my_leave_history(
 @router.post("/leave/apply", response_model=KekaMCPResponse)
 async def apply_for_leave(
     leave_request: ApplyLeaveRequest,
-    user_email: str = Depends(get_user_email)
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
 ):
     """Apply for leave"""
     try:
-        hr_data_service.set_authenticated_user(user_email)
-        
         # Create leave application object
         from app.models.hr import LeaveApplication
         from datetime import datetime, date
@@ -262,7 +278,7 @@ async def apply_for_leave(
             "note": leave_request.note or ""
         }
         
-        result = await hr_data_service.create_leave_request(leave_data)
+        result = await hr_service.apply_for_leave(leave_data)
         
         return KekaMCPResponse(
             success=True,
@@ -281,7 +297,8 @@ async def apply_for_leave(
 async def get_my_attendance(
     from_date: Optional[date] = None,
     to_date: Optional[date] = None,
-    user_email: str = Depends(get_user_email)
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
 ):
     """Get attendance records for the authenticated user"""
     try:
@@ -299,10 +316,9 @@ async def get_my_attendance(
                 detail="Date range cannot exceed 6 months"
             )
         
-        hr_data_service.set_authenticated_user(user_email)
         from_date_str = from_date.isoformat() if from_date else None
         to_date_str = to_date.isoformat() if to_date else None
-        attendance = await hr_data_service.get_my_attendance(from_date_str, to_date_str)
+        attendance = await hr_service.get_my_attendance(from_date_str, to_date_str)
         
         # Return raw Keka data structure
         return attendance
@@ -314,15 +330,17 @@ async def get_my_attendance(
         )
 
 @router.get("/attendance/current-month")
-async def get_current_month_attendance(user_email: str = Depends(get_user_email)):
+async def get_current_month_attendance(
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
+):
     """Get attendance for the current month"""
     try:
         today = date.today()
         from_date = date(today.year, today.month, 1)
         to_date = today
         
-        hr_data_service.set_authenticated_user(user_email)
-        attendance = await hr_data_service.get_current_month_attendance()
+        attendance = await hr_service.get_current_month_attendance()
         
         # Return raw Keka data structure
         return attendance
@@ -338,7 +356,8 @@ async def get_current_month_attendance(user_email: str = Depends(get_user_email)
 async def get_my_payslip(
     month: int,
     year: int,
-    user_email: str = Depends(get_user_email)
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
 ):
     """Get payslip for specific month and year"""
     try:
@@ -356,8 +375,7 @@ async def get_my_payslip(
                 detail=f"Year must be between 2020 and {current_year}"
             )
         
-        hr_data_service.set_authenticated_user(user_email)
-        payslip = await hr_data_service.get_my_payslip(month, year)
+        payslip = await hr_service.get_my_payslip(month, year)
         return payslip
     except Exception as e:
         logger.error(f"Failed to fetch payslip for {user_email}: {str(e)}")
@@ -367,15 +385,17 @@ async def get_my_payslip(
         )
 
 @router.get("/payslip/latest", response_model=Payslip)
-async def get_latest_payslip(user_email: str = Depends(get_user_email)):
+async def get_latest_payslip(
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
+):
     """Get the latest available payslip"""
     try:
         # Try current month first, then previous month
         today = date.today()
         
         try:
-            hr_data_service.set_authenticated_user(user_email)
-            return await hr_data_service.get_my_payslip(today.month, today.year)
+            return await hr_service.get_my_payslip(today.month, today.year)
         except HTTPException:
             # Try previous month
             if today.month == 1:
@@ -385,7 +405,7 @@ async def get_latest_payslip(user_email: str = Depends(get_user_email)):
                 prev_month = today.month - 1
                 prev_year = today.year
                 
-            return await hr_data_service.get_my_payslip(prev_month, prev_year)
+            return await hr_service.get_my_payslip(prev_month, prev_year)
             
     except Exception as e:
         logger.error(f"Failed to fetch latest payslip for {user_email}: {str(e)}")
@@ -396,11 +416,13 @@ async def get_latest_payslip(user_email: str = Depends(get_user_email)):
 
 # General Information Endpoints
 @router.get("/leave-types")
-async def get_available_leave_types(user_email: str = Depends(get_user_email)):
+async def get_available_leave_types(
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
+):
     """Get available leave types"""
     try:
-        hr_data_service.set_authenticated_user(user_email)
-        leave_types = await hr_data_service.get_leave_types()
+        leave_types = await hr_service.get_leave_types()
         return {"leave_types": leave_types}
     except Exception as e:
         logger.error(f"Failed to fetch leave types: {str(e)}")
@@ -412,15 +434,15 @@ async def get_available_leave_types(user_email: str = Depends(get_user_email)):
 @router.get("/holidays", response_model=List[Holiday])
 async def get_company_holidays(
     year: Optional[int] = None,
-    user_email: str = Depends(get_user_email)
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
 ):
     """Get company holidays"""
     try:
         if not year:
             year = datetime.now().year
             
-        hr_data_service.set_authenticated_user(user_email)
-        holidays = await hr_data_service.get_upcoming_holidays(year)
+        holidays = await hr_service.get_upcoming_holidays(year)
         return holidays
     except Exception as e:
         logger.error(f"Failed to fetch holidays: {str(e)}")
@@ -430,11 +452,13 @@ async def get_company_holidays(
         )
 
 @router.get("/holidays/upcoming", response_model=List[Holiday])
-async def get_upcoming_holidays(user_email: str = Depends(get_user_email)):
+async def get_upcoming_holidays(
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
+):
     """Get upcoming holidays in the next 3 months"""
     try:
-        hr_data_service.set_authenticated_user(user_email)
-        holidays = await hr_data_service.get_upcoming_holidays()
+        holidays = await hr_service.get_upcoming_holidays()
         
         # Filter for upcoming holidays in next 3 months
         today = date.today()
@@ -460,35 +484,34 @@ async def get_upcoming_holidays(user_email: str = Depends(get_user_email)):
 @router.post("/chat/context", response_model=KekaMCPResponse)
 async def get_hr_context_for_chat(
     query: str,
-    user_email: str = Depends(get_user_email)
+    user_email: str = Depends(get_user_email),
+    hr_service: HRDataServiceDirect = Depends(get_hr_service)
 ):
     """Get HR context for chat queries"""
     try:
-        hr_data_service.set_authenticated_user(user_email)
-        
         # Simple intent classification (can be enhanced with NLP)
         query_lower = query.lower()
         
         context_data = {}
         
         if any(word in query_lower for word in ['profile', 'details', 'information', 'me']):
-            context_data['profile'] = await hr_data_service.get_my_profile()
+            context_data['profile'] = await hr_service.get_my_profile()
             
         if any(word in query_lower for word in ['leave', 'vacation', 'time off']):
             if any(word in query_lower for word in ['balance', 'remaining', 'left']):
-                context_data['leave_balances'] = await hr_data_service.get_my_leave_balances()
+                context_data['leave_balances'] = await hr_service.get_my_leave_balances()
             if any(word in query_lower for word in ['history', 'past', 'previous']):
-                context_data['leave_history'] = await hr_data_service.get_my_leave_history()
+                context_data['leave_history'] = await hr_service.get_my_leave_history()
                 
         if any(word in query_lower for word in ['attendance', 'present', 'hours']):
             today = date.today()
             from_date = date(today.year, today.month, 1)
-            context_data['attendance'] = await hr_data_service.get_my_attendance(from_date, today)
+            context_data['attendance'] = await hr_service.get_my_attendance(from_date, today)
             
         if any(word in query_lower for word in ['salary', 'payslip', 'pay']):
             try:
                 today = date.today()
-                context_data['payslip'] = await hr_data_service.get_my_payslip(today.month, today.year)
+                context_data['payslip'] = await hr_service.get_my_payslip(today.month, today.year)
             except:
                 # Try previous month if current month not available
                 if today.month == 1:
@@ -496,12 +519,12 @@ async def get_hr_context_for_chat(
                 else:
                     prev_month, prev_year = today.month - 1, today.year
                 try:
-                    context_data['payslip'] = await hr_data_service.get_my_payslip(prev_month, prev_year)
+                    context_data['payslip'] = await hr_service.get_my_payslip(prev_month, prev_year)
                 except:
                     pass  # No payslip available
                     
         if any(word in query_lower for word in ['holiday', 'holidays']):
-            context_data['holidays'] = await hr_data_service.get_upcoming_holidays()
+            context_data['holidays'] = await hr_service.get_upcoming_holidays()
         
         return KekaMCPResponse(
             success=True,
@@ -524,7 +547,11 @@ async def hr_service_health():
         "status": "healthy",
         "service": "HR ESS Integration",
         "timestamp": datetime.now().isoformat(),
-        "keka_configured": bool(os.getenv("KEKA_CLIENT_ID") and os.getenv("KEKA_CLIENT_SECRET"))
+        "keka_configured": bool(os.getenv("KEKA_CLIENT_ID") and os.getenv("KEKA_CLIENT_SECRET")),
+        "keka_token_cache": keka_api_token_manager.get_stats(),
+        "keka_client": keka_client.get_stats(),
+        "keka_scheduler": keka_request_scheduler.get_stats(),
+        "hr_read_cache": hr_read_cache_service.get_stats()
     }
 
 # Helper function
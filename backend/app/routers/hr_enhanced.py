@@ -3,6 +3,8 @@ Enhanced HR Router with Keka OAuth Integration
 Provides HR endpoints that require proper Keka authentication via OAuth2 tokens
 """
 
+import os
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List, Optional, Dict, Any
 from datetime import datetime, date, timedelta
@@ -13,7 +15,7 @@ from app.models.hr import (
     AttendanceRequest, PayslipRequest, HolidayRequest, LeaveBalanceRequest
 )
 from app.services.keka_oauth_service import keka_oauth_service
-from app.services.keka_mcp_service import keka_mcp_service
+from app.services.keka_mcp_service import KekaMCPServer, keka_mcp_service
 from app.utils.auth_utils import get_current_supabase_user
 import logging
 
@@ -23,6 +25,9 @@ logger = logging.getLogger(__name__)
 # Create router
 router = APIRouter(prefix="/api/hr", tags=["hr-enhanced"])
 
+# Per-source timeout (seconds) for the dashboard fan-out
+DASHBOARD_SOURCE_TIMEOUT = float(os.getenv("HR_DASHBOARD_SOURCE_TIMEOUT", "8"))
+
 class KekaAuthenticationError(HTTPException):
     """Custom exception for Keka authentication issues"""
     def __init__(self, detail: str = "Keka account not connected"):
@@ -35,7 +40,7 @@ class KekaAuthenticationError(HTTPException):
             }
         )
 
-def get_keka_authenticated_user(current_user: dict = Depends(get_current_supabase_user)) -> str:
+async def get_keka_authenticated_user(current_user: dict = Depends(get_current_supabase_user)) -> str:
     """
     Enhanced dependency that ensures user has valid Keka authentication
     
@@ -53,7 +58,7 @@ def get_keka_authenticated_user(current_user: dict = Depends(get_current_supabas
         )
     
     # Check if user has valid Keka tokens
-    access_token = keka_oauth_service.get_valid_access_token(user_email)
+    access_token = await keka_oauth_service.get_valid_access_token(user_email)
     
     if not access_token:
         logger.warning(f"User {user_email} attempted to access HR data without valid Keka tokens")
@@ -61,18 +66,25 @@ def get_keka_authenticated_user(current_user: dict = Depends(get_current_supabas
             "To access your HR information, please connect your Keka account first."
         )
     
-    # Set up Keka MCP service with valid tokens
-    keka_mcp_service.set_authenticated_user(user_email)
-    
     return user_email
 
+def get_keka_service(user_email: str = Depends(get_keka_authenticated_user)) -> KekaMCPServer:
+    """Request-scoped Keka MCP service bound to the authenticated user"""
+    try:
+        return keka_mcp_service.for_user(user_email)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
+
 # Employee Profile Endpoints
 @router.get("/profile", response_model=EmployeeProfile)
-async def get_my_profile(user_email: str = Depends(get_keka_authenticated_user)):
+async def get_my_profile(
+    user_email: str = Depends(get_keka_authenticated_user),
+    keka_service: KekaMCPServer = Depends(get_keka_service)
+):
     """Get the authenticated user's employee profile from Keka"""
     try:
         logger.info(f"Fetching profile for authenticated user: {user_email}")
-        profile = await keka_mcp_service.get_my_profile()
+        profile = await keka_service.get_my_profile()
         return profile
     except Exception as e:
         logger.error(f"Failed to fetch profile for {user_email}: {str(e)}")
@@ -85,12 +97,13 @@ async def get_my_profile(user_email: str = Depends(get_keka_authenticated_user))
 @router.get("/leave/balances", response_model=List[LeaveBalance])
 async def get_my_leave_balances(
     leave_type: Optional[str] = None,
-    user_email: str = Depends(get_keka_authenticated_user)
+    user_email: str = Depends(get_keka_authenticated_user),
+    keka_service: KekaMCPServer = Depends(get_keka_service)
 ):
     """Get leave balances for the authenticated user"""
     try:
         logger.info(f"Fetching leave balances for user: {user_email}, type: {leave_type}")
-        balances = await keka_mcp_service.get_my_leave_balances(leave_type)
+        balances = await keka_service.get_my_leave_balances(leave_type)
         return balances
     except Exception as e:
         logger.error(f"Failed to fetch leave balances for {user_email}: {str(e)}")
@@ -103,12 +116,13 @@ async def get_my_leave_balances(
 async def get_my_leave_history(
     from_date: Optional[date] = None,
     to_date: Optional[date] = None,
-    user_email: str = Depends(get_keka_authenticated_user)
+    user_email: str = Depends(get_keka_authenticated_user),
+    keka_service: KekaMCPServer = Depends(get_keka_service)
 ):
     """Get leave history for the authenticated user"""
     try:
         logger.info(f"Fetching leave history for user: {user_email}, from: {from_date}, to: {to_date}")
-        history = await keka_mcp_service.get_my_leave_history(from_date, to_date)
+        history = await keka_service.get_my_leave_history(from_date, to_date)
         return history
     except Exception as e:
         logger.error(f"Failed to fetch leave history for {user_email}: {str(e)}")
@@ -120,7 +134,8 @@ async def get_my_leave_history(
 @router.post("/leave/apply", response_model=KekaMCPResponse)
 async def apply_for_leave(
     leave_request: ApplyLeaveRequest,
-    user_email: str = Depends(get_keka_authenticated_user)
+    user_email: str = Depends(get_keka_authenticated_user),
+    keka_service: KekaMCPServer = Depends(get_keka_service)
 ):
     """Apply for leave"""
     try:
@@ -136,7 +151,7 @@ async def apply_for_leave(
             is_half_day=leave_request.is_half_day
         )
         
-        response = await keka_mcp_service.apply_for_leave(leave_app)
+        response = await keka_service.apply_for_leave(leave_app)
         return response
     except Exception as e:
         logger.error(f"Failed to apply for leave for {user_email}: {str(e)}")
@@ -150,12 +165,13 @@ async def apply_for_leave(
 async def get_my_attendance(
     from_date: Optional[date] = None,
     to_date: Optional[date] = None,
-    user_email: str = Depends(get_keka_authenticated_user)
+    user_email: str = Depends(get_keka_authenticated_user),
+    keka_service: KekaMCPServer = Depends(get_keka_service)
 ):
     """Get attendance records for the authenticated user"""
     try:
         logger.info(f"Fetching attendance for user: {user_email}, from: {from_date}, to: {to_date}")
-        attendance = await keka_mcp_service.get_my_attendance(from_date, to_date)
+        attendance = await keka_service.get_my_attendance(from_date, to_date)
         return attendance
     except Exception as e:
         logger.error(f"Failed to fetch attendance for {user_email}: {str(e)}")
@@ -169,12 +185,13 @@ async def get_my_attendance(
 async def get_my_payslips(
     year: Optional[int] = None,
     month: Optional[int] = None,
-    user_email: str = Depends(get_keka_authenticated_user)
+    user_email: str = Depends(get_keka_authenticated_user),
+    keka_service: KekaMCPServer = Depends(get_keka_service)
 ):
     """Get payslips for the authenticated user"""
     try:
         logger.info(f"Fetching payslips for user: {user_email}, year: {year}, month: {month}")
-        payslips = await keka_mcp_service.get_my_payslips(year, month)
+        payslips = await keka_service.get_my_payslips(year, month)
         return payslips
     except Exception as e:
         logger.error(f"Failed to fetch payslips for {user_email}: {str(e)}")
@@ -187,12 +204,13 @@ async def get_my_payslips(
 @router.get("/holidays", response_model=List[Holiday])
 async def get_holidays(
     year: Optional[int] = None,
-    user_email: str = Depends(get_keka_authenticated_user)
+    user_email: str = Depends(get_keka_authenticated_user),
+    keka_service: KekaMCPServer = Depends(get_keka_service)
 ):
     """Get holiday calendar"""
     try:
         logger.info(f"Fetching holidays for user: {user_email}, year: {year}")
-        holidays = await keka_mcp_service.get_holidays(year)
+        holidays = await keka_service.get_holidays(year)
         return holidays
     except Exception as e:
         logger.error(f"Failed to fetch holidays for {user_email}: {str(e)}")
@@ -202,11 +220,30 @@ async def get_holidays(
         )
 
 # Summary Dashboard Endpoint
+async def _fetch_dashboard_source(name: str, fetch, default: Any) -> Dict[str, Any]:
+    """Run one dashboard sub-call with its own timeout; failures yield the default"""
+    try:
+        value = await asyncio.wait_for(fetch(), timeout=DASHBOARD_SOURCE_TIMEOUT)
+        return {"name": name, "value": value, "error": None}
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out fetching {name} for dashboard after {DASHBOARD_SOURCE_TIMEOUT}s")
+        return {"name": name, "value": default, "error": "timeout"}
+    except Exception as e:
+        logger.warning(f"Failed to fetch {name} for dashboard: {str(e)}")
+        return {"name": name, "value": default, "error": str(e)}
+
 @router.get("/dashboard")
-async def get_hr_dashboard(user_email: str = Depends(get_keka_authenticated_user)) -> Dict[str, Any]:
+async def get_hr_dashboard(
+    user_email: str = Depends(get_keka_authenticated_user),
+    keka_service: KekaMCPServer = Depends(get_keka_service)
+) -> Dict[str, Any]:
     """
     Get HR dashboard data - combines multiple HR data sources
     
+    Sources are fetched concurrently, each with its own timeout. A slow or
+    failing source falls back to an empty value and is listed under
+    'errors' instead of failing the whole dashboard.
+    
     Returns:
         Dict containing profile, leave balances, recent attendance, and upcoming holidays
     """
@@ -217,52 +254,41 @@ async def get_hr_dashboard(user_email: str = Depends(get_keka_authenticated_user
         today = date.today()
         current_month_start = today.replace(day=1)
         
-        # Parallel fetch of multiple data sources
-        dashboard_data = {}
-        
-        try:
-            # Basic profile info
-            profile = await keka_mcp_service.get_my_profile()
-            dashboard_data['profile'] = {
+        async def fetch_profile():
+            profile = await keka_service.get_my_profile()
+            return {
                 'employee_id': profile.employee_id,
                 'full_name': profile.full_name,
                 'designation': profile.designation,
                 'department': profile.department
             }
-        except Exception as e:
-            logger.warning(f"Failed to fetch profile for dashboard: {str(e)}")
-            dashboard_data['profile'] = None
-        
-        try:
-            # Leave balances
-            leave_balances = await keka_mcp_service.get_my_leave_balances()
-            dashboard_data['leave_balances'] = leave_balances
-        except Exception as e:
-            logger.warning(f"Failed to fetch leave balances for dashboard: {str(e)}")
-            dashboard_data['leave_balances'] = []
         
-        try:
-            # Current month attendance
-            attendance = await keka_mcp_service.get_my_attendance(
+        async def fetch_attendance():
+            return await keka_service.get_my_attendance(
                 from_date=current_month_start,
                 to_date=today
             )
-            dashboard_data['current_month_attendance'] = attendance
-        except Exception as e:
-            logger.warning(f"Failed to fetch attendance for dashboard: {str(e)}")
-            dashboard_data['current_month_attendance'] = []
         
-        try:
+        async def fetch_upcoming_holidays():
             # Upcoming holidays (next 3 months)
-            holidays = await keka_mcp_service.get_holidays(today.year)
+            holidays = await keka_service.get_upcoming_holidays(today.year)
             upcoming_holidays = [
                 h for h in holidays 
                 if h.date >= today and h.date <= today + timedelta(days=90)
             ]
-            dashboard_data['upcoming_holidays'] = upcoming_holidays[:5]  # Limit to 5 upcoming
-        except Exception as e:
-            logger.warning(f"Failed to fetch holidays for dashboard: {str(e)}")
-            dashboard_data['upcoming_holidays'] = []
+            return upcoming_holidays[:5]  # Limit to 5 upcoming
+        
+        # Parallel fetch of multiple data sources; the scoped service resolves
+        # the access token and employee ID once and shares them across sub-calls
+        results = await asyncio.gather(
+            _fetch_dashboard_source('profile', fetch_profile, None),
+            _fetch_dashboard_source('leave_balances', keka_service.get_my_leave_balances, []),
+            _fetch_dashboard_source('current_month_attendance', fetch_attendance, []),
+            _fetch_dashboard_source('upcoming_holidays', fetch_upcoming_holidays, []),
+        )
+        
+        dashboard_data = {result['name']: result['value'] for result in results}
+        errors = {result['name']: result['error'] for result in results if result['error']}
         
         # Calculate some stats
         dashboard_data['stats'] = {
@@ -275,8 +301,9 @@ async def get_hr_dashboard(user_email: str = Depends(get_keka_authenticated_user
         }
         
         return {
-            'status': 'success',
+            'status': 'partial' if errors else 'success',
             'data': dashboard_data,
+            'errors': errors,
             'last_updated': datetime.now().isoformat()
         }
         
@@ -314,7 +341,7 @@ async def refresh_auth_tokens(user_email: str = Depends(get_current_supabase_use
     (This endpoint doesn't require Keka auth - it attempts to refresh)
     """
     try:
-        success = keka_oauth_service.refresh_user_tokens(user_email)
+        success = await keka_oauth_service.refresh_user_tokens(user_email)
         
         if success:
             status = keka_oauth_service.get_connection_status(user_email)
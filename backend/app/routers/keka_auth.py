@@ -153,11 +153,11 @@ async def test_keka_connection(user_email: str = Depends(get_user_email)):
     Test the Keka API connection by fetching user profile
     """
     try:
-        # Set the authenticated user in the MCP service
-        keka_mcp_service.set_authenticated_user(user_email)
+        # Request-scoped MCP service for this user
+        keka_service = keka_mcp_service.for_user(user_email)
         
         # Try to fetch the user's profile
-        profile = await keka_mcp_service.get_my_profile()
+        profile = await keka_service.get_my_profile()
         
         return {
             "success": True,
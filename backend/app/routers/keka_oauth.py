@@ -79,7 +79,7 @@ async def oauth_callback(
         logger.info(f"Processing OAuth callback with state: {state}")
         
         # Handle the callback
-        result = keka_oauth_service.handle_oauth_callback(code, state)
+        result = await keka_oauth_service.handle_oauth_callback(code, state)
         
         if result['success']:
             logger.info(f"Successfully connected Keka account for user: {result['user_email']}")
@@ -183,7 +183,7 @@ async def refresh_tokens(
         
         logger.info(f"Refreshing Keka tokens for user: {user_email}")
         
-        success = keka_oauth_service.refresh_user_tokens(user_email)
+        success = await keka_oauth_service.refresh_user_tokens(user_email)
         
         if success:
             # Get updated status
@@ -0,0 +1,59 @@
+"""
+Keka Webhooks Router
+Receives Keka change events and applies them to the sync tables
+"""
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, status
+from datetime import datetime
+import logging
+
+from app.services.keka_webhook_service import keka_webhook_service, KekaWebhookError
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.post("/keka", status_code=status.HTTP_202_ACCEPTED)
+async def receive_keka_webhook(request: Request, background_tasks: BackgroundTasks):
+    """
+    Accept a signed Keka change event. The event is acknowledged once it is
+    recorded and applied in the background; redeliveries are acknowledged
+    without being applied again.
+    """
+    body = await request.body()
+    try:
+        keka_webhook_service.verify_signature(body, request.headers.get(keka_webhook_service.signature_header))
+        event = keka_webhook_service.parse_event(body, request.headers.get(keka_webhook_service.event_id_header))
+    except KekaWebhookError as e:
+        logger.warning(f"Rejected Keka webhook: {str(e)}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    try:
+        if not keka_webhook_service.claim_event(event):
+            return {"success": True, "duplicate": True, "event_id": event["event_id"]}
+        
+        background_tasks.add_task(keka_webhook_service.process_event, event)
+        return {
+            "success": True,
+            "duplicate": False,
+            "event_id": event["event_id"],
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        # A 5xx makes Keka redeliver, and the event ID keeps that idempotent
+        logger.error(f"Failed to record Keka webhook {event['event_id']}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to record webhook event"
+        )
+
+@router.get("/keka/health")
+async def keka_webhook_health():
+    """Webhook counters for this worker"""
+    return {
+        "status": "healthy",
+        "service": "Keka Webhooks",
+        "stats": keka_webhook_service.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
@@ -3,12 +3,14 @@ Sync Management Router
 Provides endpoints for managing Keka data synchronization
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, status, BackgroundTasks
 from typing import Dict, Any, Optional
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import logging
 
 from app.services.keka_sync_scheduler import keka_sync_scheduler
+from app.services.keka_sync_cron_service import keka_sync_cron_service
+from app.services.keka_sync_run_service import keka_sync_run_service
 from app.services.keka_employee_sync_service import keka_employee_sync_service
 from app.utils.auth_utils import get_current_supabase_user
 
@@ -22,15 +24,26 @@ def get_admin_user(current_user: dict = Depends(get_current_supabase_user)) -> d
     # For now, just return the user - implement proper admin check
     return current_user
 
+def _ensure_no_sync_running() -> None:
+    """Reject a manual trigger while a scheduled or manual run is in progress"""
+    running = keka_sync_scheduler.current_run()
+    if running:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"A Keka sync is already running on {running.get('holder', 'another worker')}"
+        )
+
 @router.post("/sync/daily")
 async def trigger_daily_sync(
     background_tasks: BackgroundTasks,
+    resume: bool = True,
     admin_user: dict = Depends(get_admin_user)
 ):
-    """Trigger daily sync operation"""
+    """Trigger daily sync operation; resume skips stages an unfinished run already completed"""
+    _ensure_no_sync_running()
     try:
         # Run sync in background
-        background_tasks.add_task(keka_sync_scheduler.run_daily_sync)
+        background_tasks.add_task(keka_sync_scheduler.run_daily_sync, resume)
         
         return {
             "success": True,
@@ -47,12 +60,14 @@ async def trigger_daily_sync(
 @router.post("/sync/weekly")
 async def trigger_weekly_sync(
     background_tasks: BackgroundTasks,
+    resume: bool = True,
     admin_user: dict = Depends(get_admin_user)
 ):
     """Trigger weekly sync operation"""
+    _ensure_no_sync_running()
     try:
         # Run sync in background
-        background_tasks.add_task(keka_sync_scheduler.run_weekly_sync)
+        background_tasks.add_task(keka_sync_scheduler.run_weekly_sync, resume)
         
         return {
             "success": True,
@@ -69,12 +84,14 @@ async def trigger_weekly_sync(
 @router.post("/sync/monthly")
 async def trigger_monthly_sync(
     background_tasks: BackgroundTasks,
+    resume: bool = True,
     admin_user: dict = Depends(get_admin_user)
 ):
-    """Trigger monthly sync operation"""
+    """Trigger monthly sync operation; resume skips stages an unfinished run already completed"""
+    _ensure_no_sync_running()
     try:
         # Run sync in background
-        background_tasks.add_task(keka_sync_scheduler.run_monthly_sync)
+        background_tasks.add_task(keka_sync_scheduler.run_monthly_sync, resume)
         
         return {
             "success": True,
@@ -91,12 +108,14 @@ async def trigger_monthly_sync(
 @router.post("/sync/full")
 async def trigger_full_sync(
     background_tasks: BackgroundTasks,
+    resume: bool = True,
     admin_user: dict = Depends(get_admin_user)
 ):
-    """Trigger full sync operation"""
+    """Trigger full sync operation; resume skips stages an unfinished run already completed"""
+    _ensure_no_sync_running()
     try:
         # Run sync in background
-        background_tasks.add_task(keka_sync_scheduler.run_full_sync)
+        background_tasks.add_task(keka_sync_scheduler.run_full_sync, resume)
         
         return {
             "success": True,
@@ -112,9 +131,10 @@ async def trigger_full_sync(
 
 @router.get("/sync/status")
 async def get_sync_status(admin_user: dict = Depends(get_admin_user)):
-    """Get current sync status"""
+    """Get current sync status, the run in progress and recent stage history"""
     try:
         status_data = await keka_sync_scheduler.get_sync_status()
+        status_data["current_run"] = keka_sync_scheduler.current_run()
         return status_data
     except Exception as e:
         logger.error(f"Failed to get sync status: {str(e)}")
@@ -123,14 +143,38 @@ async def get_sync_status(admin_user: dict = Depends(get_admin_user)):
             detail="Failed to get sync status"
         )
 
+@router.get("/sync/trends")
+async def get_sync_trends(
+    days: int = Query(30, ge=1, le=365),
+    sync_type: Optional[str] = None,
+    admin_user: dict = Depends(get_admin_user)
+):
+    """Daily duration, API/DB time and throughput per sync type, with the change across the window"""
+    try:
+        return {
+            "success": True,
+            **keka_sync_run_service.get_trends(days=days, sync_type=sync_type)
+        }
+    except Exception as e:
+        logger.error(f"Failed to get sync trends: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get sync trends"
+        )
+
 @router.post("/sync/employees")
 async def sync_employees(
     background_tasks: BackgroundTasks,
     admin_user: dict = Depends(get_admin_user)
 ):
     """Sync employees data"""
+    _ensure_no_sync_running()
     try:
-        background_tasks.add_task(keka_employee_sync_service.sync_all_employees)
+        background_tasks.add_task(
+            keka_sync_scheduler.run_stage,
+            "employees",
+            keka_employee_sync_service.sync_all_employees
+        )
         
         return {
             "success": True,
@@ -150,8 +194,13 @@ async def sync_leave_balances(
     admin_user: dict = Depends(get_admin_user)
 ):
     """Sync leave balances data"""
+    _ensure_no_sync_running()
     try:
-        background_tasks.add_task(keka_employee_sync_service.sync_employee_leave_balances)
+        background_tasks.add_task(
+            keka_sync_scheduler.run_stage,
+            "leave_balances",
+            keka_employee_sync_service.sync_employee_leave_balances
+        )
         
         return {
             "success": True,
@@ -169,25 +218,25 @@ async def sync_leave_balances(
 async def sync_attendance(
     from_date: Optional[date] = None,
     to_date: Optional[date] = None,
+    repair: bool = False,
     background_tasks: BackgroundTasks = None,
     admin_user: dict = Depends(get_admin_user)
 ):
-    """Sync attendance data"""
+    """Sync attendance data; incremental without dates, repair re-syncs the range and prunes stale rows"""
+    _ensure_no_sync_running()
     try:
-        if not from_date:
-            from_date = date.today()
-        if not to_date:
-            to_date = date.today()
+        if repair and not from_date:
+            from_date = date.today() - timedelta(days=90)
         
         background_tasks.add_task(
-            keka_employee_sync_service.sync_employee_attendance,
-            from_date,
-            to_date
+            keka_sync_scheduler.run_stage,
+            "attendance",
+            lambda: keka_employee_sync_service.sync_employee_attendance(from_date, to_date, repair)
         )
         
         return {
             "success": True,
-            "message": f"Attendance sync triggered for {from_date} to {to_date}",
+            "message": f"Attendance sync triggered for {from_date or 'changes since last sync'} to {to_date or date.today()}",
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -201,25 +250,25 @@ async def sync_attendance(
 async def sync_leave_history(
     from_date: Optional[date] = None,
     to_date: Optional[date] = None,
+    repair: bool = False,
     background_tasks: BackgroundTasks = None,
     admin_user: dict = Depends(get_admin_user)
 ):
-    """Sync leave history data"""
+    """Sync leave history data; incremental without dates, repair re-syncs the range and prunes stale rows"""
+    _ensure_no_sync_running()
     try:
-        if not from_date:
+        if repair and not from_date:
             from_date = date.today() - timedelta(days=90)
-        if not to_date:
-            to_date = date.today()
         
         background_tasks.add_task(
-            keka_employee_sync_service.sync_employee_leave_history,
-            from_date,
-            to_date
+            keka_sync_scheduler.run_stage,
+            "leave_history",
+            lambda: keka_employee_sync_service.sync_employee_leave_history(from_date, to_date, repair)
         )
         
         return {
             "success": True,
-            "message": f"Leave history sync triggered for {from_date} to {to_date}",
+            "message": f"Leave history sync triggered for {from_date or 'changes since last sync'} to {to_date or date.today()}",
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -236,13 +285,15 @@ async def sync_holidays(
     admin_user: dict = Depends(get_admin_user)
 ):
     """Sync holidays data"""
+    _ensure_no_sync_running()
     try:
         if not year:
             year = datetime.now().year
         
         background_tasks.add_task(
-            keka_employee_sync_service.sync_company_holidays,
-            year
+            keka_sync_scheduler.run_stage,
+            "holidays",
+            lambda: keka_employee_sync_service.sync_company_holidays(year)
         )
         
         return {
@@ -263,8 +314,13 @@ async def sync_holiday_calendars(
     admin_user: dict = Depends(get_admin_user)
 ):
     """Sync holiday calendars data"""
+    _ensure_no_sync_running()
     try:
-        background_tasks.add_task(keka_employee_sync_service.sync_holiday_calendars)
+        background_tasks.add_task(
+            keka_sync_scheduler.run_stage,
+            "holiday_calendars",
+            keka_employee_sync_service.sync_holiday_calendars
+        )
         
         return {
             "success": True,
@@ -278,11 +334,40 @@ async def sync_holiday_calendars(
             detail="Failed to trigger holiday calendars sync"
         )
 
+@router.post("/sync/payslips")
+async def sync_payslips(
+    months: int = 6,
+    force: bool = False,
+    background_tasks: BackgroundTasks = None,
+    admin_user: dict = Depends(get_admin_user)
+):
+    """Sync processed pay registers into the payslip index"""
+    _ensure_no_sync_running()
+    try:
+        background_tasks.add_task(
+            keka_sync_scheduler.run_stage,
+            "payslips",
+            lambda: keka_employee_sync_service.sync_employee_payslips(months, force)
+        )
+        
+        return {
+            "success": True,
+            "message": f"Payslips sync triggered for the last {months} pay cycles",
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Failed to trigger payslips sync: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to trigger payslips sync"
+        )
+
 @router.get("/health")
 async def sync_health():
     """Health check for sync service"""
     return {
         "status": "healthy",
         "service": "Keka Data Sync",
+        "cron": keka_sync_cron_service.get_status(),
         "timestamp": datetime.now().isoformat()
     }
@@ -0,0 +1,290 @@
+"""
+Chat Admission Service
+Admission control for chat requests: per-user in-flight limits, a bounded
+concurrency cap with a short wait queue and daily per-user token budgets
+"""
+
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from fastapi import HTTPException, status
+
+from app.utils.llm_gateway import LLMUsage, current_llm_usage
+
+logger = logging.getLogger(__name__)
+
+
+def _seconds_until_utc_midnight() -> int:
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1, int((midnight - now).total_seconds()))
+
+
+class ChatAdmission:
+    """
+    One admitted chat request. Track its LLM calls with tracking() and call
+    release() when the response is finished; release is safe to call twice.
+    """
+
+    def __init__(self, service: "ChatAdmissionService", user_key: str):
+        self.service = service
+        self.user_key = user_key
+        self.usage = LLMUsage()
+        # Whether this request holds a concurrency slot and an in-flight count
+        self.holds_slot = False
+        self._released = False
+
+    @contextmanager
+    def tracking(self) -> Iterator[LLMUsage]:
+        """Count the LLM calls made inside the block against this request"""
+        token = current_llm_usage.set(self.usage)
+        try:
+            yield self.usage
+        finally:
+            try:
+                current_llm_usage.reset(token)
+            except ValueError:
+                # A streaming generator closed from another context; nothing to restore
+                pass
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self.service._release(self)
+
+
+class ChatAdmissionService:
+    """
+    Decides whether a chat request may start.
+
+    Checks run cheapest-refusal first: a user over their daily token budget
+    gets 429 until UTC midnight; a user with too many requests already in
+    flight gets 429; otherwise the request takes a slot under the
+    concurrency cap, waiting briefly in a bounded queue, and gets 503 when
+    the queue is full or the wait runs out. Every refusal carries
+    Retry-After.
+
+    In-flight and concurrency limits are per worker (they guard this
+    process's event loop and OpenAI connection pool). Token usage is summed
+    in Postgres via chat_token_usage_add() so the budget holds across
+    workers, with a per-worker tally when Postgres is unreachable.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("CHAT_ADMISSION_ENABLED", "true").lower() == "true"
+        self.max_inflight_per_user = int(os.getenv("CHAT_MAX_INFLIGHT_PER_USER", "2"))
+        # Per worker; gunicorn runs several
+        self.max_concurrent = int(os.getenv("CHAT_MAX_CONCURRENT", "16"))
+        self.queue_size = int(os.getenv("CHAT_QUEUE_SIZE", "8"))
+        self.queue_timeout = float(os.getenv("CHAT_QUEUE_TIMEOUT", "5"))
+        # Tokens per user per UTC day; 0 turns the budget off
+        self.daily_token_budget = int(os.getenv("CHAT_DAILY_TOKEN_BUDGET", "200000"))
+        # Seconds a user's usage total is trusted before re-reading it from Postgres
+        self.budget_refresh_seconds = float(os.getenv("CHAT_BUDGET_REFRESH_SECONDS", "30"))
+        self.backend = os.getenv("CHAT_BUDGET_BACKEND", "postgres")  # "postgres" or "local"
+
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._active = 0
+        self._waiting = 0
+        self._inflight: Dict[str, int] = {}
+        # user key -> (usage date, tokens used that day, monotonic time read)
+        self._usage: Dict[str, Tuple[str, int, float]] = {}
+        self._shared_failed_at: Optional[float] = None
+        self._background_tasks: Set[asyncio.Task] = set()
+
+        self.stats = {
+            "admitted": 0, "queued": 0, "rejected_budget": 0, "rejected_inflight": 0,
+            "rejected_queue_full": 0, "rejected_queue_timeout": 0, "tokens_recorded": 0,
+            "shared_backend_errors": 0,
+        }
+
+    async def admit(self, user_key: str) -> ChatAdmission:
+        """A ticket for one chat request, or HTTPException 429/503 with Retry-After"""
+        ticket = ChatAdmission(self, user_key)
+        if not self.enabled:
+            # Still tracked so usage is recorded
+            return ticket
+
+        if self.daily_token_budget > 0:
+            used = await self.tokens_used_today(user_key)
+            if used >= self.daily_token_budget:
+                self.stats["rejected_budget"] += 1
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Daily chat token budget exhausted; it resets at midnight UTC",
+                    headers={"Retry-After": str(_seconds_until_utc_midnight())},
+                )
+
+        if self._inflight.get(user_key, 0) >= self.max_inflight_per_user:
+            self.stats["rejected_inflight"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many chat requests in progress; wait for one to finish",
+                headers={"Retry-After": "5"},
+            )
+        # Counted before queueing so one user can't fill the queue
+        self._inflight[user_key] = self._inflight.get(user_key, 0) + 1
+        try:
+            await self._acquire_slot()
+        except BaseException:
+            self._release_inflight(user_key)
+            raise
+
+        ticket.holds_slot = True
+        self.stats["admitted"] += 1
+        return ticket
+
+    async def _acquire_slot(self) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            self._active += 1
+            return
+
+        busy_headers = {"Retry-After": str(max(1, int(self.queue_timeout)))}
+        if self._waiting >= self.queue_size:
+            self.stats["rejected_queue_full"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The assistant is busy; please try again shortly",
+                headers=busy_headers,
+            )
+
+        self.stats["queued"] += 1
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected_queue_timeout"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The assistant is busy; please try again shortly",
+                headers=busy_headers,
+            )
+        finally:
+            self._waiting -= 1
+        self._active += 1
+
+    def _release_inflight(self, user_key: str) -> None:
+        remaining = self._inflight.get(user_key, 0) - 1
+        if remaining > 0:
+            self._inflight[user_key] = remaining
+        else:
+            self._inflight.pop(user_key, None)
+
+    def _release(self, ticket: ChatAdmission) -> None:
+        if ticket.holds_slot:
+            self._active -= 1
+            self._semaphore.release()
+            self._release_inflight(ticket.user_key)
+
+        tokens = ticket.usage.total_tokens
+        if tokens > 0:
+            task = asyncio.ensure_future(self._record_tokens(ticket.user_key, tokens))
+            # Hold a reference so the task isn't garbage collected mid-flight
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    # ------------------------------------------------------------------
+    # Token budget
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now(timezone.utc).date().isoformat()
+
+    async def tokens_used_today(self, user_key: str) -> int:
+        """Tokens a user has used since midnight UTC"""
+        today = self._today()
+        cached = self._usage.get(user_key)
+        cached_tokens = cached[1] if cached is not None and cached[0] == today else None
+        if not self._use_shared_backend():
+            return cached_tokens or 0
+        if cached_tokens is not None and time.monotonic() - cached[2] < self.budget_refresh_seconds:
+            return cached_tokens
+
+        try:
+            used = await self._read_shared(user_key, today)
+        except Exception as e:
+            self._shared_backend_failed(e)
+            return cached_tokens or 0
+        self._usage[user_key] = (today, used, time.monotonic())
+        return used
+
+    async def _record_tokens(self, user_key: str, tokens: int) -> None:
+        today = self._today()
+        self.stats["tokens_recorded"] += tokens
+        cached = self._usage.get(user_key)
+        local_total = (cached[1] if cached is not None and cached[0] == today else 0) + tokens
+
+        total = None
+        if self._use_shared_backend():
+            try:
+                total = await self._add_shared(user_key, today, tokens)
+            except Exception as e:
+                self._shared_backend_failed(e)
+        self._usage[user_key] = (today, total if total is not None else local_total, time.monotonic())
+        self._sweep_usage(today)
+
+    def _sweep_usage(self, today: str) -> None:
+        for user_key in [key for key, (day, _, _) in self._usage.items() if day != today]:
+            del self._usage[user_key]
+
+    def _use_shared_backend(self) -> bool:
+        # After a failure, stay on the per-worker tally for a while before retrying Postgres
+        return self.backend == "postgres" and (
+            self._shared_failed_at is None or time.monotonic() - self._shared_failed_at >= 30
+        )
+
+    def _shared_backend_failed(self, error: Exception) -> None:
+        self.stats["shared_backend_errors"] += 1
+        self._shared_failed_at = time.monotonic()
+        logger.warning(f"Shared chat token usage unavailable, using per-worker totals: {str(error)}")
+
+    async def _read_shared(self, user_key: str, usage_date: str) -> int:
+        from app.utils.supabase_client import supabase_admin_client
+
+        def _call():
+            return supabase_admin_client.table("chat_token_usage").select("tokens").eq(
+                "user_key", user_key
+            ).eq("usage_date", usage_date).limit(1).execute()
+
+        # supabase-py is synchronous; keep it off the event loop
+        response = await asyncio.get_running_loop().run_in_executor(None, _call)
+        return int(response.data[0].get("tokens") or 0) if response.data else 0
+
+    async def _add_shared(self, user_key: str, usage_date: str, tokens: int) -> int:
+        from app.utils.supabase_client import supabase_admin_client
+
+        def _call():
+            return supabase_admin_client.rpc("chat_token_usage_add", {
+                "p_user_key": user_key,
+                "p_usage_date": usage_date,
+                "p_tokens": tokens,
+            }).execute()
+
+        response = await asyncio.get_running_loop().run_in_executor(None, _call)
+        return int(response.data or 0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Admission counters for health endpoints"""
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "active": self._active,
+            "waiting": self._waiting,
+            "max_concurrent": self.max_concurrent,
+            "users_in_flight": len(self._inflight),
+            "budget_backend": "postgres" if self._use_shared_backend() else "local",
+        }
+
+
+# Global instance
+chat_admission_service = ChatAdmissionService()
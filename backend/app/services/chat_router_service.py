@@ -0,0 +1,250 @@
+"""
+Chat Router Service
+Classifies each chat turn locally and picks the cheapest adequate path:
+template-only ticket fallback, small model for FAQ / knowledge answers,
+larger model for personal HR data and open questions
+"""
+
+import re
+import logging
+from typing import Any, Dict, List, Optional
+
+from app.models.chat import ChatRoute
+from app.services.hr_chat_service import hr_chat_service
+from app.utils.openai_utils import CHAT_MODEL_LARGE, CHAT_MODEL_SMALL
+
+logger = logging.getLogger(__name__)
+
+# Prefix our fallback responses start with; also used to count earlier fallbacks
+TICKET_TYPE_PREFIX = "🚩 Ticket type:"
+
+# Issue keywords per ticket category, mapped to the noun-phrase used in the opener
+TICKET_CATEGORY_KEYWORDS: Dict[str, Dict[str, str]] = {
+    "IT Requests": {
+        "laptop": "laptop issue",
+        "computer": "computer issue",
+        "desktop": "desktop issue",
+        "monitor": "monitor issue",
+        "keyboard": "keyboard issue",
+        "mouse": "mouse issue",
+        "printer": "printer issue",
+        "wifi": "Wi-Fi issue",
+        "wi-fi": "Wi-Fi issue",
+        "internet": "internet issue",
+        "vpn": "VPN issue",
+        "password": "password issue",
+        "outlook": "Outlook issue",
+        "email account": "email account issue",
+        "teams": "Teams issue",
+        "software": "software issue",
+        "install": "software installation",
+        "blue screen": "blue-screen",
+        "login": "login issue",
+        "log in": "login issue",
+    },
+    "HR Requests": {
+        "offer letter": "offer letter request",
+        "relieving letter": "relieving letter request",
+        "experience letter": "experience letter request",
+        "employment verification": "employment verification request",
+        "id card": "ID card request",
+        "address change": "address change request",
+        "bank details": "bank details update",
+        "onboarding": "onboarding issue",
+    },
+    "Payroll Requests": {
+        "salary not credited": "salary not credited",
+        "salary delay": "salary delay",
+        "salary delayed": "salary delay",
+        "form 16": "Form 16 request",
+        "tds": "TDS issue",
+        "tax deduction": "tax deduction issue",
+        "provident fund": "PF issue",
+        "pf": "PF issue",
+        "payslip missing": "missing payslip",
+        "wrong salary": "incorrect salary",
+        "incorrect salary": "incorrect salary",
+    },
+    "Operations": {
+        "cab didn't": "cab issue",
+        "cab did not": "cab issue",
+        "cab not": "cab issue",
+        "cab late": "late cab",
+        "driver": "cab driver issue",
+        "access card": "access card issue",
+        "parking": "parking issue",
+        "seating": "seating issue",
+        "housekeeping": "housekeeping issue",
+        "air conditioning": "AC issue",
+        "ac not": "AC issue",
+    },
+    "Accounts": {
+        "reimbursement": "reimbursement issue",
+        "expense claim": "expense claim issue",
+        "expense": "expense issue",
+        "invoice": "invoice issue",
+        "bill": "bill issue",
+    },
+    "AI Requests": {
+        "chatbot": "chatbot issue",
+        "ai tool": "AI tool request",
+        "copilot": "Copilot request",
+        "chatgpt": "ChatGPT access request",
+    },
+}
+
+# Phrases that signal the user has a problem that needs a human
+PROBLEM_SIGNALS = [
+    "not working", "isn't working", "is not working", "doesn't work", "does not work",
+    "stopped working", "broken", "issue", "problem", "error", "unable to", "can't",
+    "cannot", "not able to", "stuck", "failed", "not received", "not credited",
+    "missing", "delayed", "late", "reset", "need a", "need an", "request for", "raise a",
+]
+
+PROBLEM_SIGNAL_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(signal) for signal in PROBLEM_SIGNALS) + r")\b"
+)
+
+# Whole-word patterns for every ticket keyword, compiled once
+TICKET_KEYWORD_PATTERNS: Dict[str, List[Any]] = {
+    category: [(re.compile(r"\b" + re.escape(keyword) + r"\b"), keyword, issue) for keyword, issue in keywords.items()]
+    for category, keywords in TICKET_CATEGORY_KEYWORDS.items()
+}
+
+CAB_FAQ_PATTERN = re.compile(
+    r"\b(cab|cabs|book a cab|pickup|pick-up|drop|dropoff|drop-off|transport)\b"
+)
+
+APPROVED_OPENERS = [
+    "😣 Oh no, that **{issue}** is a pain.",
+    "😣 Oh no—**{issue}** is the worst.",
+    "😭 Bummer, that **{issue}** sounds rough.",
+    "🤔 Uh-oh, that **{issue}** must be annoying.",
+    "😟 Yikes, **{issue}** must be so frustrating.",
+    "😟 That **{issue}** is tough—sorry you're experiencing it.",
+]
+
+# The chat knowledge search scores documents by the share of query words that
+# appear anywhere in them as substrings, so "what", "the" and "can't" match
+# almost everything. A hit is judged on content words only: at least this
+# many, and this share of them, must appear as whole words in one result.
+KNOWLEDGE_HIT_MIN_WORDS = 2
+KNOWLEDGE_HIT_MIN_SHARE = 0.6
+
+KNOWLEDGE_STOPWORDS = frozenset("""
+    a an and are as at be been but by can could did do does for from get got had has have how i i'm if in
+    is it its me my no not of on or our so than that the their them then there this to too us was we
+    were what when where which who why will with would you your about any also just please tell know
+    want need like find help
+""".split()) | frozenset(word for signal in PROBLEM_SIGNALS for word in signal.split())
+
+WORD_PATTERN = re.compile(r"[a-z0-9][a-z0-9'\-]*")
+
+
+class ChatRouterService:
+    """
+    Local, rule-based turn classifier and template renderer for chat
+    """
+
+    def _match_ticket_category(self, message_lower: str) -> Optional[Dict[str, str]]:
+        """Return the single best ticket category and issue phrase, or None if ambiguous"""
+        scores = []
+        for category, patterns in TICKET_KEYWORD_PATTERNS.items():
+            matched = [(keyword, issue) for pattern, keyword, issue in patterns if pattern.search(message_lower)]
+            if matched:
+                # Prefer the longest (most specific) keyword for the issue phrase
+                _, issue = max(matched, key=lambda item: len(item[0]))
+                scores.append((len(matched), category, issue))
+
+        if not scores:
+            return None
+
+        scores.sort(key=lambda item: item[0], reverse=True)
+        if len(scores) > 1 and scores[0][0] == scores[1][0]:
+            # Two categories tie: let the LLM decide
+            return None
+
+        _, category, issue = scores[0]
+        return {"category": category, "issue": issue}
+
+    def _has_problem_signal(self, message_lower: str) -> bool:
+        return PROBLEM_SIGNAL_PATTERN.search(message_lower) is not None
+
+    def _is_knowledge_hit(self, message_lower: str, knowledge_results: Optional[List[Dict[str, Any]]]) -> bool:
+        """Whether any knowledge result covers the question's content words"""
+        if not knowledge_results:
+            return False
+        content_words = {word for word in WORD_PATTERN.findall(message_lower) if len(word) > 2 and word not in KNOWLEDGE_STOPWORDS}
+        if len(content_words) < KNOWLEDGE_HIT_MIN_WORDS:
+            return False
+        for result in knowledge_results:
+            document_words = set(WORD_PATTERN.findall((result.get("text") or "").lower()))
+            matched = len(content_words & document_words)
+            if matched >= KNOWLEDGE_HIT_MIN_WORDS and matched / len(content_words) >= KNOWLEDGE_HIT_MIN_SHARE:
+                return True
+        return False
+
+    def route_turn(
+        self,
+        message: str,
+        knowledge_results: Optional[List[Dict[str, Any]]] = None,
+        user_email: Optional[str] = None,
+    ) -> ChatRoute:
+        """
+        Classify a chat turn.
+
+        Order matters: a confident escalation wins unless the knowledge base
+        covers the question (those are answered, as the prompt requires),
+        then personal HR data (only for authenticated users), then the cab
+        FAQ, then the knowledge hit; anything else is an open question.
+        """
+        message_lower = message.lower()
+        knowledge_hit = self._is_knowledge_hit(message_lower, knowledge_results)
+
+        if not knowledge_hit and self._has_problem_signal(message_lower):
+            ticket = self._match_ticket_category(message_lower)
+            if ticket:
+                return ChatRoute(
+                    route="escalation",
+                    model=None,
+                    ticket_category=ticket["category"],
+                    issue=ticket["issue"],
+                )
+
+        if user_email:
+            # Single detector pass; 'general' means no HR keyword matched at all
+            hr_query = hr_chat_service.detect_hr_query(message_lower)
+            if hr_query.query_type != 'general':
+                return ChatRoute(route="hr_data", model=CHAT_MODEL_LARGE, hr_query=hr_query)
+
+        if CAB_FAQ_PATTERN.search(message_lower):
+            return ChatRoute(route="faq", model=CHAT_MODEL_SMALL)
+
+        if knowledge_hit:
+            return ChatRoute(route="knowledge", model=CHAT_MODEL_SMALL)
+
+        return ChatRoute(route="open", model=CHAT_MODEL_LARGE)
+
+    def render_ticket_response(self, route: ChatRoute, history: Optional[List[Dict[str, Any]]] = None) -> str:
+        """
+        Render the ticket fallback template without calling the LLM.
+
+        Openers rotate in order across the session, based on how many
+        fallback responses the assistant has already given.
+        """
+        previous_fallbacks = sum(
+            1 for msg in (history or [])
+            if msg.get('role') == 'assistant' and TICKET_TYPE_PREFIX in (msg.get('content') or '')
+        )
+        opener = APPROVED_OPENERS[previous_fallbacks % len(APPROVED_OPENERS)].format(issue=route.issue)
+
+        return (
+            f"{TICKET_TYPE_PREFIX} {route.ticket_category}\n\n"
+            f"{opener}\n\n"
+            "Don't worry, our support heroes are standing by!\n\n"
+            "👉 Create a ticket so they can dive in right away."
+        )
+
+
+# Global instance
+chat_router_service = ChatRouterService()
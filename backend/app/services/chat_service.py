@@ -11,9 +11,12 @@ from app.utils.supabase_client import supabase_admin_client
 from app.models.chat import ChatSession, Message, ChatRequest, ChatResponse 
 # Import OpenAI and vector store utils
 from app.utils.openai_utils import get_chat_completion, get_chat_completion_stream
+from app.utils.llm_gateway import LLMError
 from app.utils.vector_store import vector_store
 # Import HR chat service for enhanced context
 from app.services.hr_chat_service import hr_chat_service
+# Import chat router for per-turn model routing
+from app.services.chat_router_service import chat_router_service
 # Import Supabase chat utility functions
 from app.utils.supabase_chat_utils import (
     db_create_chat_session,
@@ -26,6 +29,12 @@ from app.utils.supabase_chat_utils import (
 # REMOVE In-memory storage 
 # chat_sessions = {}
 
+# Shown to the user when the LLM gateway gives up (rate limit, outage, deadline)
+LLM_FALLBACK_MESSAGE = (
+    "Sorry, I'm having trouble answering right now. Please try again in a moment, "
+    "or contact hr@othainsoft.com if it's urgent."
+)
+
 def create_session(db, user_id: str, user_email: Optional[str] = None) -> Optional[ChatSession]: # db param might be unused now
     """Create a new chat session in Supabase."""
     db_session = db_create_chat_session(user_id, user_email=user_email)
@@ -45,11 +54,56 @@ def create_session(db, user_id: str, user_email: Optional[str] = None) -> Option
 
 # REMOVE add_message_to_session (will call db function directly)
 
-def get_relevant_context(query: str, top_k: int = 3) -> str:
-    """Get relevant context from the knowledge base."""
-    # Search for relevant documents without using embeddings for chat queries
-    results = vector_store.search(query, top_k=top_k, is_chat_query=True)
-    
+# Shared system prompt for every LLM-backed chat route
+BASE_SYSTEM_CONTENT = (
+    "You are an HR assistant for Othain, branded as \"Othain Self Service.\" "
+    "Answer questions about Othain's HR policies, benefits, leave, payroll, and other HR-related topics "
+    "based on the provided context. "
+    "If you don't know the answer or the information isn't in the context, say so politely and direct the user to contact hr@othainsoft.com. "
+    "Always refer to the company as \"Othain\" and never discuss other companies, products, or topics.\n\n"
+    "If the user asks about something the chatbot itself cannot directly resolve, you must:\n\n"
+    "1. **Classify the issue** into the single *most specific* category from the list below.  \n"
+    "2. **Respond** with the fallback template exactly as specified.\n\n"
+    "────────────────────────────────────────────────────────\n"
+    "CATEGORIES (pick one)                 \n"
+    "────────────────────────────────────────────────────────\n"
+    "• IT Requests  \n"
+    "• HR Requests  \n"
+    "• Payroll Requests  \n"
+    "• Operations  \n"
+    "• Accounts  \n"
+    "• AI Requests  \n"
+    "────────────────────────────────────────────────────────\n"
+    "RESPONSE FORMAT (**exactly**)                          \n"
+    "────────────────────────────────────────────────────────\n"
+    "🚩 Ticket type: <Category>\n\n"
+    "<Rotating opener from the list below, restating **only** the key issue>\n\n"
+    "Don't worry, our support heroes are standing by!\n\n"
+    "👉 Create a ticket so they can dive in right away.\n"
+    "────────────────────────────────────────────────────────\n"
+    "APPROVED ROTATING OPENERS (use in this order, then loop)\n"
+    "────────────────────────────────────────────────────────\n"
+    "1. 😣 Oh no, that **<issue>** is a pain.  \n"
+    "2. 😣 Oh no—**<issue>** is the worst.  \n"
+    "3. 😭 Bummer, that **<issue>** sounds rough.  \n"
+    "4. 🤔 Uh-oh, that **<issue>** must be annoying.  \n"
+    "5. 😟 Yikes, **<issue>** must be so frustrating.  \n"
+    "6. 😟 That **<issue>** is tough—sorry you're experiencing it.  \n\n"
+    "────────────────────────────────────────────────────────\n"
+    "NOTES\n"
+    "────────────────────────────────────────────────────────\n"
+    "• Never add extra text before or after the format; our code appends the ticket-creation link.  \n"
+    "• Replace **<issue>** with a concise noun-phrase (\"blue-screen\", \"benefits inquiry\", etc.).  \n"
+    "• Cycle through the six openers in order; do not invent new ones.  \n"
+    "• If the user's question is covered by built-in knowledge, answer normally—only invoke this fallback when escalation is needed.\n\n"
+    "Othain Cab Service FAQ (handle directly; do NOT trigger fallback):\n"
+    "• Othain Cab Service lets employees schedule a cab to and from work.\n"
+    "• Book a cab via the Book A Cab page by selecting a pickup time and location. You must book a cab at least 3 hours in advance.\n"
+    "• The service is available to all Othain employees.\n"
+)
+
+def format_knowledge_context(results: List[Dict[str, Any]]) -> str:
+    """Format knowledge base search results as a context block."""
     if not results:
         return ""
     
@@ -60,7 +114,19 @@ def get_relevant_context(query: str, top_k: int = 3) -> str:
     
     return context
 
-async def process_chat_request(request: ChatRequest, user_email: Optional[str] = None) -> ChatResponse:
+def get_relevant_context(query: str, top_k: int = 3) -> str:
+    """Get relevant context from the knowledge base."""
+    # Search for relevant documents without using embeddings for chat queries
+    results = vector_store.search(query, top_k=top_k, is_chat_query=True)
+    return format_knowledge_context(results)
+
+async def _prepare_chat_turn(request: ChatRequest, user_email: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Log the user message, route the turn and build what it needs.
+
+    Returns the routing decision plus either a ready-made template response
+    (escalations) or the OpenAI messages for the chosen model.
+    """
     session_id = request.session_id or str(uuid.uuid4())
     user_id = request.user_id
     message = request.message.strip()
@@ -68,94 +134,67 @@ async def process_chat_request(request: ChatRequest, user_email: Optional[str] =
     # 1️⃣ Log the user message
     db_add_chat_message(session_id, "user", message, user_email=user_email)
 
-    # 2️⃣ Check for HR-related queries and get context
+    recent_messages_db = db_get_chat_messages(session_id, user_id)
+    if recent_messages_db is None:
+        raise HTTPException(status_code=404, detail="Chat session not found or access denied")
+
+    # 2️⃣ Classify the turn locally before doing any expensive work
+    knowledge_results = vector_store.search(message, top_k=3, is_chat_query=True)
+    route = chat_router_service.route_turn(message, knowledge_results, user_email)
+    print(f"Chat turn in session {session_id} routed to '{route.route}' (model: {route.model or 'template'})")
+
+    turn = {"session_id": session_id, "route": route, "template_response": None, "openai_messages": []}
+
+    if route.route == "escalation":
+        # Confident ticket fallback: render the template, no LLM call needed
+        turn["template_response"] = chat_router_service.render_ticket_response(route, recent_messages_db)
+        return turn
+
+    # 3️⃣ Fetch personal HR data only for turns that need it
     hr_context_data = ""
-    if user_email:
+    if route.route == "hr_data":
         try:
-            hr_query_context = hr_chat_service.detect_hr_query(message)
-            if hr_query_context.query_type != 'general' or any(keyword in message.lower() for keywords in hr_chat_service.hr_keywords.values() for keyword in keywords):
-                # This is an HR-related query, get relevant HR context
-                hr_data = await hr_chat_service.get_hr_context_for_chat(user_email, message)
-                hr_context_data = hr_chat_service.format_hr_data_for_context(hr_data.get('hr_data', {}))
+            hr_data = await hr_chat_service.get_hr_context_for_chat(user_email, message, route.hr_query)
+            hr_context_data = hr_chat_service.format_hr_data_for_context(hr_data.get('hr_data', {}))
         except Exception as e:
             # Log error but continue with regular processing
             print(f"Error getting HR context: {str(e)}")
 
-    # 3️⃣ Build OpenAI messages with enhanced HR context
-    recent_messages_db = db_get_chat_messages(session_id, user_id)
-    if recent_messages_db is None:
-        raise HTTPException(status_code=404, detail="Chat session not found or access denied")
-    openai_messages = []
-    
-    base_system_content = (
-        "You are an HR assistant for Othain, branded as \"Othain Self Service.\" "
-        "Answer questions about Othain's HR policies, benefits, leave, payroll, and other HR-related topics "
-        "based on the provided context. "
-        "If you don't know the answer or the information isn't in the context, say so politely and direct the user to contact hr@othainsoft.com. "
-        "Always refer to the company as \"Othain\" and never discuss other companies, products, or topics.\n\n"
-        "If the user asks about something the chatbot itself cannot directly resolve, you must:\n\n"
-        "1. **Classify the issue** into the single *most specific* category from the list below.  \n"
-        "2. **Respond** with the fallback template exactly as specified.\n\n"
-        "────────────────────────────────────────────────────────\n"
-        "CATEGORIES (pick one)                 \n"
-        "────────────────────────────────────────────────────────\n"
-        "• IT Requests  \n"
-        "• HR Requests  \n"
-        "• Payroll Requests  \n"
-        "• Operations  \n"
-        "• Expense Management  \n"
-        "• AI Requests  \n"
-        "────────────────────────────────────────────────────────\n"
-        "RESPONSE FORMAT (**exactly**)                          \n"
-        "────────────────────────────────────────────────────────\n"
-        "🚩 Ticket type: <Category>\n\n"
-        "<Rotating opener from the list below, restating **only** the key issue>\n\n"
-        "Don't worry, our support heroes are standing by!\n\n"
-        "👉 Create a ticket so they can dive in right away.\n"
-        "────────────────────────────────────────────────────────\n"
-        "APPROVED ROTATING OPENERS (use in this order, then loop)\n"
-        "────────────────────────────────────────────────────────\n"
-        "1. 😣 Oh no, that **<issue>** is a pain.  \n"
-        "2. 😣 Oh no—**<issue>** is the worst.  \n"
-        "3. 😭 Bummer, that **<issue>** sounds rough.  \n"
-        "4. 🤔 Uh-oh, that **<issue>** must be annoying.  \n"
-        "5. 😟 Yikes, **<issue>** must be so frustrating.  \n"
-        "6. 😟 That **<issue>** is tough—sorry you're experiencing it.  \n\n"
-        "────────────────────────────────────────────────────────\n"
-        "NOTES\n"
-        "────────────────────────────────────────────────────────\n"
-        "• Never add extra text before or after the format; our code appends the ticket-creation link.  \n"
-        "• Replace **<issue>** with a concise noun-phrase (\"blue-screen\", \"benefits inquiry\", etc.).  \n"
-        "• Cycle through the six openers in order; do not invent new ones.  \n"
-        "• If the user's question is covered by built-in knowledge, answer normally—only invoke this fallback when escalation is needed.\n\n"
-        "Othain Cab Service FAQ (handle directly; do NOT trigger fallback):\n"
-        "• Othain Cab Service lets employees schedule a cab to and from work.\n"
-        "• Book a cab via the Book A Cab page by selecting a pickup time and location. You must book a cab at least 3 hours in advance.\n"
-        "• The service is available to all Othain employees.\n"
-    )
-    
-    # Enhance system message with HR context if available
+    # 4️⃣ Build OpenAI messages
     if hr_context_data:
-        system_content = hr_chat_service.enhance_system_message_with_hr_context(base_system_content, hr_context_data)
+        system_content = hr_chat_service.enhance_system_message_with_hr_context(BASE_SYSTEM_CONTENT, hr_context_data)
     else:
-        system_content = base_system_content
-    
-    system_message = {
-        "role": "system",
-        "content": system_content
-    }
-    openai_messages.append(system_message)
-    context = get_relevant_context(message)
+        system_content = BASE_SYSTEM_CONTENT
+
+    openai_messages = [{"role": "system", "content": system_content}]
+    context = format_knowledge_context(knowledge_results)
     if context:
         openai_messages.append({"role": "system", "content": context})
     history_limit = 10
     for msg in recent_messages_db[-history_limit:]:
         openai_messages.append({"role": msg['role'], "content": msg['content']})
-    if not openai_messages or openai_messages[-1]['content'] != message:
+    if openai_messages[-1]['content'] != message:
         openai_messages.append({"role": "user", "content": message})
-    assistant_response = get_chat_completion(openai_messages)
 
-    # 3️⃣ Log the assistant's reply to DB
+    turn["openai_messages"] = openai_messages
+    return turn
+
+async def process_chat_request(request: ChatRequest, user_email: Optional[str] = None) -> ChatResponse:
+    turn = await _prepare_chat_turn(request, user_email)
+    session_id = turn["session_id"]
+    route = turn["route"]
+
+    if turn["template_response"] is not None:
+        assistant_response = turn["template_response"]
+    else:
+        try:
+            assistant_response = await get_chat_completion(turn["openai_messages"], model=route.model)
+        except LLMError as e:
+            # Don't persist the fallback text as if it were a real answer
+            print(f"LLM call failed for session {session_id}: {e}")
+            return ChatResponse(message=LLM_FALLBACK_MESSAGE, session_id=session_id)
+
+    # 5️⃣ Log the assistant's reply to DB
     db_add_chat_message(session_id, "assistant", assistant_response, user_email=user_email)
 
     return ChatResponse(
@@ -164,107 +203,29 @@ async def process_chat_request(request: ChatRequest, user_email: Optional[str] =
     )
 
 async def process_chat_request_stream(request: ChatRequest, user_email: Optional[str] = None):
-    session_id = request.session_id or str(uuid.uuid4())
-    user_id = request.user_id
-    message = request.message.strip()
-
-    # 1️⃣ Log the user message
-    db_add_chat_message(session_id, "user", message, user_email=user_email)
-
-    # 2️⃣ Check for HR-related queries and get context (same as non-streaming version)
-    hr_context_data = ""
-    if user_email:
-        try:
-            hr_query_context = hr_chat_service.detect_hr_query(message)
-            if hr_query_context.query_type != 'general' or any(keyword in message.lower() for keywords in hr_chat_service.hr_keywords.values() for keyword in keywords):
-                # This is an HR-related query, get relevant HR context
-                hr_data = await hr_chat_service.get_hr_context_for_chat(user_email, message)
-                hr_context_data = hr_chat_service.format_hr_data_for_context(hr_data.get('hr_data', {}))
-        except Exception as e:
-            # Log error but continue with regular processing
-            print(f"Error getting HR context: {str(e)}")
+    turn = await _prepare_chat_turn(request, user_email)
+    session_id = turn["session_id"]
+    route = turn["route"]
 
-    # 3️⃣ Build context and stream from OpenAI
-    recent_messages_db = db_get_chat_messages(session_id, user_id)
-    if recent_messages_db is None:
-        raise HTTPException(status_code=404, detail="Chat session not found or access denied")
-    openai_messages = []
-    
-    base_system_content = (
-        "You are an HR assistant for Othain, branded as \"Othain Self Service.\" "
-        "Answer questions about Othain's HR policies, benefits, leave, payroll, and other HR-related topics "
-        "based on the provided context. "
-        "If you don't know the answer or the information isn't in the context, say so politely and direct the user to contact hr@othainsoft.com. "
-        "Always refer to the company as \"Othain\" and never discuss other companies, products, or topics.\n\n"
-
-        "If the user asks about something the chatbot itself cannot directly resolve, you must:\n\n"
-        "1. **Classify the issue** into the single *most specific* category from the list below.  \n"
-        "2. **Respond** with the fallback template exactly as specified.\n\n"
-        "────────────────────────────────────────────────────────\n"
-            "CATEGORIES (pick one)                 \n"
-            "────────────────────────────────────────────────────────\n"
-            "• IT Requests  \n"
-            "• HR Requests  \n"
-            "• Payroll Requests  \n"
-            "• Operations  \n"
-            "• Accounts  \n"
-            "• AI Requests  \n"
-            "────────────────────────────────────────────────────────\n"
-            "RESPONSE FORMAT (**exactly**)                          \n"
-            "────────────────────────────────────────────────────────\n"
-            "🚩 Ticket type: <Category>\n\n"
-            "<Rotating opener from the list below, restating **only** the key issue>\n\n"
-            "Don’t worry, our support heroes are standing by!\n\n"
-            "👉 Create a ticket so they can dive in right away.\n"
-            "────────────────────────────────────────────────────────\n"
-            "APPROVED ROTATING OPENERS (use in this order, then loop)\n"
-            "────────────────────────────────────────────────────────\n"
-            "1. 😣 Oh no, that **<issue>** is a pain.  \n"
-            "2. 😣 Oh no—**<issue>** is the worst.  \n"
-            "3. 😭 Bummer, that **<issue>** sounds rough.  \n"
-            "4. 🤔 Uh-oh, that **<issue>** must be annoying.  \n"
-            "5. 😟 Yikes, **<issue>** must be so frustrating.  \n"
-            "6. 😟 That **<issue>** is tough—sorry you're experiencing it.  \n\n"
-            "────────────────────────────────────────────────────────\n"
-            "NOTES\n"
-            "────────────────────────────────────────────────────────\n"
-            "• Never add extra text before or after the format; our code appends the ticket-creation link.  \n"
-            "• Replace **<issue>** with a concise noun-phrase (“blue-screen”, “benefits inquiry”, etc.).  \n"
-            "• Cycle through the six openers in order; do not invent new ones.  \n"
-            "• If the user’s question is covered by built-in knowledge, answer normally—only invoke this fallback when escalation is needed.\n"
-            
-            "Othain Cab Service FAQ (handle directly; do NOT trigger fallback):\n"
-            "• Othain Cab Service lets employees schedule a cab to and from work.\n"
-            "• Book a cab via the Book A Cab page by selecting a pickup time and location. You must book a cab at least 3 hours in advance.\n"
-            "• The service is available to all Othain employees.\n"
-    )
-    
-    # Enhance system message with HR context if available
-    if hr_context_data:
-        system_content = hr_chat_service.enhance_system_message_with_hr_context(base_system_content, hr_context_data)
-    else:
-        system_content = base_system_content
-    
-    system_message = {
-        "role": "system",
-        "content": system_content
-    }
-    openai_messages.append(system_message)
-    context = get_relevant_context(message)
-    if context:
-        openai_messages.append({"role": "system", "content": context})
-    history_limit = 10
-    for msg in recent_messages_db[-history_limit:]:
-        openai_messages.append({"role": msg['role'], "content": msg['content']})
-    if not openai_messages or openai_messages[-1]['content'] != message:
-        openai_messages.append({"role": "user", "content": message})
+    if turn["template_response"] is not None:
+        yield turn["template_response"]
+        db_add_chat_message(session_id, "assistant", turn["template_response"], user_email=user_email)
+        return
 
     full_response = ""
-    async for chunk in get_chat_completion_stream(openai_messages):
-        full_response += chunk
-        yield chunk
-
-    # 4️⃣ Log the full assistant response after streaming finishes
+    try:
+        async for chunk in get_chat_completion_stream(turn["openai_messages"], model=route.model):
+            full_response += chunk
+            yield chunk
+    except LLMError as e:
+        print(f"LLM stream failed for session {session_id}: {e}")
+        if not full_response:
+            yield LLM_FALLBACK_MESSAGE
+            return
+        # Partial answer already streamed; keep what we have and tell the user it was cut off
+        yield "\n\n(Response interrupted. Please try again.)"
+
+    # 5️⃣ Log the full assistant response after streaming finishes
     if full_response: # Avoid logging empty responses
         db_add_chat_message(session_id, "assistant", full_response, user_email=user_email)
     else:
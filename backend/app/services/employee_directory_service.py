@@ -0,0 +1,225 @@
+"""
+Employee Directory Service
+Email to Keka employee resolution over the synced keka_employees table, with
+a bounded in-memory LRU, negative caching and batch lookups
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Looks one email up in Keka when keka_employees doesn't have it
+EmployeeLookup = Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class EmployeeDirectoryService:
+    """
+    The one place emails are resolved to Keka employees.
+
+    Lookups go LRU -> keka_employees -> Keka API. Rows are cached for a
+    short TTL so other workers' writes show up without coordination; emails
+    that resolve to nobody are cached for a shorter one so repeated
+    lookups for non-employees don't each cost a Keka call. Concurrent
+    lookups for the same email share one query. Anything that writes
+    keka_employees calls invalidate() so the next read sees the change.
+    """
+
+    def __init__(self):
+        self.max_entries = int(os.getenv("EMPLOYEE_DIRECTORY_MAX_ENTRIES", "5000"))
+        self.ttl = float(os.getenv("EMPLOYEE_DIRECTORY_TTL", "900"))
+        self.negative_ttl = float(os.getenv("EMPLOYEE_DIRECTORY_NEGATIVE_TTL", "300"))
+        # Fall back to hris/employees?email= for emails missing from keka_employees
+        self.api_fallback = os.getenv("EMPLOYEE_DIRECTORY_API_FALLBACK", "true").lower() == "true"
+
+        # email -> (expires_at, keka_employees row or None for a known miss)
+        self._entries: "OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.stats = {"hits": 0, "negative_hits": 0, "db_loads": 0, "api_loads": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalize(email: str) -> str:
+        return (email or "").strip().lower()
+
+    async def get_employee(
+        self, email: str, lookup: Optional[EmployeeLookup] = None, fetch_missing: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """The keka_employees row for an email, or None"""
+        return (await self.get_many([email], lookup, fetch_missing)).get(self._normalize(email))
+
+    async def resolve(self, email: str, lookup: Optional[EmployeeLookup] = None) -> Optional[str]:
+        """The Keka employee ID for an email, or None"""
+        employee = await self.get_employee(email, lookup)
+        return employee.get("keka_employee_id") if employee else None
+
+    async def resolve_many(self, emails: Iterable[str], lookup: Optional[EmployeeLookup] = None) -> Dict[str, Optional[str]]:
+        """Keka employee IDs for several emails at once, keyed by normalized email"""
+        employees = await self.get_many(emails, lookup)
+        return {email: (employee.get("keka_employee_id") if employee else None) for email, employee in employees.items()}
+
+    async def get_many(
+        self, emails: Iterable[str], lookup: Optional[EmployeeLookup] = None, fetch_missing: bool = True
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        keka_employees rows for several emails, keyed by normalized email.
+        With fetch_missing=False only the table is consulted and misses are
+        not remembered, so a later caller that allows the API isn't refused.
+        `lookup` replaces the default Keka search (e.g. to use a user's token).
+        """
+        results: Dict[str, Optional[Dict[str, Any]]] = {}
+        misses: List[str] = []
+        waiting: Dict[str, asyncio.Future] = {}
+        # Keka keeps an email's original case, so the table is matched on what callers passed too
+        spellings: Dict[str, Set[str]] = {}
+        for raw in emails:
+            if raw:
+                spellings.setdefault(self._normalize(raw), set()).add(raw.strip())
+        now = time.monotonic()
+
+        for email in spellings:
+            entry = self._entries.get(email)
+            if entry is not None and entry[0] > now and (entry[1] is not None or fetch_missing):
+                self._entries.move_to_end(email)
+                self.stats["hits" if entry[1] is not None else "negative_hits"] += 1
+                results[email] = entry[1]
+            elif fetch_missing and email in self._inflight:
+                waiting[email] = self._inflight[email]
+            else:
+                misses.append(email)
+
+        if misses:
+            future = asyncio.ensure_future(self._load(misses, spellings, lookup, fetch_missing))
+            if fetch_missing:
+                for email in misses:
+                    self._inflight[email] = future
+            try:
+                # Shield so one caller going away doesn't cancel the load for the others
+                results.update(await asyncio.shield(future))
+            finally:
+                for email in misses:
+                    if self._inflight.get(email) is future:
+                        del self._inflight[email]
+
+        for email, future in waiting.items():
+            results[email] = (await asyncio.shield(future)).get(email)
+        return results
+
+    async def _load(
+        self, emails: List[str], spellings: Dict[str, Set[str]], lookup: Optional[EmployeeLookup], fetch_missing: bool
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        db_ok = True
+        try:
+            found = await self._load_from_db(emails + [raw for email in emails for raw in spellings.get(email, ())])
+            self.stats["db_loads"] += 1
+        except Exception as e:
+            logger.warning(f"Employee directory could not read keka_employees: {str(e)}")
+            found, db_ok = {}, False
+
+        unknown: Set[str] = set()
+        missing = [email for email in emails if email not in found]
+        if missing and fetch_missing and (self.api_fallback or lookup is not None):
+            fetched, unknown = await self._load_from_api(missing, lookup)
+            found.update(fetched)
+
+        results = {email: found.get(email) for email in emails}
+        for email, employee in results.items():
+            # A miss is only trusted when the table could be read
+            if employee is not None or (fetch_missing and db_ok and email not in unknown):
+                self._remember(email, employee)
+        return results
+
+    async def _load_from_db(self, emails: List[str]) -> Dict[str, Dict[str, Any]]:
+        from app.utils.supabase_client import supabase_admin_client
+
+        candidates = list(dict.fromkeys(emails))
+        response = await asyncio.get_running_loop().run_in_executor(
+            None,
+            lambda: supabase_admin_client.table("keka_employees").select("*").in_("email", candidates).execute()
+        )
+        rows: Dict[str, Dict[str, Any]] = {}
+        for row in response.data or []:
+            email = self._normalize(row.get("email"))
+            # Prefer the active record when an email was reused
+            if email not in rows or row.get("account_status") == 1:
+                rows[email] = row
+        return rows
+
+    async def _load_from_api(
+        self, emails: List[str], lookup: Optional[EmployeeLookup]
+    ) -> Tuple[Dict[str, Dict[str, Any]], Set[str]]:
+        """Employees found in Keka, and the emails whose lookup failed"""
+        if lookup is None:
+            from app.services.keka_client import keka_client
+
+            async def lookup(email: str) -> Optional[Dict[str, Any]]:
+                return await keka_client.find_employee_by_email(email, timeout=30.0)
+
+        outcomes = await asyncio.gather(*(lookup(email) for email in emails), return_exceptions=True)
+        self.stats["api_loads"] += len(emails)
+        errors = {email: outcome for email, outcome in zip(emails, outcomes) if isinstance(outcome, Exception)}
+        if errors and len(errors) == len(emails):
+            # Nothing came back; let the caller see why
+            raise next(iter(errors.values()))
+        for email, error in errors.items():
+            logger.warning(f"Keka employee lookup for {email} failed: {str(error)}")
+
+        fetched = {
+            email: employee for email, employee in zip(emails, outcomes)
+            if email not in errors and employee and employee.get("id")
+        }
+        if not fetched:
+            return {}, set(errors)
+
+        # Store them so the next lookup (from any worker) is a table hit
+        try:
+            from app.services.keka_employee_sync_service import keka_employee_sync_service
+
+            await keka_employee_sync_service.apply_employee_changes(list(fetched.values()))
+            stored = await self._load_from_db(list(fetched) + [e.get("email") for e in fetched.values() if e.get("email")])
+        except Exception as e:
+            logger.warning(f"Failed to store employees fetched from Keka: {str(e)}")
+            stored = {}
+
+        # If the write failed, keep enough of a row for ID resolution
+        return {
+            email: stored.get(email) or {"keka_employee_id": employee["id"], "email": employee.get("email"), "raw_data": employee}
+            for email, employee in fetched.items()
+        }, set(errors)
+
+    def _remember(self, email: str, employee: Optional[Dict[str, Any]]) -> None:
+        ttl = self.ttl if employee is not None else self.negative_ttl
+        self._entries[email] = (time.monotonic() + ttl, employee)
+        self._entries.move_to_end(email)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, emails: Iterable[str] = (), employee_ids: Iterable[str] = ()) -> None:
+        """Forget the given emails and employee IDs; call after writing keka_employees"""
+        targets: Set[str] = {self._normalize(email) for email in emails if email}
+        ids = set(employee_ids)
+        if ids:
+            targets.update(
+                email for email, (_, employee) in self._entries.items()
+                if employee is not None and employee.get("keka_employee_id") in ids
+            )
+        for email in targets:
+            if self._entries.pop(email, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def invalidate_all(self) -> None:
+        """Forget everything, e.g. after a full employee sync"""
+        self.stats["invalidations"] += len(self._entries)
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for health endpoints"""
+        return {**self.stats, "entries": len(self._entries)}
+
+
+# Global instance
+employee_directory_service = EmployeeDirectoryService()
@@ -9,9 +9,23 @@ from typing import Dict, List, Any, Optional
 from datetime import datetime, date, timedelta
 from app.services.keka_mcp_service import keka_mcp_service
 from app.models.hr import HRChatContext, HRChatResponse
+from app.utils.keyword_matcher import KeywordMatcher
 
 logger = logging.getLogger(__name__)
 
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june',
+          'july', 'august', 'september', 'october', 'november', 'december']
+_MONTH_ALTERNATION = '|'.join(MONTHS)
+
+DATE_PATTERNS = [
+    re.compile(r'(\d{1,2})[/-](\d{1,2})[/-](\d{2,4})'),  # DD/MM/YYYY or DD-MM-YYYY
+    re.compile(rf'({_MONTH_ALTERNATION})\s+(\d{{1,2}})'),
+    re.compile(rf'(\d{{1,2}})\s+({_MONTH_ALTERNATION})'),
+]
+LEAVE_TYPE_PATTERN = re.compile(r'(vacation|sick|personal|emergency|casual|medical)')
+MONTH_PATTERN = re.compile(rf'({_MONTH_ALTERNATION})')
+YEAR_PATTERN = re.compile(r'20\d{2}')
+
 class HRChatService:
     """
     Service to handle HR-related chat queries and provide contextual responses
@@ -35,18 +49,41 @@ class HRChatService:
             'profile_info': r'(show|get|view).*(profile|personal|information)'
         }
 
+        # Precompiled matchers, built once per process
+        self._keyword_categories: Dict[str, List[str]] = {}
+        for category, keywords in self.hr_keywords.items():
+            for keyword in keywords:
+                self._keyword_categories.setdefault(keyword, []).append(category)
+        self._keyword_matcher = KeywordMatcher(self._keyword_categories.keys())
+
+        # One regex for all intents; each alternative is a lookahead anchored at the
+        # start, so the first intent (in priority order) that matches anywhere wins
+        self._intent_regex = re.compile(
+            r'\A(?:' + '|'.join(
+                rf'(?=[\s\S]*?(?P<{intent_key}>{pattern}))'
+                for intent_key, pattern in self.intent_patterns.items()
+            ) + r')'
+        )
+
     def detect_hr_query(self, message: str) -> HRChatContext:
         """
-        Analyze message to determine if it's HR-related and extract intent
+        Analyze message to determine if it's HR-related and extract intent.
+
+        One pass of the keyword automaton scores every category, one combined
+        regex picks the intent; query_type is 'general' when no keyword matched.
         """
         message_lower = message.lower()
         
-        # Determine query type based on keywords
+        # Score categories by distinct keywords found
+        category_scores = {category: 0 for category in self.hr_keywords}
+        for keyword in self._keyword_matcher.find_all(message_lower):
+            for category in self._keyword_categories[keyword]:
+                category_scores[category] += 1
+        
+        # Highest score wins; ties go to the category listed first
         query_type = 'general'
         max_matches = 0
-        
-        for category, keywords in self.hr_keywords.items():
-            matches = sum(1 for keyword in keywords if keyword in message_lower)
+        for category, matches in category_scores.items():
             if matches > max_matches:
                 max_matches = matches
                 query_type = category
@@ -55,10 +92,9 @@ class HRChatService:
         intent = None
         entities = {}
         
-        for intent_key, pattern in self.intent_patterns.items():
-            if re.search(pattern, message_lower):
-                intent = intent_key
-                break
+        intent_match = self._intent_regex.match(message_lower)
+        if intent_match:
+            intent = intent_match.lastgroup
         
         # Extract specific entities based on intent
         if intent:
@@ -68,7 +104,8 @@ class HRChatService:
             user_email="",  # Will be set by caller
             query_type=query_type,
             intent=intent,
-            entities=entities
+            entities=entities,
+            category_scores=category_scores
         )
 
     def _extract_entities(self, message: str, intent: str) -> Dict[str, Any]:
@@ -77,36 +114,24 @@ class HRChatService:
         
         if intent == 'apply_leave':
             # Extract dates if mentioned
-            date_patterns = [
-                r'(\d{1,2})[/-](\d{1,2})[/-](\d{2,4})',  # DD/MM/YYYY or DD-MM-YYYY
-                r'(january|february|march|april|may|june|july|august|september|october|november|december)\s+(\d{1,2})',
-                r'(\d{1,2})\s+(january|february|march|april|may|june|july|august|september|october|november|december)'
-            ]
-            
-            for pattern in date_patterns:
-                matches = re.findall(pattern, message)
+            for pattern in DATE_PATTERNS:
+                matches = pattern.findall(message)
                 if matches:
                     entities['dates_mentioned'] = matches
                     break
             
             # Extract leave type
-            leave_types = ['vacation', 'sick', 'personal', 'emergency', 'casual', 'medical']
-            for leave_type in leave_types:
-                if leave_type in message:
-                    entities['leave_type'] = leave_type
-                    break
+            leave_type_match = LEAVE_TYPE_PATTERN.search(message)
+            if leave_type_match:
+                entities['leave_type'] = leave_type_match.group(1)
         
         elif intent == 'view_payslip':
             # Extract month/year
-            months = ['january', 'february', 'march', 'april', 'may', 'june',
-                     'july', 'august', 'september', 'october', 'november', 'december']
+            month_match = MONTH_PATTERN.search(message)
+            if month_match:
+                entities['month'] = MONTHS.index(month_match.group(1)) + 1
             
-            for i, month in enumerate(months):
-                if month in message:
-                    entities['month'] = i + 1
-                    break
-            
-            year_match = re.search(r'20\d{2}', message)
+            year_match = YEAR_PATTERN.search(message)
             if year_match:
                 entities['year'] = int(year_match.group())
         
@@ -119,51 +144,49 @@ class HRChatService:
         
         return entities
 
-    async def get_hr_context_for_chat(self, user_email: str, query: str) -> Dict[str, Any]:
+    async def get_hr_context_for_chat(self, user_email: str, query: str, detected: Optional[HRChatContext] = None) -> Dict[str, Any]:
         """
-        Get relevant HR context data for chat response
+        Get relevant HR context data for chat response.
+        Pass `detected` to reuse a detect_hr_query result instead of re-scanning.
         """
-        context = HRChatContext(
-            user_email=user_email,
-            **self.detect_hr_query(query).__dict__
-        )
+        context = (detected or self.detect_hr_query(query)).model_copy(update={'user_email': user_email})
         
         hr_data = {}
         
         try:
-            # Set authenticated user
-            keka_mcp_service.set_authenticated_user(user_email)
+            # Request-scoped Keka service for this user
+            keka_service = keka_mcp_service.for_user(user_email)
             
             # Based on query type, fetch relevant data
             if context.query_type == 'profile' or context.intent == 'profile_info':
-                profile_result = await keka_mcp_service.get_my_profile()
+                profile_result = await keka_service.get_my_profile()
                 hr_data['profile'] = profile_result
             
             elif context.query_type == 'leave':
                 if context.intent == 'check_balance':
-                    balances_result = await keka_mcp_service.get_my_leave_balances()
+                    balances_result = await keka_service.get_my_leave_balances()
                     hr_data['leave_balances'] = balances_result
                 elif context.intent == 'apply_leave':
                     # Get leave types and balances for application context
-                    types_result = await keka_mcp_service.get_leave_types()
-                    balances_result = await keka_mcp_service.get_my_leave_balances()
+                    types_result = await keka_service.get_leave_types()
+                    balances_result = await keka_service.get_my_leave_balances()
                     hr_data['leave_types'] = types_result
                     hr_data['leave_balances'] = balances_result
                 else:
                     # Default: get balances and recent history
-                    balances_result = await keka_mcp_service.get_my_leave_balances()
-                    history_result = await keka_mcp_service.get_my_leave_history()
+                    balances_result = await keka_service.get_my_leave_balances()
+                    history_result = await keka_service.get_my_leave_history()
                     hr_data['leave_balances'] = balances_result
                     hr_data['leave_history'] = history_result[:5]  # Last 5 applications
             
             elif context.query_type == 'attendance':
                 if context.entities.get('period') == 'current_month':
-                    attendance_result = await keka_mcp_service.get_my_attendance(
+                    attendance_result = await keka_service.get_my_attendance(
                         date.today().replace(day=1), date.today()
                     )
                 else:
                     # Default to current month
-                    attendance_result = await keka_mcp_service.get_my_attendance(
+                    attendance_result = await keka_service.get_my_attendance(
                         date.today().replace(day=1), date.today()
                     )
                 hr_data['attendance'] = attendance_result
@@ -173,12 +196,12 @@ class HRChatService:
                 year = context.entities.get('year', date.today().year)
                 
                 try:
-                    payslip_result = await keka_mcp_service.get_my_payslip(month, year)
+                    payslip_result = await keka_service.get_my_payslip(month, year)
                     hr_data['payslip'] = payslip_result
                 except:
                     # Try latest payslip if specific month/year not available
                     try:
-                        payslip_result = await keka_mcp_service.get_my_payslip(
+                        payslip_result = await keka_service.get_my_payslip(
                             date.today().month, date.today().year
                         )
                         hr_data['payslip'] = payslip_result
@@ -186,13 +209,13 @@ class HRChatService:
                         pass  # No payslip available
             
             elif context.query_type == 'holidays':
-                holidays_result = await keka_mcp_service.get_upcoming_holidays()
+                holidays_result = await keka_service.get_upcoming_holidays()
                 hr_data['holidays'] = holidays_result
             
             # Always include basic profile for personalization
             if 'profile' not in hr_data:
                 try:
-                    profile_result = await keka_mcp_service.get_my_profile()
+                    profile_result = await keka_service.get_my_profile()
                     hr_data['profile_basic'] = profile_result
                 except:
                     pass
@@ -3,8 +3,8 @@ HR Data Service
 Provides HR data access using stored Keka employee data instead of OAuth
 """
 
+import copy
 import logging
-import requests
 import os
 from typing import List, Optional, Dict, Any
 from datetime import datetime, date, timedelta
@@ -14,7 +14,11 @@ from app.models.hr import (
     Payslip, Holiday, KekaMCPResponse, LeaveStatus
 )
 from app.utils.supabase_client import supabase_admin_client
-from app.services.keka_token_service import keka_token_service
+from app.services.keka_token_service import keka_token_service, KekaUserTokenProvider
+from app.services.keka_client import keka_client, KekaError
+from app.services.hr_read_cache_service import hr_read_cache_service
+from app.services.keka_db_cache_service import keka_db_cache_service
+from app.services.employee_directory_service import employee_directory_service
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -27,20 +31,21 @@ class HRDataService:
     def __init__(self):
         self.authenticated_user_email: Optional[str] = None
     
-    def set_authenticated_user(self, email: str) -> None:
-        """Set the authenticated user's email for this session"""
+    def for_user(self, email: str) -> "HRDataService":
+        """Return a request-scoped copy of this service bound to one user"""
         if not email or not self._is_valid_email(email):
             raise ValueError("Invalid email address")
         
-        self.authenticated_user_email = email
-        logger.info(f"Set authenticated user: {email}")
+        scoped = copy.copy(self)
+        scoped.authenticated_user_email = email
+        return scoped
     
     def _is_valid_email(self, email: str) -> bool:
         """Basic email validation"""
         return "@" in email and "." in email.split("@")[1]
     
-    async def _get_keka_headers(self) -> Dict[str, str]:
-        """Get Keka API headers with valid token"""
+    async def _get_keka_token_provider(self) -> KekaUserTokenProvider:
+        """Get a Keka token provider for the current user, checking they are connected"""
         if not self.authenticated_user_email:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -55,21 +60,19 @@ class HRDataService:
                 detail="Keka authentication required. Please connect your Keka account."
             )
         
-        return {
-            "accept": "application/json",
-            "authorization": f"Bearer {tokens.access_token}"
-        }
+        return KekaUserTokenProvider(self.authenticated_user_email, keka_token_service)
     
     async def _fetch_keka_leave_balance(self, employee_id: str) -> List[Dict[str, Any]]:
         """Fetch leave balance from Keka API"""
         try:
-            url = f"https://othainsoft.keka.com/api/v1/time/leavebalance?employeeIds={employee_id}"
-            headers = await self._get_keka_headers()
-            
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            data = await keka_client.request_json(
+                "GET",
+                "time/leavebalance",
+                params={"employeeIds": employee_id},
+                token_provider=await self._get_keka_token_provider(),
+                cache_scope=self.authenticated_user_email
+            )
             
-            data = response.json()
             if data.get("succeeded") and data.get("data"):
                 return data["data"][0]["leaveBalance"]  # Get the first employee's leave balance
             else:
@@ -81,23 +84,20 @@ class HRDataService:
             return []
     
     async def _fetch_keka_leave_requests(self, employee_id: str) -> List[Dict[str, Any]]:
-        """Fetch leave requests from Keka API"""
+        """Fetch leave requests from Keka API (all pages)"""
         try:
-            url = f"https://othainsoft.keka.com/api/v1/time/leaverequests?employeeIds={employee_id}"
-            headers = await self._get_keka_headers()
-            
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            leave_requests = await keka_client.get_all(
+                "time/leaverequests",
+                params={"employeeIds": employee_id},
+                token_provider=await self._get_keka_token_provider(),
+                cache_scope=self.authenticated_user_email
+            )
             
-            data = response.json()
-            logger.info(f"Keka leave requests API response: {data}")
-            if data.get("succeeded") and data.get("data"):
-                logger.info(f"Found {len(data['data'])} leave requests for employee {employee_id}")
-                logger.info(f"Pagination info: page {data.get('pageNumber', 1)} of {data.get('totalPages', 1)}, total records: {data.get('totalRecords', 0)}")
-                return data["data"]
+            if leave_requests:
+                logger.info(f"Found {len(leave_requests)} leave requests for employee {employee_id}")
             else:
                 logger.warning(f"No leave requests found for employee {employee_id}")
-                return []
+            return leave_requests
                 
         except Exception as e:
             logger.error(f"Failed to fetch leave requests from Keka API: {str(e)}")
@@ -106,13 +106,13 @@ class HRDataService:
     async def _fetch_keka_leave_types(self) -> List[Dict[str, Any]]:
         """Fetch leave types from Keka API"""
         try:
-            url = "https://othainsoft.keka.com/api/v1/time/leavetypes"
-            headers = await self._get_keka_headers()
-            
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            data = await keka_client.request_json(
+                "GET",
+                "time/leavetypes",
+                token_provider=await self._get_keka_token_provider(),
+                cache_scope=self.authenticated_user_email
+            )
             
-            data = response.json()
             if data.get("succeeded") and data.get("data"):
                 return data["data"]
             else:
@@ -126,10 +126,6 @@ class HRDataService:
     async def _create_keka_leave_request(self, employee_id: str, leave_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a leave request in Keka API"""
         try:
-            url = "https://othainsoft.keka.com/api/v1/time/leaverequests"
-            headers = await self._get_keka_headers()
-            headers["content-type"] = "application/*+json"
-            
             # Prepare the request data according to Keka API format
             # Convert date strings to proper datetime format for Keka API
             from datetime import datetime
@@ -148,21 +144,18 @@ class HRDataService:
                 "note": leave_data.get("note", "")
             }
             
-            response = requests.post(url, headers=headers, json=request_data)
-            
-            # Log the request details for debugging
-            logger.info(f"Keka API Request URL: {url}")
-            logger.info(f"Keka API Request Headers: {headers}")
             logger.info(f"Keka API Request Data: {request_data}")
-            logger.info(f"Keka API Response Status: {response.status_code}")
-            logger.info(f"Keka API Response Text: {response.text}")
             
-            if response.status_code != 200:
-                error_detail = response.text
-                logger.error(f"Keka API Error {response.status_code}: {error_detail}")
-                return {"success": False, "error": f"Keka API Error {response.status_code}: {error_detail}"}
+            try:
+                data = await keka_client.apply_leave(
+                    request_data,
+                    token_provider=await self._get_keka_token_provider(),
+                    cache_scope=self.authenticated_user_email
+                )
+            except KekaError as e:
+                logger.error(f"Keka API Error {e.status_code}: {e.body}")
+                return {"success": False, "error": f"Keka API Error {e.status_code}: {e.body or str(e)}"}
             
-            data = response.json()
             if data.get("succeeded"):
                 return {"success": True, "data": data}
             else:
@@ -175,16 +168,15 @@ class HRDataService:
     async def _get_employee_by_email(self, email: str) -> Dict[str, Any]:
         """Get employee data by email"""
         try:
-            response = supabase_admin_client.table("keka_employees").select("*").eq("email", email).eq("account_status", 1).execute()
+            employee = await employee_directory_service.get_employee(email, fetch_missing=False)
             
-            if not response.data or len(response.data) == 0:
+            if not employee or employee.get("account_status") != 1:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Employee not found with email: {email}"
                 )
             
-            # Return the first matching employee
-            return response.data[0]
+            return employee
         except HTTPException:
             raise
         except Exception as e:
@@ -368,6 +360,8 @@ class HRDataService:
             
             # Create leave request in Keka API
             result = await self._create_keka_leave_request(employee_id, leave_data)
+            if result.get("success"):
+                hr_read_cache_service.invalidate_employee(employee_id)
             
             return result
             
@@ -490,21 +484,8 @@ class HRDataService:
             employee_data = await self._get_employee_by_email(self.authenticated_user_email)
             employee_id = employee_data["keka_employee_id"]
             
-            # Find payslip for the requested month/year
-            response = supabase_admin_client.table("keka_employee_payslips").select("*").eq("keka_employee_id", employee_id).execute()
-            
-            payslips = response.data
-            target_payslip = None
-            
-            for payslip in payslips:
-                if payslip.get("start_date"):
-                    try:
-                        start_date = datetime.fromisoformat(payslip["start_date"]).date()
-                        if start_date.month == month and start_date.year == year:
-                            target_payslip = payslip
-                            break
-                    except Exception:
-                        continue
+            # Look up the payslip for the requested month/year via the period index
+            target_payslip = await keka_db_cache_service.get_cached_payslip(employee_id, year, month)
             
             if not target_payslip:
                 raise HTTPException(
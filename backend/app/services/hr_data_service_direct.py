@@ -4,8 +4,10 @@ Uses direct Keka API calls with on-demand token generation
 No OAuth required
 """
 
+import os
+import copy
 import logging
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime, date, timedelta
 from fastapi import HTTPException, status
 
@@ -15,6 +17,8 @@ from app.models.hr import (
 )
 from app.services.keka_api_service import keka_api_service
 from app.services.keka_db_cache_service import keka_db_cache_service
+from app.services.hr_read_cache_service import hr_read_cache_service
+from app.services.employee_directory_service import employee_directory_service
 
 logger = logging.getLogger(__name__)
 
@@ -24,17 +28,17 @@ class HRDataServiceDirect:
     """
     
     def __init__(self):
+        # Only set on request-scoped copies from for_user()
         self.authenticated_user_email: Optional[str] = None
-        self.cached_employee_id: Optional[str] = None
     
-    def set_authenticated_user(self, email: str) -> None:
-        """Set the authenticated user's email for this session"""
+    def for_user(self, email: str) -> "HRDataServiceDirect":
+        """Return a request-scoped copy of this service bound to one user"""
         if not email or "@" not in email:
             raise ValueError("Invalid email address")
         
-        self.authenticated_user_email = email
-        self.cached_employee_id = None  # Reset cache
-        logger.info(f"Set authenticated user: {email}")
+        scoped = copy.copy(self)
+        scoped.authenticated_user_email = email
+        return scoped
     
     async def _get_employee_id(self) -> str:
         """Get employee ID for the authenticated user from DATABASE"""
@@ -44,26 +48,8 @@ class HRDataServiceDirect:
                 detail="User not authenticated"
             )
         
-        # Return cached ID if available
-        if self.cached_employee_id:
-            return self.cached_employee_id
-        
-        # ** NEW: Get from database first **
-        cache_service = keka_db_cache_service
-        if cache_service and cache_service.supabase:
-            try:
-                cached_employee = await cache_service.get_cached_employee_by_email(self.authenticated_user_email)
-                if cached_employee and cached_employee.get("keka_employee_id"):
-                    employee_id = cached_employee.get("keka_employee_id")
-                    logger.info(f"Found employee ID {employee_id} in database for {self.authenticated_user_email}")
-                    self.cached_employee_id = employee_id
-                    return employee_id
-            except Exception as e:
-                logger.warning(f"Failed to get employee ID from database: {str(e)}")
-        
-        # Fallback: Fetch employee ID from Keka API
-        logger.info(f"Employee not found in database, fetching from Keka API for {self.authenticated_user_email}")
-        employee_id = await keka_api_service.get_employee_id_from_email(self.authenticated_user_email)
+        # keka_employees through the shared directory, then the Keka API
+        employee_id = await employee_directory_service.resolve(self.authenticated_user_email)
         
         if not employee_id:
             raise HTTPException(
@@ -71,7 +57,6 @@ class HRDataServiceDirect:
                 detail=f"Employee not found with email: {self.authenticated_user_email}"
             )
         
-        self.cached_employee_id = employee_id
         return employee_id
     
     async def get_my_profile(self) -> EmployeeProfile:
@@ -88,7 +73,7 @@ class HRDataServiceDirect:
             cache_service = keka_db_cache_service
             if cache_service and cache_service.supabase:
                 try:
-                    cached_employee = await cache_service.get_cached_employee_by_email(self.authenticated_user_email)
+                    cached_employee = await employee_directory_service.get_employee(self.authenticated_user_email, fetch_missing=False)
                     if cached_employee:
                         logger.info(f"Found employee profile in DATABASE for {self.authenticated_user_email}")
                         
@@ -238,7 +223,7 @@ class HRDataServiceDirect:
             # Get employee data from DATABASE
             cache_service = keka_db_cache_service
             if cache_service and cache_service.supabase:
-                cached_employee = await cache_service.get_cached_employee_by_email(self.authenticated_user_email)
+                cached_employee = await employee_directory_service.get_employee(self.authenticated_user_email, fetch_missing=False)
                 if cached_employee:
                     logger.info(f"Returning raw employee data from DATABASE for {self.authenticated_user_email}")
                     # Return the raw database record with all fields
@@ -274,39 +259,19 @@ class HRDataServiceDirect:
         """Get leave balances"""
         try:
             employee_id = await self._get_employee_id()
-            balance_data = await keka_api_service.get_leave_balance(employee_id)
+            balances = await hr_read_cache_service.get(
+                "leave_balances",
+                employee_id,
+                fetch=lambda: self._fetch_leave_balances(employee_id),
+                load_from_db=lambda: self._load_leave_balances_from_db(employee_id)
+            )
             
-            if not balance_data:
+            if not balances:
                 return []
             
-            # Extract leave balances from response
-            balances = []
-            leave_balance_list = balance_data.get("data", [])
-            
-            if isinstance(leave_balance_list, list) and len(leave_balance_list) > 0:
-                employee_balances = leave_balance_list[0].get("leaveBalance", [])
-                
-                for balance in employee_balances:
-                    # Get leave type name - Keka API returns it as 'leaveTypeName' (flat string)
-                    leave_type_name = balance.get("leaveTypeName", "Unknown")
-                    
-                    # Skip if filtering by leave type
-                    if leave_type and leave_type_name != leave_type:
-                        continue
-                    
-                    # Skip leave types with no annual quota (like Unpaid Leave with -1)
-                    annual_quota = float(balance.get("annualQuota", 0))
-                    if annual_quota <= 0:
-                        continue
-                    
-                    balances.append(LeaveBalance(
-                        leave_type=leave_type_name,
-                        total_allocated=annual_quota,
-                        used=float(balance.get("consumedAmount", 0)),
-                        remaining=float(balance.get("availableBalance", 0)),
-                        carry_forward=float(balance.get("accruedAmount", 0)) - float(balance.get("consumedAmount", 0)) if balance.get("accruedAmount", 0) > balance.get("consumedAmount", 0) else 0.0
-                    ))
-            
+            # Skip if filtering by leave type
+            if leave_type:
+                return [balance for balance in balances if balance.leave_type == leave_type]
             return balances
             
         except HTTPException:
@@ -318,16 +283,87 @@ class HRDataServiceDirect:
                 detail=f"Failed to retrieve leave balances: {str(e)}"
             )
     
+    async def _fetch_leave_balances(self, employee_id: str) -> Optional[List[LeaveBalance]]:
+        """Fetch leave balances from the Keka API"""
+        balance_data = await keka_api_service.get_leave_balance(employee_id)
+        
+        if not balance_data:
+            return None
+        
+        # Extract leave balances from response
+        balances = []
+        leave_balance_list = balance_data.get("data", [])
+        
+        if isinstance(leave_balance_list, list) and len(leave_balance_list) > 0:
+            employee_balances = leave_balance_list[0].get("leaveBalance", [])
+            
+            for balance in employee_balances:
+                # Get leave type name - Keka API returns it as 'leaveTypeName' (flat string)
+                leave_type_name = balance.get("leaveTypeName", "Unknown")
+                
+                # Skip leave types with no annual quota (like Unpaid Leave with -1)
+                annual_quota = float(balance.get("annualQuota", 0))
+                if annual_quota <= 0:
+                    continue
+                
+                balances.append(LeaveBalance(
+                    leave_type=leave_type_name,
+                    total_allocated=annual_quota,
+                    used=float(balance.get("consumedAmount", 0)),
+                    remaining=float(balance.get("availableBalance", 0)),
+                    carry_forward=float(balance.get("accruedAmount", 0)) - float(balance.get("consumedAmount", 0)) if balance.get("accruedAmount", 0) > balance.get("consumedAmount", 0) else 0.0
+                ))
+        
+        return balances
+    
+    async def _load_leave_balances_from_db(self, employee_id: str) -> Optional[Tuple[List[LeaveBalance], Optional[datetime]]]:
+        """Load leave balances from the keka_employee_leave_balances sync table"""
+        if not keka_db_cache_service.supabase:
+            return None
+        
+        rows = await keka_db_cache_service.get_cached_leave_balances(employee_id)
+        if not rows:
+            return None
+        
+        balances = [
+            LeaveBalance(
+                leave_type=row.get("leave_type") or "Unknown",
+                total_allocated=float(row.get("total_allocated") or 0),
+                used=float(row.get("used") or 0),
+                remaining=float(row.get("remaining") or 0),
+                carry_forward=float(row.get("carry_forward") or 0)
+            )
+            for row in rows
+            if float(row.get("total_allocated") or 0) > 0
+        ]
+        return balances, self._oldest_sync_time(rows)
+    
+    @staticmethod
+    def _oldest_sync_time(rows: List[Dict[str, Any]]) -> Optional[datetime]:
+        """Oldest last_synced_at across sync-table rows"""
+        synced = []
+        for row in rows:
+            try:
+                synced.append(datetime.fromisoformat(str(row.get("last_synced_at")).replace("Z", "+00:00")))
+            except (TypeError, ValueError):
+                return None
+        return min(synced) if synced else None
+    
+    async def _get_leave_requests(self, employee_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Leave requests from Keka, shared by the requests and history views"""
+        async def fetch():
+            requests_data = await keka_api_service.get_leave_requests(employee_id)
+            if not requests_data or "data" not in requests_data:
+                return None
+            return requests_data.get("data", [])
+        
+        return await hr_read_cache_service.get("leave_requests", employee_id, fetch=fetch)
+    
     async def get_my_leave_requests(self) -> List[Dict[str, Any]]:
         """Get leave requests"""
         try:
             employee_id = await self._get_employee_id()
-            requests_data = await keka_api_service.get_leave_requests(employee_id)
-            
-            if not requests_data:
-                return []
-            
-            return requests_data.get("data", [])
+            return await self._get_leave_requests(employee_id) or []
             
         except HTTPException:
             raise
@@ -354,14 +390,14 @@ class HRDataServiceDirect:
                 from_date = to_date - timedelta(days=180)
             
             # Get leave requests from Keka API (which includes history)
-            requests_data = await keka_api_service.get_leave_requests(employee_id)
+            leave_requests = await self._get_leave_requests(employee_id)
             
-            if not requests_data or "data" not in requests_data:
+            if not leave_requests:
                 return []
             
             # Transform to LeaveHistory format
             history = []
-            for req in requests_data.get("data", []):
+            for req in leave_requests:
                 try:
                     # Parse dates
                     req_from_date = datetime.fromisoformat(req.get("fromDate", "").replace("Z", "+00:00")).date()
@@ -418,7 +454,9 @@ class HRDataServiceDirect:
     async def get_leave_types(self) -> List[Dict[str, Any]]:
         """Get all leave types"""
         try:
-            types_data = await keka_api_service.get_leave_types()
+            types_data = await hr_read_cache_service.get(
+                "leave_types", "all", fetch=keka_api_service.get_leave_types
+            )
             
             if not types_data:
                 logger.warning("No leave types data received from Keka API")
@@ -454,6 +492,8 @@ class HRDataServiceDirect:
                     detail="Failed to apply for leave"
                 )
             
+            # Balances and requests changed; the next read must go to Keka
+            hr_read_cache_service.invalidate_employee(employee_id)
             return result
             
         except HTTPException:
@@ -469,7 +509,11 @@ class HRDataServiceDirect:
         """Get attendance records"""
         try:
             employee_id = await self._get_employee_id()
-            attendance_data = await keka_api_service.get_attendance(employee_id, from_date, to_date)
+            attendance_data = await hr_read_cache_service.get(
+                "attendance",
+                f"{employee_id}:{from_date}:{to_date}",
+                fetch=lambda: keka_api_service.get_attendance(employee_id, from_date, to_date)
+            )
             
             if not attendance_data:
                 return []
@@ -504,12 +548,12 @@ class HRDataServiceDirect:
     async def get_holidays(self, year: int = None) -> List[Dict[str, Any]]:
         """Get company holidays"""
         try:
-            holidays_data = await keka_api_service.get_holidays(year)
-            
-            if not holidays_data:
-                return []
-            
-            return holidays_data.get("data", [])
+            return await hr_read_cache_service.get(
+                "holidays",
+                str(year or "current"),
+                fetch=lambda: self._fetch_holidays(year),
+                load_from_db=(lambda: self._load_holidays_from_db(year)) if year else None
+            ) or []
             
         except Exception as e:
             logger.error(f"Failed to get holidays: {str(e)}")
@@ -518,6 +562,36 @@ class HRDataServiceDirect:
                 detail=f"Failed to retrieve holidays: {str(e)}"
             )
     
+    async def _fetch_holidays(self, year: Optional[int]) -> Optional[List[Dict[str, Any]]]:
+        """Fetch holidays from the Keka API"""
+        holidays_data = await keka_api_service.get_holidays(year)
+        if not holidays_data:
+            return None
+        return holidays_data.get("data", [])
+    
+    async def _load_holidays_from_db(self, year: int) -> Optional[Tuple[List[Dict[str, Any]], Optional[datetime]]]:
+        """Load holidays from the keka_company_holidays sync table in the API's shape"""
+        if not keka_db_cache_service.supabase:
+            return None
+        
+        rows = await keka_db_cache_service.get_cached_holidays(year=year)
+        calendar_id = os.getenv("KEKA_CALENDAR_ID")
+        if calendar_id:
+            rows = [row for row in rows if row.get("calendar_id") == calendar_id]
+        if not rows:
+            return None
+        
+        holidays = [
+            {
+                "date": row.get("holiday_date"),
+                "name": row.get("name"),
+                "type": row.get("type", "company"),
+                "isOptional": row.get("is_optional", False)
+            }
+            for row in rows
+        ]
+        return holidays, self._oldest_sync_time(rows)
+    
     async def get_upcoming_holidays(self) -> List[Dict[str, Any]]:
         """Get upcoming holidays"""
         try:
@@ -538,11 +612,66 @@ class HRDataServiceDirect:
                 detail=f"Failed to retrieve upcoming holidays: {str(e)}"
             )
     
+    async def _get_indexed_payslip(self, employee_id: str, month: int, year: int) -> Optional[Dict[str, Any]]:
+        """Synced payslip for (employee, period) from keka_employee_payslips"""
+        return await hr_read_cache_service.get(
+            "payslip",
+            f"{employee_id}:{year}-{month:02d}",
+            fetch=lambda: keka_db_cache_service.get_cached_payslip(employee_id, year, month)
+        )
+    
+    async def get_my_payslip(self, month: int, year: int) -> Payslip:
+        """Get payslip for a specific month from the synced payslip index"""
+        try:
+            employee_id = await self._get_employee_id()
+            payslip = await self._get_indexed_payslip(employee_id, month, year)
+            
+            if not payslip:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Payslip not found for {month}/{year}"
+                )
+            
+            gross = float(payslip.get("gross_amount") or 0)
+            net = float(payslip.get("net_amount") or 0)
+            return Payslip(
+                employee_id=employee_id,
+                month=month,
+                year=year,
+                pay_period=payslip.get("pay_period") or "",
+                gross_salary=gross,
+                net_salary=net,
+                total_deductions=gross - net,
+                earnings=payslip.get("earnings") or [],
+                deductions=payslip.get("deductions") or [],
+                ytd_gross=None,  # Not available in pay register
+                ytd_net=None     # Not available in pay register
+            )
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to get payslip: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to retrieve payslip: {str(e)}"
+            )
+    
     async def get_payslip(self, month: int, year: int) -> Optional[Dict[str, Any]]:
         """Get payslip for a specific month"""
         try:
             employee_id = await self._get_employee_id()
-            salary_data = await keka_api_service.get_payroll_salaries(employee_id)
+            
+            # Synced pay register row for this period, if the payroll sync has run
+            payslip = await self._get_indexed_payslip(employee_id, month, year)
+            if payslip:
+                return payslip
+            
+            salary_data = await hr_read_cache_service.get(
+                "payslip",
+                employee_id,
+                fetch=lambda: keka_api_service.get_payroll_salaries(employee_id)
+            )
             
             if not salary_data:
                 return None
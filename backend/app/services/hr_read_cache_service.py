@@ -0,0 +1,191 @@
+"""
+HR Read-Through Cache Service
+Tiered reads for per-user HR data: in-process LRU, then the Keka sync
+tables, then the Keka API, with per-type TTLs and stale-while-revalidate
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds an entry is fresh, per data type. Overridable with HR_CACHE_TTL_<TYPE>.
+DEFAULT_TTLS: Dict[str, int] = {
+    "leave_balances": 300,
+    "leave_requests": 120,
+    "attendance": 600,
+    "leave_types": 86400,
+    "holidays": 86400,
+    "payslip": 86400,
+}
+
+# (value, synced_at) from the Postgres sync tables, or None on a miss
+DBLoader = Callable[[], Awaitable[Optional[Tuple[Any, Optional[datetime]]]]]
+
+
+class HRReadCacheService:
+    """
+    Read-through cache in front of the Keka API.
+
+    A fresh entry is returned as is. A stale one (older than its TTL but
+    inside the stale window) is returned immediately while one background
+    task per key refetches it. On a miss the sync tables are tried before
+    the API; rows written before the key was last invalidated are ignored.
+    """
+
+    def __init__(self):
+        self.max_entries = int(os.getenv("HR_CACHE_MAX_ENTRIES", "5000"))
+        # Stale entries are served for up to TTL * multiplier
+        self.stale_multiplier = float(os.getenv("HR_CACHE_STALE_MULTIPLIER", "12"))
+        self.ttls = {
+            data_type: int(os.getenv(f"HR_CACHE_TTL_{data_type.upper()}", str(ttl)))
+            for data_type, ttl in DEFAULT_TTLS.items()
+        }
+
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self._invalidated_at: Dict[Tuple[str, str], float] = {}
+        self._refreshing: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._background_tasks: Set[asyncio.Task] = set()
+
+        self.stats = {"fresh_hits": 0, "stale_hits": 0, "db_hits": 0, "api_loads": 0, "refreshes": 0, "refresh_failures": 0}
+
+    def _ttl(self, data_type: str) -> float:
+        return self.ttls.get(data_type, 300)
+
+    async def get(
+        self,
+        data_type: str,
+        key: str,
+        fetch: Callable[[], Awaitable[Any]],
+        load_from_db: Optional[DBLoader] = None,
+    ) -> Any:
+        """
+        Return the cached value for (data_type, key), loading it through the tiers.
+        `fetch` hits the Keka API; a None result is never cached.
+        """
+        cache_key = (data_type, key)
+        ttl = self._ttl(data_type)
+        now = time.time()
+
+        entry = self._entries.get(cache_key)
+        if entry is not None:
+            stored_at, value = entry
+            age = now - stored_at
+            if age < ttl:
+                self._entries.move_to_end(cache_key)
+                self.stats["fresh_hits"] += 1
+                return value
+            if age < ttl * self.stale_multiplier:
+                self._entries.move_to_end(cache_key)
+                self.stats["stale_hits"] += 1
+                self._refresh_in_background(cache_key, fetch)
+                return value
+
+        if load_from_db is not None:
+            db_result = await self._load_from_db(cache_key, load_from_db)
+            if db_result is not None:
+                value, synced_at = db_result
+                self.stats["db_hits"] += 1
+                self._store(cache_key, value, synced_at)
+                if now - synced_at >= ttl:
+                    self._refresh_in_background(cache_key, fetch)
+                return value
+
+        self.stats["api_loads"] += 1
+        value = await fetch()
+        if value is not None:
+            self._store(cache_key, value, now)
+        return value
+
+    async def _load_from_db(self, cache_key: Tuple[str, str], load_from_db: DBLoader) -> Optional[Tuple[Any, float]]:
+        try:
+            result = await load_from_db()
+        except Exception as e:
+            logger.warning(f"HR cache DB tier failed for {cache_key[0]}: {str(e)}")
+            return None
+        if not result or not result[0]:
+            return None
+
+        value, synced_at = result
+        synced_ts = self._to_timestamp(synced_at)
+        # Rows synced before an invalidation (e.g. a leave application) are out of date
+        if synced_ts <= self._invalidated_at.get(cache_key, 0.0):
+            return None
+        return value, synced_ts
+
+    @staticmethod
+    def _to_timestamp(synced_at: Optional[datetime]) -> float:
+        if synced_at is None:
+            return 0.0
+        if synced_at.tzinfo is None:
+            synced_at = synced_at.replace(tzinfo=timezone.utc)
+        return synced_at.timestamp()
+
+    def _store(self, cache_key: Tuple[str, str], value: Any, stored_at: float) -> None:
+        self._entries[cache_key] = (stored_at, value)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _refresh_in_background(self, cache_key: Tuple[str, str], fetch: Callable[[], Awaitable[Any]]) -> None:
+        task = self._refreshing.get(cache_key)
+        if task is not None and not task.done():
+            return
+
+        async def _refresh():
+            started = time.time()
+            try:
+                value = await fetch()
+                if value is None:
+                    self.stats["refresh_failures"] += 1
+                    return
+                # Don't resurrect a value that was invalidated mid-refresh
+                if self._invalidated_at.get(cache_key, 0.0) < started:
+                    self._store(cache_key, value, time.time())
+                    self.stats["refreshes"] += 1
+            except Exception as e:
+                self.stats["refresh_failures"] += 1
+                logger.warning(f"Background refresh of {cache_key[0]} failed: {str(e)}")
+            finally:
+                self._refreshing.pop(cache_key, None)
+
+        task = asyncio.ensure_future(_refresh())
+        self._refreshing[cache_key] = task
+        # Hold a reference so the task isn't garbage collected mid-flight
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def invalidate(self, data_type: str, key: Optional[str] = None) -> None:
+        """Drop one key, or every key of a data type, and skip older DB rows for it"""
+        now = time.time()
+        for cache_key in list(self._entries):
+            if cache_key[0] == data_type and (key is None or cache_key[1] == key):
+                del self._entries[cache_key]
+        if key is not None:
+            self._invalidated_at[(data_type, key)] = now
+
+    def invalidate_employee(self, employee_id: str, data_types: Tuple[str, ...] = ("leave_balances", "leave_requests")) -> None:
+        """Invalidate an employee's entries after a write such as a leave application"""
+        for data_type in data_types:
+            self.invalidate(data_type, employee_id)
+            # Attendance and similar keys are scoped by employee plus a range
+            for cache_key in [k for k in self._entries if k[0] == data_type and k[1].startswith(f"{employee_id}:")]:
+                del self._entries[cache_key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for health endpoints"""
+        lookups = self.stats["fresh_hits"] + self.stats["stale_hits"] + self.stats["db_hits"] + self.stats["api_loads"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "api_load_rate": round(self.stats["api_loads"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Global instance
+hr_read_cache_service = HRReadCacheService()
@@ -7,27 +7,12 @@ No OAuth flow required
 import logging
 import os
 from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
-import httpx
-from app.utils.supabase_client import supabase_admin_client
+from app.services.keka_api_token_manager import keka_api_token_manager
+from app.services.keka_client import keka_client
+from app.services.employee_directory_service import employee_directory_service
 
 logger = logging.getLogger(__name__)
 
-# Import cache service (will be initialized after this module)
-_cache_service = None
-
-def get_cache_service():
-    """Lazy load cache service to avoid circular imports"""
-    global _cache_service
-    if _cache_service is None:
-        try:
-            from app.services.keka_db_cache_service import keka_db_cache_service
-            _cache_service = keka_db_cache_service
-        except Exception as e:
-            logger.warning(f"Cache service not available: {e}")
-            _cache_service = False
-    return _cache_service if _cache_service is not False else None
-
 class KekaAPIService:
     """
     Direct Keka API service using API key authentication
@@ -54,48 +39,14 @@ class KekaAPIService:
     
     async def generate_access_token(self) -> Optional[str]:
         """
-        Generate a fresh access token using API credentials
-        This token is NOT cached and should be generated for each session
+        Get an access token for the kekaapi grant.
+        Served from the process-wide token cache; only hits login.keka.com
+        when the cached token is missing or about to expire.
         
         Returns:
             Access token string or None if failed
         """
-        try:
-            if not all([self.client_id, self.client_secret, self.api_key]):
-                logger.error("Keka API credentials not configured in environment")
-                return None
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.token_endpoint,
-                    data={
-                        "grant_type": "kekaapi",
-                        "scope": "kekaapi",
-                        "client_id": self.client_id,
-                        "client_secret": self.client_secret,
-                        "api_key": self.api_key
-                    },
-                    headers={
-                        "accept": "application/json",
-                        "content-type": "application/x-www-form-urlencoded"
-                    },
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    token_data = response.json()
-                    access_token = token_data.get("access_token")
-                    expires_in = token_data.get("expires_in", 3600)
-                    
-                    logger.info(f"Successfully generated Keka access token (expires in {expires_in}s)")
-                    return access_token
-                else:
-                    logger.error(f"Failed to generate token: {response.status_code} - {response.text}")
-                    return None
-                    
-        except Exception as e:
-            logger.error(f"Exception generating Keka token: {str(e)}")
-            return None
+        return await keka_api_token_manager.get_token()
     
     async def get_employee_by_id(self, employee_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -108,27 +59,11 @@ class KekaAPIService:
             Employee data dict or None
         """
         try:
-            access_token = await self.generate_access_token()
-            if not access_token:
-                return None
-            
-            url = f"{self.api_base_url}/hris/employees/{employee_id}"
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "accept": "application/json"
-                    },
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    logger.error(f"Failed to get employee: {response.status_code} - {response.text}")
-                    return None
+            return await keka_client.request_json(
+                "GET",
+                f"hris/employees/{employee_id}",
+                timeout=30.0
+            )
                     
         except Exception as e:
             logger.error(f"Exception getting employee {employee_id}: {str(e)}")
@@ -137,7 +72,7 @@ class KekaAPIService:
     async def get_employee_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         """
         Get employee data by email
-        Checks cache first, then fetches from API if needed
+        Resolved through the employee directory (keka_employees, then the API)
         
         Args:
             email: Employee email address
@@ -146,61 +81,11 @@ class KekaAPIService:
             Employee data dict or None
         """
         try:
-            # Try to get from cache first
-            cache_service = get_cache_service()
-            if cache_service:
-                cached_employee = await cache_service.get_cached_employee_by_email(email)
-                if cached_employee:
-                    # Check if cache is fresh (less than 24 hours old)
-                    last_synced = cached_employee.get("last_synced_at")
-                    if last_synced:
-                        try:
-                            last_synced_dt = datetime.fromisoformat(last_synced.replace("Z", "+00:00"))
-                            if (datetime.now() - last_synced_dt).total_seconds() < 86400:  # 24 hours
-                                logger.info(f"Using cached employee data for {email}")
-                                return cached_employee.get("raw_data", {})
-                        except:
-                            pass
-            
-            # Fetch from API
-            access_token = await self.generate_access_token()
-            if not access_token:
+            employee = await employee_directory_service.get_employee(email)
+            if not employee:
+                logger.warning(f"No employee found with email: {email}")
                 return None
-            
-            url = f"{self.api_base_url}/hris/employees"
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "accept": "application/json"
-                    },
-                    params={"email": email},
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    employees = data if isinstance(data, list) else data.get('data', [])
-                    
-                    if employees and len(employees) > 0:
-                        employee_data = employees[0]
-                        
-                        # Cache the employee data
-                        if cache_service:
-                            try:
-                                await cache_service.cache_employee_data(employee_data)
-                            except Exception as cache_error:
-                                logger.warning(f"Failed to cache employee data: {cache_error}")
-                        
-                        return employee_data
-                    else:
-                        logger.warning(f"No employee found with email: {email}")
-                        return None
-                else:
-                    logger.error(f"Failed to search employees: {response.status_code} - {response.text}")
-                    return None
+            return employee.get("raw_data") or employee
                     
         except Exception as e:
             logger.error(f"Exception searching for employee {email}: {str(e)}")
@@ -217,28 +102,12 @@ class KekaAPIService:
             Leave balance data or None
         """
         try:
-            access_token = await self.generate_access_token()
-            if not access_token:
-                return None
-            
-            url = f"{self.api_base_url}/time/leavebalance"
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "accept": "application/json"
-                    },
-                    params={"employeeId": employee_id},
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    logger.error(f"Failed to get leave balance: {response.status_code} - {response.text}")
-                    return None
+            return await keka_client.request_json(
+                "GET",
+                "time/leavebalance",
+                params={"employeeId": employee_id},
+                timeout=30.0
+            )
                     
         except Exception as e:
             logger.error(f"Exception getting leave balance for {employee_id}: {str(e)}")
@@ -257,11 +126,6 @@ class KekaAPIService:
             Attendance data or None
         """
         try:
-            access_token = await self.generate_access_token()
-            if not access_token:
-                return None
-            
-            url = f"{self.api_base_url}/time/attendance"
             params = {"employeeId": employee_id}
             
             if from_date:
@@ -269,22 +133,12 @@ class KekaAPIService:
             if to_date:
                 params["to"] = to_date
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "accept": "application/json"
-                    },
-                    params=params,
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    logger.error(f"Failed to get attendance: {response.status_code} - {response.text}")
-                    return None
+            return await keka_client.request_json(
+                "GET",
+                "time/attendance",
+                params=params,
+                timeout=30.0
+            )
                     
         except Exception as e:
             logger.error(f"Exception getting attendance for {employee_id}: {str(e)}")
@@ -301,28 +155,12 @@ class KekaAPIService:
             Leave requests data or None
         """
         try:
-            access_token = await self.generate_access_token()
-            if not access_token:
-                return None
-            
-            url = f"{self.api_base_url}/time/leaverequests"
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "accept": "application/json"
-                    },
-                    params={"employeeId": employee_id},
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    logger.error(f"Failed to get leave requests: {response.status_code} - {response.text}")
-                    return None
+            return await keka_client.request_json(
+                "GET",
+                "time/leaverequests",
+                params={"employeeId": employee_id},
+                timeout=30.0
+            )
                     
         except Exception as e:
             logger.error(f"Exception getting leave requests for {employee_id}: {str(e)}")
@@ -336,27 +174,11 @@ class KekaAPIService:
             Leave types data or None
         """
         try:
-            access_token = await self.generate_access_token()
-            if not access_token:
-                return None
-            
-            url = f"{self.api_base_url}/time/leavetypes"
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "accept": "application/json"
-                    },
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    logger.error(f"Failed to get leave types: {response.status_code} - {response.text}")
-                    return None
+            return await keka_client.request_json(
+                "GET",
+                "time/leavetypes",
+                timeout=30.0
+            )
                     
         except Exception as e:
             logger.error(f"Exception getting leave types: {str(e)}")
@@ -374,32 +196,11 @@ class KekaAPIService:
             Response data or None
         """
         try:
-            access_token = await self.generate_access_token()
-            if not access_token:
-                return None
-            
-            url = f"{self.api_base_url}/time/leaverequests"
             
             # Add employee ID to leave data
             request_data = {**leave_data, "employeeId": employee_id}
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "accept": "application/json",
-                        "content-type": "application/json"
-                    },
-                    json=request_data,
-                    timeout=30.0
-                )
-                
-                if response.status_code in [200, 201]:
-                    return response.json()
-                else:
-                    logger.error(f"Failed to apply leave: {response.status_code} - {response.text}")
-                    return None
+            return await keka_client.apply_leave(request_data, timeout=30.0)
                     
         except Exception as e:
             logger.error(f"Exception applying leave for {employee_id}: {str(e)}")
@@ -416,28 +217,12 @@ class KekaAPIService:
             Salary data or None
         """
         try:
-            access_token = await self.generate_access_token()
-            if not access_token:
-                return None
-            
-            url = f"{self.api_base_url}/payroll/salaries"
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "accept": "application/json"
-                    },
-                    params={"employeeId": employee_id},
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    logger.error(f"Failed to get salaries: {response.status_code} - {response.text}")
-                    return None
+            return await keka_client.request_json(
+                "GET",
+                "payroll/salaries",
+                params={"employeeId": employee_id},
+                timeout=30.0
+            )
                     
         except Exception as e:
             logger.error(f"Exception getting salaries for {employee_id}: {str(e)}")
@@ -454,35 +239,20 @@ class KekaAPIService:
             Holidays data or None
         """
         try:
-            access_token = await self.generate_access_token()
-            if not access_token:
-                return None
-            
             # Note: Keka holidays endpoint requires calendar ID
             # You may need to get this from your Keka configuration
             calendar_id = os.getenv("KEKA_CALENDAR_ID", "default")
-            url = f"{self.api_base_url}/time/holidayscalendar/{calendar_id}/holidays"
             
             params = {}
             if year:
                 params["year"] = year
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "accept": "application/json"
-                    },
-                    params=params if params else None,
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    logger.error(f"Failed to get holidays: {response.status_code} - {response.text}")
-                    return None
+            return await keka_client.request_json(
+                "GET",
+                f"time/holidayscalendar/{calendar_id}/holidays",
+                params=params if params else None,
+                timeout=30.0
+            )
                     
         except Exception as e:
             logger.error(f"Exception getting holidays: {str(e)}")
@@ -491,7 +261,7 @@ class KekaAPIService:
     async def get_employee_id_from_email(self, email: str) -> Optional[str]:
         """
         Helper method to get employee ID from email
-        Checks cache first, then fetches from API
+        Resolved through the employee directory (keka_employees, then the API)
         
         Args:
             email: Employee email
@@ -500,42 +270,10 @@ class KekaAPIService:
             Employee ID or None
         """
         try:
-            # Check cache first
-            response = supabase_admin_client.table("keka_employee_cache")\
-                .select("employee_id, cache_expires_at")\
-                .eq("user_email", email)\
-                .single()\
-                .execute()
-            
-            if response.data:
-                cache_expires_at = datetime.fromisoformat(response.data["cache_expires_at"])
-                if cache_expires_at > datetime.now():
-                    logger.info(f"Using cached employee ID for {email}")
-                    return response.data["employee_id"]
+            return await employee_directory_service.resolve(email)
         except Exception as e:
-            logger.debug(f"No cached employee ID for {email}: {str(e)}")
-        
-        # Fetch from API
-        employee_data = await self.get_employee_by_email(email)
-        if not employee_data:
+            logger.error(f"Failed to resolve employee ID for {email}: {str(e)}")
             return None
-        
-        employee_id = employee_data.get("id")
-        
-        # Cache the result
-        try:
-            cache_expires_at = datetime.now() + timedelta(hours=24)
-            supabase_admin_client.table("keka_employee_cache").upsert({
-                "user_email": email,
-                "employee_id": employee_id,
-                "employee_data": employee_data,
-                "cache_expires_at": cache_expires_at.isoformat(),
-                "updated_at": datetime.now().isoformat()
-            }, on_conflict="user_email").execute()
-        except Exception as e:
-            logger.warning(f"Failed to cache employee data: {str(e)}")
-        
-        return employee_id
 
 
 # Global instance
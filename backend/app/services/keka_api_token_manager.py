@@ -0,0 +1,143 @@
+"""
+Keka API Token Manager
+Process-wide cache for the grant_type=kekaapi access token: reused until
+shortly before expiry, refreshed once for all concurrent callers
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from app.utils.keka_http import keka_http
+
+logger = logging.getLogger(__name__)
+
+
+class KekaAPITokenManager:
+    """
+    Caches the kekaapi token and single-flights refreshes
+    """
+
+    def __init__(self):
+        self.client_id = os.getenv("KEKA_CLIENT_ID")
+        self.client_secret = os.getenv("KEKA_CLIENT_SECRET")
+        self.api_key = os.getenv("KEKA_API_KEY")
+        self.environment = os.getenv("KEKA_ENVIRONMENT", "keka")
+
+        if self.environment == 'keka':
+            self.token_endpoint = "https://login.keka.com/connect/token"
+        else:
+            self.token_endpoint = f"https://login.{self.environment}.com/connect/token"
+
+        # Refresh this many seconds before the token actually expires
+        self.refresh_skew_seconds = int(os.getenv("KEKA_TOKEN_REFRESH_SKEW", "120"))
+
+        self._access_token: Optional[str] = None
+        self._expires_at: float = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+        # Counters for the token-endpoint hit rate
+        self.token_requests = 0
+        self.cache_hits = 0
+        self.token_endpoint_calls = 0
+        self.token_endpoint_failures = 0
+        self.invalidations = 0
+
+    def _get_lock(self) -> asyncio.Lock:
+        # Created lazily so it binds to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _is_fresh(self) -> bool:
+        return self._access_token is not None and time.monotonic() < self._expires_at - self.refresh_skew_seconds
+
+    async def get_token(self, force_refresh: bool = False) -> Optional[str]:
+        """
+        Return a valid access token, fetching a new one only when the cached
+        token is missing, about to expire or force_refresh is set.
+        Concurrent callers wait on the same in-flight refresh.
+        """
+        self.token_requests += 1
+        if not force_refresh and self._is_fresh():
+            self.cache_hits += 1
+            return self._access_token
+
+        stale_token = self._access_token
+        async with self._get_lock():
+            # Another caller may have refreshed while we were waiting
+            if self._is_fresh() and (not force_refresh or self._access_token != stale_token):
+                self.cache_hits += 1
+                return self._access_token
+            return await self._fetch_token()
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        """
+        Drop the cached token (e.g. after a 401). Passing the token that failed
+        avoids throwing away a newer one another request already fetched.
+        """
+        if token is None or token == self._access_token:
+            self.invalidations += 1
+            self._access_token = None
+            self._expires_at = 0.0
+
+    async def _fetch_token(self) -> Optional[str]:
+        if not all([self.client_id, self.client_secret, self.api_key]):
+            logger.error("Keka API credentials not configured in environment")
+            return None
+
+        self.token_endpoint_calls += 1
+        try:
+            async with keka_http.session() as client:
+                response = await client.post(
+                    self.token_endpoint,
+                    data={
+                        "grant_type": "kekaapi",
+                        "scope": "kekaapi",
+                        "client_id": self.client_id,
+                        "client_secret": self.client_secret,
+                        "api_key": self.api_key
+                    },
+                    headers={
+                        "accept": "application/json",
+                        "content-type": "application/x-www-form-urlencoded"
+                    },
+                    timeout=30.0
+                )
+
+            if response.status_code != 200:
+                self.token_endpoint_failures += 1
+                logger.error(f"Failed to generate token: {response.status_code} - {response.text}")
+                return None
+
+            token_data = response.json()
+            expires_in = int(token_data.get("expires_in", 3600))
+            self._access_token = token_data.get("access_token")
+            self._expires_at = time.monotonic() + expires_in
+
+            logger.info(f"Generated Keka access token (expires in {expires_in}s)")
+            return self._access_token
+
+        except Exception as e:
+            self.token_endpoint_failures += 1
+            logger.error(f"Exception generating Keka token: {str(e)}")
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Token cache statistics, including the token-endpoint hit rate"""
+        return {
+            "token_requests": self.token_requests,
+            "cache_hits": self.cache_hits,
+            "token_endpoint_calls": self.token_endpoint_calls,
+            "token_endpoint_failures": self.token_endpoint_failures,
+            "invalidations": self.invalidations,
+            # Share of token requests that had to go to login.keka.com
+            "token_endpoint_hit_rate": round(self.token_endpoint_calls / self.token_requests, 4) if self.token_requests else 0.0,
+            "cached_token_ttl_seconds": max(0, int(self._expires_at - time.monotonic())) if self._access_token else 0,
+        }
+
+
+# Global instance
+keka_api_token_manager = KekaAPITokenManager()
@@ -0,0 +1,597 @@
+"""
+Keka API Client
+Single client for every Keka call: typed endpoints, pagination, jittered
+retries on 429/5xx, and a circuit breaker that serves last-known data
+"""
+
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.utils.keka_http import keka_http
+from app.services.keka_api_token_manager import keka_api_token_manager
+from app.services.keka_request_scheduler import keka_request_scheduler, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+from app.services.keka_sync_run_service import record_api_call, record_api_retry, record_rows_read
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Endpoints whose response is the same for every employee
+TENANT_GLOBAL_ENDPOINTS = re.compile(
+    r"^(time/leavetypes|time/holidayscalendar(/[^/]+/holidays)?|payroll/paygroups(/[^/]+/paycycles)?)$"
+)
+
+
+class KekaError(Exception):
+    """A Keka request that failed after retries (status_code is None for transport errors)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, body: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+class KekaCircuitOpenError(KekaError):
+    """Keka is failing and the circuit is open; no request was sent"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Keka circuit open, retry in {retry_after:.0f}s", status_code=503)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures,
+    open -> half-open after `reset_timeout` seconds, where a single probe
+    request decides whether to close again or re-open
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("Keka circuit closed")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+                logger.warning(f"Keka circuit opened after {self.consecutive_failures} consecutive failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """Give up a half-open probe slot without a verdict (e.g. a 4xx response)"""
+        self._probe_in_flight = False
+
+
+class KekaClient:
+    """
+    Shared Keka API client used by the HR and sync services.
+
+    Every request goes through the pooled HTTP client, the kekaapi token
+    cache (or a caller-supplied token provider), retries and the breaker.
+    """
+
+    def __init__(self):
+        self.company_name = os.getenv("KEKA_COMPANY_NAME", "othainsoft")
+        self.environment = os.getenv("KEKA_ENVIRONMENT", "keka")
+        self.api_base_url = os.getenv(
+            "KEKA_API_BASE_URL", f"https://{self.company_name}.{self.environment}.com/api/v1"
+        ).rstrip("/")
+
+        # Retry policy
+        self.max_retries = int(os.getenv("KEKA_MAX_RETRIES", "3"))
+        self.retry_base_delay = float(os.getenv("KEKA_RETRY_BASE_DELAY", "0.5"))
+        self.retry_max_delay = float(os.getenv("KEKA_RETRY_MAX_DELAY", "10"))
+        # Longest Retry-After we are willing to sleep through inside a request
+        self.retry_after_cap = float(os.getenv("KEKA_RETRY_AFTER_CAP", "30"))
+
+        # Pagination
+        self.page_size = int(os.getenv("KEKA_PAGE_SIZE", "200"))
+        self.max_pages = int(os.getenv("KEKA_MAX_PAGES", "500"))
+
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("KEKA_BREAKER_FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("KEKA_BREAKER_RESET_TIMEOUT", "30")),
+        )
+
+        # Last good GET payloads, served when Keka is down
+        self.stale_cache_size = int(os.getenv("KEKA_STALE_CACHE_SIZE", "512"))
+        self.stale_cache_max_age = float(os.getenv("KEKA_STALE_CACHE_MAX_AGE", "86400"))
+        self._last_good: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+
+        # Single-flight and short-lived memo for tenant-global data
+        self.tenant_memo_ttl = float(os.getenv("KEKA_TENANT_MEMO_TTL", "60"))
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._memo: Dict[Tuple, Tuple[float, Any]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.stats = {
+            "requests": 0, "retries": 0, "failures": 0, "stale_served": 0, "short_circuited": 0,
+            "coalesced": 0, "memo_hits": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Core request path
+    # ------------------------------------------------------------------
+
+    async def request_json(
+        self,
+        method: str,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        token_provider: Any = None,
+        cache_scope: Optional[str] = "global",
+        timeout: Optional[float] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Any:
+        """
+        Send a request and return the decoded JSON body.
+
+        token_provider needs `get_token(force_refresh=False)` and
+        `invalidate(token)`; it defaults to the shared kekaapi token cache.
+        cache_scope keeps per-user stale copies apart from tenant-wide ones;
+        None keeps no stale copy at all (bulk sync pages are read once).
+        priority orders the call in the outbound rate-limit queue
+        (PRIORITY_BACKGROUND for sync jobs).
+        Identical concurrent GETs are coalesced into one upstream call, and
+        tenant-global GETs are memoized for KEKA_TENANT_MEMO_TTL seconds
+        (background calls skip the memo but refresh it); the returned
+        payload is shared, so callers must not mutate it.
+        Raises KekaError when the request fails and no stale copy exists.
+        """
+        method = method.upper()
+        provider = token_provider or keka_api_token_manager
+        endpoint = endpoint.strip("/")
+        if method == "GET" and cache_scope == "global" and TENANT_GLOBAL_ENDPOINTS.match(endpoint):
+            # Same answer for every user, so every user can share it; a caller
+            # that asked for no stale copy (cache_scope=None) keeps that
+            cache_scope = "tenant"
+        cache_key = (cache_scope, endpoint, tuple(sorted((params or {}).items())))
+
+        if method != "GET":
+            return await self._request(method, endpoint, params, json, provider, timeout, priority, cache_key)
+
+        self._bind_loop()
+        if cache_scope == "tenant" and priority != PRIORITY_BACKGROUND:
+            # Syncs read fresh (and refresh the memo for everyone else)
+            memo = self._memo.get(cache_key)
+            if memo is not None and memo[0] > time.monotonic():
+                self.stats["memo_hits"] += 1
+                return memo[1]
+
+        # Single flight: identical concurrent GETs share one upstream call and one parsed payload
+        inflight = self._inflight.get(cache_key)
+        if inflight is None:
+            inflight = asyncio.ensure_future(
+                self._request(method, endpoint, params, json, provider, timeout, priority, cache_key)
+            )
+            self._inflight[cache_key] = inflight
+            inflight.add_done_callback(lambda _, key=cache_key: self._finish_inflight(key))
+        else:
+            self.stats["coalesced"] += 1
+        # Shield so one caller giving up doesn't cancel the fetch for the others
+        return await asyncio.shield(inflight)
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # In-flight futures belong to the loop that created them
+            self._inflight = {}
+            self._loop = loop
+
+    def _finish_inflight(self, cache_key: Tuple) -> None:
+        task = self._inflight.pop(cache_key, None)
+        if task is None or task.cancelled() or task.exception() is not None:
+            return
+        if cache_key[0] == "tenant" and self.tenant_memo_ttl > 0:
+            self._memo[cache_key] = (time.monotonic() + self.tenant_memo_ttl, task.result())
+            if len(self._memo) > self.stale_cache_size:
+                now = time.monotonic()
+                for key in [k for k, (expires, _) in self._memo.items() if expires <= now]:
+                    del self._memo[key]
+
+    async def _request(
+        self,
+        method: str,
+        endpoint: str,
+        params: Optional[Dict[str, Any]],
+        json: Optional[Dict[str, Any]],
+        provider: Any,
+        timeout: Optional[float],
+        priority: int,
+        cache_key: Tuple,
+    ) -> Any:
+        if not self.breaker.allow_request():
+            self.stats["short_circuited"] += 1
+            stale = self._get_stale(method, cache_key, priority)
+            if stale is not None:
+                return stale
+            raise KekaCircuitOpenError(self.breaker.retry_after())
+
+        try:
+            payload = await self._send_with_retries(method, endpoint, params, json, provider, timeout, priority)
+        except KekaError as e:
+            if self._is_upstream_failure(e):
+                self.breaker.record_failure()
+                self.stats["failures"] += 1
+                stale = self._get_stale(method, cache_key, priority)
+                if stale is not None:
+                    return stale
+            else:
+                self.breaker.release_probe()
+            raise
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+
+        self.breaker.record_success()
+        if method == "GET":
+            self._remember(cache_key, payload)
+        return payload
+
+    async def _send_with_retries(
+        self,
+        method: str,
+        endpoint: str,
+        params: Optional[Dict[str, Any]],
+        json: Optional[Dict[str, Any]],
+        provider: Any,
+        timeout: Optional[float],
+        priority: int,
+    ) -> Any:
+        url = f"{self.api_base_url}/{endpoint.lstrip('/')}"
+        access_token = await provider.get_token()
+        if not access_token:
+            raise KekaError("Could not obtain Keka access token", status_code=401)
+
+        refreshed = False
+        attempt = 0
+        while True:
+            self.stats["requests"] += 1
+            request_kwargs: Dict[str, Any] = {"params": params, "json": json}
+            if timeout is not None:
+                request_kwargs["timeout"] = timeout
+
+            queued_at = time.monotonic()
+            try:
+                # Every attempt counts against the tenant quota
+                await keka_request_scheduler.acquire(priority)
+            except asyncio.TimeoutError:
+                raise KekaError("Timed out waiting for the Keka rate limit", status_code=429)
+
+            sent_at = time.monotonic()
+            try:
+                async with keka_http.session() as client:
+                    response = await client.request(
+                        method,
+                        url,
+                        headers={
+                            "Authorization": f"Bearer {access_token}",
+                            "accept": "application/json",
+                        },
+                        **request_kwargs,
+                    )
+            except httpx.HTTPError as e:
+                record_api_call(time.monotonic() - sent_at, sent_at - queued_at)
+                # A POST is only safe to resend if it never reached Keka
+                if attempt < self.max_retries and (method == "GET" or isinstance(e, httpx.ConnectError)):
+                    attempt += 1
+                    await self._sleep_before_retry(attempt, None, f"{method} {endpoint}: {e}")
+                    continue
+                logger.error(f"Keka request {method} {endpoint} failed: {str(e)}")
+                raise KekaError(f"Keka request failed: {str(e)}") from e
+
+            record_api_call(time.monotonic() - sent_at, sent_at - queued_at)
+
+            if response.status_code == 401 and not refreshed:
+                logger.warning(f"Keka API returned 401 for {endpoint}, refreshing access token and retrying")
+                refreshed = True
+                provider.invalidate(access_token)
+                access_token = await provider.get_token(force_refresh=True)
+                if not access_token:
+                    raise KekaError("Keka authentication failed", status_code=401)
+                continue
+
+            if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries and (
+                method == "GET" or response.status_code == 429
+            ):
+                retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is None or retry_after <= self.retry_after_cap:
+                    attempt += 1
+                    await self._sleep_before_retry(attempt, retry_after, f"{method} {endpoint}: {response.status_code}")
+                    continue
+
+            if response.status_code in (200, 201, 202):
+                return response.json() if response.content else {}
+            if response.status_code == 204:
+                return {}
+
+            logger.error(f"Keka API error on {method} {endpoint}: {response.status_code} - {response.text}")
+            raise KekaError(
+                f"Keka API request failed: {response.status_code}",
+                status_code=response.status_code,
+                body=response.text,
+            )
+
+    async def _sleep_before_retry(self, attempt: int, retry_after: Optional[float], reason: str) -> None:
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            # Full jitter keeps a burst of failed callers from retrying in lockstep
+            delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** (attempt - 1))))
+        self.stats["retries"] += 1
+        record_api_retry()
+        logger.warning(f"Retrying Keka request ({reason}), attempt {attempt}/{self.max_retries} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Retry-After is either delta-seconds or an HTTP date"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=timezone.utc)
+            return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _is_upstream_failure(error: KekaError) -> bool:
+        """Transport errors and 5xx count against the breaker; 4xx are the caller's problem"""
+        return error.status_code is None or error.status_code >= 500
+
+    # ------------------------------------------------------------------
+    # Last-known-good cache
+    # ------------------------------------------------------------------
+
+    def _remember(self, key: Tuple, payload: Any) -> None:
+        if key[0] is None:
+            return
+        self._last_good[key] = (time.monotonic(), payload)
+        self._last_good.move_to_end(key)
+        while len(self._last_good) > self.stale_cache_size:
+            self._last_good.popitem(last=False)
+
+    def _get_stale(self, method: str, key: Tuple, priority: int = PRIORITY_INTERACTIVE) -> Any:
+        # Syncs write what they read, so they get the error rather than old data
+        if method != "GET" or key[0] is None or priority == PRIORITY_BACKGROUND:
+            return None
+        entry = self._last_good.get(key)
+        if entry is None:
+            return None
+        stored_at, payload = entry
+        age = time.monotonic() - stored_at
+        if age > self.stale_cache_max_age:
+            return None
+        self.stats["stale_served"] += 1
+        logger.warning(f"Serving stale Keka data for {key[1]} ({int(age)}s old)")
+        return payload
+
+    def invalidate_cached(self, endpoint_prefix: str, cache_scope: Optional[str] = None) -> None:
+        """Forget stale copies for an endpoint (e.g. after a write)"""
+        prefix = endpoint_prefix.strip("/")
+        for key in list(self._last_good):
+            if key[1].startswith(prefix) and (cache_scope is None or key[0] == cache_scope):
+                del self._last_good[key]
+        for key in list(self._memo):
+            if key[1].startswith(prefix):
+                del self._memo[key]
+
+    # ------------------------------------------------------------------
+    # Pagination
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def extract_items(payload: Any) -> List[Dict[str, Any]]:
+        """Keka wraps lists as {"data": [...]}, but some endpoints return a bare list"""
+        if isinstance(payload, list):
+            return payload
+        if isinstance(payload, dict):
+            data = payload.get("data")
+            if isinstance(data, list):
+                return data
+        return []
+
+    async def iter_pages(
+        self,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None,
+        page_size: Optional[int] = None,
+        **kwargs,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield one list of items per page until totalPages (or a short page) is reached"""
+        page_size = page_size or self.page_size
+        page_number = 1
+        while page_number <= self.max_pages:
+            payload = await self.request_json(
+                "GET",
+                endpoint,
+                params={**(params or {}), "pageNumber": page_number, "pageSize": page_size},
+                **kwargs,
+            )
+            items = self.extract_items(payload)
+            if items:
+                record_rows_read(len(items))
+                yield items
+
+            total_pages = payload.get("totalPages") if isinstance(payload, dict) else None
+            if not items or (total_pages is not None and page_number >= int(total_pages)):
+                return
+            if total_pages is None and len(items) < page_size:
+                return
+            page_number += 1
+
+        logger.warning(f"Stopped paginating {endpoint} after {self.max_pages} pages")
+
+    async def get_all(self, endpoint: str, params: Optional[Dict[str, Any]] = None, **kwargs) -> List[Dict[str, Any]]:
+        """Collect every page of a list endpoint"""
+        items: List[Dict[str, Any]] = []
+        async for page in self.iter_pages(endpoint, params=params, **kwargs):
+            items.extend(page)
+        return items
+
+    # ------------------------------------------------------------------
+    # Typed endpoints
+    # ------------------------------------------------------------------
+
+    async def get_employees(self, filters: Optional[Dict[str, Any]] = None, **kwargs) -> List[Dict[str, Any]]:
+        """All employees matching the given hris/employees filters"""
+        return await self.get_all("hris/employees", params=filters, **kwargs)
+
+    def iter_employees(self, filters: Optional[Dict[str, Any]] = None, **kwargs) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Pages of employees matching the given filters, fetched as they are consumed"""
+        return self.iter_pages("hris/employees", params=filters, **kwargs)
+
+    async def get_employee(self, employee_id: str, **kwargs) -> Dict[str, Any]:
+        payload = await self.request_json("GET", f"hris/employees/{employee_id}", **kwargs)
+        if isinstance(payload, dict) and isinstance(payload.get("data"), dict):
+            return payload["data"]
+        return payload
+
+    async def find_employee_by_email(self, email: str, **kwargs) -> Optional[Dict[str, Any]]:
+        payload = await self.request_json("GET", "hris/employees", params={"email": email}, **kwargs)
+        employees = self.extract_items(payload)
+        return employees[0] if employees else None
+
+    async def get_leave_balances(self, employee_id: Optional[str] = None, **kwargs) -> List[Dict[str, Any]]:
+        params = {"employeeId": employee_id} if employee_id else None
+        return await self.get_all("time/leavebalance", params=params, **kwargs)
+
+    async def get_leave_requests(
+        self,
+        employee_id: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        modified_since: Optional[str] = None,
+        **kwargs,
+    ) -> List[Dict[str, Any]]:
+        params = self._range_params(employee_id, from_date, to_date)
+        if modified_since:
+            params["lastModified"] = modified_since
+        return await self.get_all("time/leaverequests", params=params, **kwargs)
+
+    def iter_leave_requests(
+        self,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        modified_since: Optional[str] = None,
+        **kwargs,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Pages of leave requests across all employees"""
+        params = self._range_params(None, from_date, to_date)
+        if modified_since:
+            params["lastModified"] = modified_since
+        return self.iter_pages("time/leaverequests", params=params, **kwargs)
+
+    async def get_attendance(
+        self,
+        employee_id: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        **kwargs,
+    ) -> List[Dict[str, Any]]:
+        return await self.get_all(
+            "time/attendance", params=self._range_params(employee_id, from_date, to_date), **kwargs
+        )
+
+    def iter_attendance(
+        self,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        **kwargs,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Pages of attendance records across all employees"""
+        return self.iter_pages("time/attendance", params=self._range_params(None, from_date, to_date), **kwargs)
+
+    async def get_leave_types(self, **kwargs) -> List[Dict[str, Any]]:
+        return self.extract_items(await self.request_json("GET", "time/leavetypes", **kwargs))
+
+    async def apply_leave(self, payload: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        result = await self.request_json("POST", "time/leaverequests", json=payload, **kwargs)
+        self.invalidate_cached("time/leave")
+        return result
+
+    async def get_holiday_calendars(self, **kwargs) -> List[Dict[str, Any]]:
+        return await self.get_all("time/holidayscalendar", **kwargs)
+
+    async def get_holidays(self, calendar_id: str, year: Optional[int] = None, **kwargs) -> List[Dict[str, Any]]:
+        params = {"year": year} if year else None
+        return await self.get_all(f"time/holidayscalendar/{calendar_id}/holidays", params=params, **kwargs)
+
+    async def get_payroll_salaries(self, employee_id: str, **kwargs) -> List[Dict[str, Any]]:
+        return await self.get_all("payroll/salaries", params={"employeeId": employee_id}, **kwargs)
+
+    @staticmethod
+    def _range_params(employee_id: Optional[str], from_date: Optional[str], to_date: Optional[str]) -> Dict[str, Any]:
+        params: Dict[str, Any] = {}
+        if employee_id:
+            params["employeeId"] = employee_id
+        if from_date:
+            params["from"] = from_date
+        if to_date:
+            params["to"] = to_date
+        return params
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Request, retry and breaker counters for health endpoints"""
+        return {
+            **self.stats,
+            "circuit_state": self.breaker.state,
+            "circuit_times_opened": self.breaker.times_opened,
+            "circuit_retry_after_seconds": round(self.breaker.retry_after(), 1) if self.breaker.state == CircuitBreaker.OPEN else 0,
+            "stale_cache_entries": len(self._last_good),
+        }
+
+
+# Global instance
+keka_client = KekaClient()
@@ -9,6 +9,7 @@ from typing import List, Optional, Dict, Any
 from datetime import datetime, date, timedelta
 import os
 from supabase import create_client, Client
+from app.services.employee_directory_service import employee_directory_service
 
 logger = logging.getLogger(__name__)
 
@@ -132,6 +133,7 @@ class KekaDBCacheService:
                 on_conflict="keka_employee_id"
             ).execute()
             
+            employee_directory_service.invalidate(emails=[email], employee_ids=[keka_employee_id])
             logger.info(f"Successfully cached employee data for {email}")
             return True
             
@@ -140,19 +142,12 @@ class KekaDBCacheService:
             return False
     
     async def get_cached_employee_by_email(self, email: str) -> Optional[Dict[str, Any]]:
-        """Get cached employee data by email"""
+        """Get cached employee data by email (through the shared employee directory)"""
         if not self.supabase:
             return None
         
         try:
-            result = self.supabase.table("keka_employees").select("*").eq("email", email).execute()
-            
-            if result.data and len(result.data) > 0:
-                logger.info(f"Found cached employee data for {email}")
-                return result.data[0]
-            
-            return None
-            
+            return await employee_directory_service.get_employee(email, fetch_missing=False)
         except Exception as e:
             logger.error(f"Failed to get cached employee: {str(e)}")
             return None
@@ -317,6 +312,50 @@ class KekaDBCacheService:
             logger.error(f"Failed to get cached holidays: {str(e)}")
             return []
 
+    
+    async def get_cached_payslip(self, keka_employee_id: str, year: int, month: int) -> Optional[Dict[str, Any]]:
+        """Get one synced payslip by (employee, period) using the period index"""
+        if not self.supabase:
+            return None
+        
+        try:
+            result = self.supabase.table("keka_employee_payslips").select("*").eq(
+                "keka_employee_id", keka_employee_id
+            ).eq("period_year", year).eq("period_month", month).limit(1).execute()
+            
+            return result.data[0] if result.data else None
+            
+        except Exception as e:
+            logger.error(f"Failed to get cached payslip: {str(e)}")
+            return None
+    
+    async def get_cached_payslips(
+        self,
+        keka_employee_id: str,
+        from_date: Optional[date] = None,
+        to_date: Optional[date] = None,
+        limit: int = 6
+    ) -> List[Dict[str, Any]]:
+        """Get an employee's most recent synced payslips, optionally within a date range"""
+        if not self.supabase:
+            return []
+        
+        try:
+            query = self.supabase.table("keka_employee_payslips").select("*").eq("keka_employee_id", keka_employee_id)
+            
+            if from_date:
+                query = query.gte("start_date", from_date.isoformat())
+            if to_date:
+                query = query.lte("end_date", to_date.isoformat())
+            
+            result = query.order("start_date", desc=True).limit(limit).execute()
+            
+            return result.data if result.data else []
+            
+        except Exception as e:
+            logger.error(f"Failed to get cached payslips: {str(e)}")
+            return []
+
 
 # Singleton instance
 keka_db_cache_service = KekaDBCacheService()
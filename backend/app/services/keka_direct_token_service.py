@@ -8,8 +8,8 @@ import logging
 import os
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
-import httpx
 from app.utils.supabase_client import supabase_admin_client
+from app.utils.keka_http import keka_http
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +48,7 @@ class KekaDirectTokenService:
                 logger.error("Keka client_id or client_secret not configured")
                 return None
             
-            async with httpx.AsyncClient() as client:
+            async with keka_http.session() as client:
                 response = await client.post(
                     self.token_endpoint,
                     data={
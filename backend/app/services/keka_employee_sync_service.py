@@ -5,12 +5,17 @@ Fetches and stores all employee data from Keka API for centralized access
 
 import os
 import json
+import time
 import asyncio
 import logging
-from typing import Dict, List, Any, Optional
-from datetime import datetime, date, timedelta
-import httpx
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, date, timedelta, timezone
 from app.utils.supabase_client import supabase_admin_client
+from app.services.keka_api_token_manager import keka_api_token_manager
+from app.services.keka_client import keka_client
+from app.services.keka_request_scheduler import PRIORITY_BACKGROUND
+from app.services.keka_sync_run_service import keka_sync_run_service, record_db_time
+from app.services.employee_directory_service import employee_directory_service
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -37,64 +42,33 @@ class KekaEmployeeSyncService:
         
         if not self.client_id or not self.client_secret or not self.api_key:
             raise ValueError("KEKA_CLIENT_ID, KEKA_CLIENT_SECRET, and KEKA_API_KEY must be set")
+        
+        # Rows per Supabase upsert call
+        self.upsert_batch_size = int(os.getenv("KEKA_SYNC_UPSERT_BATCH_SIZE", "500"))
+        # Upsert calls in flight at once during a sync
+        self.upsert_concurrency = max(1, int(os.getenv("KEKA_SYNC_UPSERT_CONCURRENCY", "4")))
+        # Keka pages fetched ahead of the writer when streaming a sync
+        self.prefetch_pages = max(1, int(os.getenv("KEKA_SYNC_PREFETCH_PAGES", "2")))
+        
+        # Holiday sync
+        self.holiday_fetch_concurrency = max(1, int(os.getenv("KEKA_SYNC_HOLIDAY_CONCURRENCY", "4")))
+        self.holiday_calendar_max_age = timedelta(hours=int(os.getenv("KEKA_SYNC_HOLIDAY_CALENDAR_MAX_AGE_HOURS", "168")))
+        
+        # Incremental sync windows
+        self.attendance_lookback_days = int(os.getenv("KEKA_SYNC_ATTENDANCE_LOOKBACK_DAYS", "3"))
+        self.leave_history_window_days = int(os.getenv("KEKA_SYNC_LEAVE_HISTORY_WINDOW_DAYS", "90"))
+        
+        # Fully written pay cycles remembered in the payslips checkpoint
+        self.pay_cycle_checkpoint_size = int(os.getenv("KEKA_SYNC_PAY_CYCLE_CHECKPOINT_SIZE", "200"))
+        # Overlap applied to the modified-since cursor to absorb clock skew
+        self.cursor_overlap = timedelta(minutes=int(os.getenv("KEKA_SYNC_CURSOR_OVERLAP_MINUTES", "15")))
     
     async def _get_access_token(self) -> str:
-        """Get access token for Keka API using kekaapi grant type (same as keka_api_service)"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.token_endpoint,
-                    data={
-                        "grant_type": "kekaapi",
-                        "scope": "kekaapi",
-                        "client_id": self.client_id,
-                        "client_secret": self.client_secret,
-                        "api_key": self.api_key
-                    },
-                    headers={
-                        "accept": "application/json",
-                        "content-type": "application/x-www-form-urlencoded"
-                    },
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    token_data = response.json()
-                    logger.info("Successfully generated Keka access token for sync")
-                    return token_data["access_token"]
-                else:
-                    logger.error(f"Failed to get access token: {response.status_code} - {response.text}")
-                    raise Exception(f"Failed to get access token: {response.status_code}")
-                    
-        except Exception as e:
-            logger.error(f"Error getting access token: {str(e)}")
-            raise
-    
-    async def _make_keka_request(self, method: str, endpoint: str, **kwargs) -> Dict[str, Any]:
-        """Make authenticated request to Keka API"""
-        access_token = await self._get_access_token()
-        
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await getattr(client, method.lower())(
-                    f"{self.api_base_url}/{endpoint.lstrip('/')}",
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "Content-Type": "application/json",
-                        **kwargs.get("headers", {})
-                    },
-                    **{k: v for k, v in kwargs.items() if k != "headers"}
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    logger.error(f"Keka API error: {response.status_code} - {response.text}")
-                    raise Exception(f"Keka API request failed: {response.status_code}")
-                    
-        except httpx.HTTPError as e:
-            logger.error(f"HTTP error during Keka request: {str(e)}")
-            raise
+        """Get access token for Keka API from the shared kekaapi token cache"""
+        access_token = await keka_api_token_manager.get_token()
+        if not access_token:
+            raise Exception("Failed to get access token")
+        return access_token
     
     async def sync_all_employees(self) -> Dict[str, Any]:
         """Sync all employee data from Keka"""
@@ -104,35 +78,36 @@ class KekaEmployeeSyncService:
             # Update sync status
             await self._update_sync_status("employees", "in_progress", 0, 0)
             
-            # Fetch all employees
-            employees_data = await self._make_keka_request(
-                "GET", 
-                "hris/employees",
-                params={"inProbation": "false", "inNoticePeriod": "false"}
+            # Stream employee pages: each page is written while the next one is fetched
+            synced_at = datetime.now().isoformat()
+            upsert = await self._stream_upsert(
+                keka_client.iter_employees(
+                    {"inProbation": "false", "inNoticePeriod": "false"},
+                    cache_scope=None,
+                    priority=PRIORITY_BACKGROUND
+                ),
+                lambda employee: self._build_employee_record(employee, synced_at),
+                "keka_employees",
+                "keka_employee_id"
             )
-            
-            employees = employees_data.get("data", [])
-            logger.info(f"Found {len(employees)} employees to sync")
-            
-            processed = 0
-            failed = 0
-            
-            for employee in employees:
-                try:
-                    await self._sync_employee_data(employee)
-                    processed += 1
-                except Exception as e:
-                    logger.error(f"Failed to sync employee {employee.get('email', 'unknown')}: {str(e)}")
-                    failed += 1
+            processed = upsert["processed"]
+            failed = upsert["failed"]
+            # Every employee row may have changed
+            employee_directory_service.invalidate_all()
             
             # Update sync status
             await self._update_sync_status("employees", "success", processed, failed)
             
-            logger.info(f"Employee sync completed: {processed} processed, {failed} failed")
+            logger.info(
+                f"Employee sync completed: {processed} processed, {failed} failed "
+                f"in {upsert['batches']} batches ({upsert['rows_per_second']} rows/s)"
+            )
             return {
                 "success": True,
                 "processed": processed,
                 "failed": failed,
+                "batches": upsert["batches"],
+                "rows_per_second": upsert["rows_per_second"],
                 "message": f"Synced {processed} employees successfully"
             }
             
@@ -145,108 +120,97 @@ class KekaEmployeeSyncService:
                 "message": "Employee sync failed"
             }
     
-    async def _sync_employee_data(self, employee_data: Dict[str, Any]) -> None:
-        """Sync individual employee data to database"""
-        try:
-            # Extract basic employee information
-            employee_record = {
-                "keka_employee_id": employee_data["id"],
-                "employee_number": employee_data.get("employeeNumber"),
-                "first_name": employee_data.get("firstName"),
-                "middle_name": employee_data.get("middleName"),
-                "last_name": employee_data.get("lastName"),
-                "display_name": employee_data.get("displayName"),
-                "email": employee_data.get("email"),
-                "city": employee_data.get("city"),
-                "country_code": employee_data.get("countryCode"),
-                "image_file_name": employee_data.get("image", {}).get("fileName"),
-                "image_thumbs": employee_data.get("image", {}).get("thumbs"),
-                "job_title_identifier": employee_data.get("jobTitle", {}).get("identifier"),
-                "job_title": employee_data.get("jobTitle", {}).get("title"),
-                "secondary_job_title": employee_data.get("secondaryJobTitle"),
-                "reports_to_id": employee_data.get("reportsTo", {}).get("id"),
-                "reports_to_first_name": employee_data.get("reportsTo", {}).get("firstName"),
-                "reports_to_last_name": employee_data.get("reportsTo", {}).get("lastName"),
-                "reports_to_email": employee_data.get("reportsTo", {}).get("email"),
-                "l2_manager_id": employee_data.get("l2Manager", {}).get("id"),
-                "l2_manager_first_name": employee_data.get("l2Manager", {}).get("firstName"),
-                "l2_manager_last_name": employee_data.get("l2Manager", {}).get("lastName"),
-                "l2_manager_email": employee_data.get("l2Manager", {}).get("email"),
-                "dotted_line_manager_id": employee_data.get("dottedLineManager", {}).get("id"),
-                "dotted_line_manager_first_name": employee_data.get("dottedLineManager", {}).get("firstName"),
-                "dotted_line_manager_last_name": employee_data.get("dottedLineManager", {}).get("lastName"),
-                "dotted_line_manager_email": employee_data.get("dottedLineManager", {}).get("email"),
-                "contingent_type_id": employee_data.get("contingentType", {}).get("id"),
-                "contingent_type_name": employee_data.get("contingentType", {}).get("name"),
-                "time_type": employee_data.get("timeType"),
-                "worker_type": employee_data.get("workerType"),
-                "is_private": employee_data.get("isPrivate", False),
-                "is_profile_complete": employee_data.get("isProfileComplete", False),
-                "marital_status": employee_data.get("maritalStatus"),
-                "marriage_date": self._parse_datetime(employee_data.get("marriageDate")),
-                "gender": employee_data.get("gender"),
-                "joining_date": self._parse_datetime(employee_data.get("joiningDate")),
-                "total_experience_in_days": employee_data.get("totalExperienceInDays"),
-                "professional_summary": employee_data.get("professionalSummary"),
-                "date_of_birth": self._parse_datetime(employee_data.get("dateOfBirth")),
-                "resignation_submitted_date": self._parse_datetime(employee_data.get("resignationSubmittedDate")),
-                "exit_date": self._parse_datetime(employee_data.get("exitDate")),
-                "employment_status": employee_data.get("employmentStatus"),
-                "account_status": employee_data.get("accountStatus"),
-                "invitation_status": employee_data.get("invitationStatus"),
-                "exit_status": employee_data.get("exitStatus"),
-                "exit_type": employee_data.get("exitType"),
-                "exit_reason": employee_data.get("exitReason"),
-                "personal_email": employee_data.get("personalEmail"),
-                "work_phone": employee_data.get("workPhone"),
-                "home_phone": employee_data.get("homePhone"),
-                "mobile_phone": employee_data.get("mobilePhone"),
-                "blood_group": employee_data.get("bloodGroup"),
-                "nationality": employee_data.get("nationality"),
-                "attendance_number": employee_data.get("attendanceNumber"),
-                "probation_end_date": self._parse_datetime(employee_data.get("probationEndDate")),
-                "current_address": employee_data.get("currentAddress"),
-                "permanent_address": employee_data.get("permanentAddress"),
-                "relations": employee_data.get("relations"),
-                "education_details": employee_data.get("educationDetails"),
-                "experience_details": employee_data.get("experienceDetails"),
-                "custom_fields": employee_data.get("customFields"),
-                "groups": employee_data.get("groups"),
-                "leave_plan_identifier": employee_data.get("leavePlanInfo", {}).get("identifier"),
-                "leave_plan_title": employee_data.get("leavePlanInfo", {}).get("title"),
-                "holiday_calendar_id": employee_data.get("holidayCalendarId"),
-                "band_info_identifier": employee_data.get("bandInfo", {}).get("identifier"),
-                "band_info_title": employee_data.get("bandInfo", {}).get("title"),
-                "pay_grade_identifier": employee_data.get("payGradeInfo", {}).get("identifier"),
-                "pay_grade_title": employee_data.get("payGradeInfo", {}).get("title"),
-                "shift_policy_identifier": employee_data.get("shiftPolicyInfo", {}).get("identifier"),
-                "shift_policy_title": employee_data.get("shiftPolicyInfo", {}).get("title"),
-                "weekly_off_policy_identifier": employee_data.get("weeklyOffPolicyInfo", {}).get("identifier"),
-                "weekly_off_policy_title": employee_data.get("weeklyOffPolicyInfo", {}).get("title"),
-                "capture_scheme_identifier": employee_data.get("captureSchemeInfo", {}).get("identifier"),
-                "capture_scheme_title": employee_data.get("captureSchemeInfo", {}).get("title"),
-                "tracking_policy_identifier": employee_data.get("trackingPolicyInfo", {}).get("identifier"),
-                "tracking_policy_title": employee_data.get("trackingPolicyInfo", {}).get("title"),
-                "expense_policy_identifier": employee_data.get("expensePolicyInfo", {}).get("identifier"),
-                "expense_policy_title": employee_data.get("expensePolicyInfo", {}).get("title"),
-                "overtime_policy_identifier": employee_data.get("overtimePolicyInfo", {}).get("identifier"),
-                "overtime_policy_title": employee_data.get("overtimePolicyInfo", {}).get("title"),
-                "raw_data": employee_data,
-                "last_synced_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
-            }
-            
-            # Upsert employee data
-            supabase_admin_client.table("keka_employees").upsert(
-                employee_record,
-                on_conflict="keka_employee_id"
-            ).execute()
-            
-            logger.debug(f"Synced employee: {employee_data.get('email')}")
-            
-        except Exception as e:
-            logger.error(f"Failed to sync employee data: {str(e)}")
-            raise
+    def _build_employee_record(self, employee_data: Dict[str, Any], synced_at: str) -> Optional[Dict[str, Any]]:
+        """Map one Keka employee to a keka_employees row"""
+        if not employee_data.get("id"):
+            logger.warning(f"Employee record missing ID: {employee_data.get('email', 'unknown')}")
+            return None
+        return {
+            "keka_employee_id": employee_data["id"],
+            "employee_number": employee_data.get("employeeNumber"),
+            "first_name": employee_data.get("firstName"),
+            "middle_name": employee_data.get("middleName"),
+            "last_name": employee_data.get("lastName"),
+            "display_name": employee_data.get("displayName"),
+            "email": employee_data.get("email"),
+            "city": employee_data.get("city"),
+            "country_code": employee_data.get("countryCode"),
+            "image_file_name": employee_data.get("image", {}).get("fileName"),
+            "image_thumbs": employee_data.get("image", {}).get("thumbs"),
+            "job_title_identifier": employee_data.get("jobTitle", {}).get("identifier"),
+            "job_title": employee_data.get("jobTitle", {}).get("title"),
+            "secondary_job_title": employee_data.get("secondaryJobTitle"),
+            "reports_to_id": employee_data.get("reportsTo", {}).get("id"),
+            "reports_to_first_name": employee_data.get("reportsTo", {}).get("firstName"),
+            "reports_to_last_name": employee_data.get("reportsTo", {}).get("lastName"),
+            "reports_to_email": employee_data.get("reportsTo", {}).get("email"),
+            "l2_manager_id": employee_data.get("l2Manager", {}).get("id"),
+            "l2_manager_first_name": employee_data.get("l2Manager", {}).get("firstName"),
+            "l2_manager_last_name": employee_data.get("l2Manager", {}).get("lastName"),
+            "l2_manager_email": employee_data.get("l2Manager", {}).get("email"),
+            "dotted_line_manager_id": employee_data.get("dottedLineManager", {}).get("id"),
+            "dotted_line_manager_first_name": employee_data.get("dottedLineManager", {}).get("firstName"),
+            "dotted_line_manager_last_name": employee_data.get("dottedLineManager", {}).get("lastName"),
+            "dotted_line_manager_email": employee_data.get("dottedLineManager", {}).get("email"),
+            "contingent_type_id": employee_data.get("contingentType", {}).get("id"),
+            "contingent_type_name": employee_data.get("contingentType", {}).get("name"),
+            "time_type": employee_data.get("timeType"),
+            "worker_type": employee_data.get("workerType"),
+            "is_private": employee_data.get("isPrivate", False),
+            "is_profile_complete": employee_data.get("isProfileComplete", False),
+            "marital_status": employee_data.get("maritalStatus"),
+            "marriage_date": self._parse_datetime(employee_data.get("marriageDate")),
+            "gender": employee_data.get("gender"),
+            "joining_date": self._parse_datetime(employee_data.get("joiningDate")),
+            "total_experience_in_days": employee_data.get("totalExperienceInDays"),
+            "professional_summary": employee_data.get("professionalSummary"),
+            "date_of_birth": self._parse_datetime(employee_data.get("dateOfBirth")),
+            "resignation_submitted_date": self._parse_datetime(employee_data.get("resignationSubmittedDate")),
+            "exit_date": self._parse_datetime(employee_data.get("exitDate")),
+            "employment_status": employee_data.get("employmentStatus"),
+            "account_status": employee_data.get("accountStatus"),
+            "invitation_status": employee_data.get("invitationStatus"),
+            "exit_status": employee_data.get("exitStatus"),
+            "exit_type": employee_data.get("exitType"),
+            "exit_reason": employee_data.get("exitReason"),
+            "personal_email": employee_data.get("personalEmail"),
+            "work_phone": employee_data.get("workPhone"),
+            "home_phone": employee_data.get("homePhone"),
+            "mobile_phone": employee_data.get("mobilePhone"),
+            "blood_group": employee_data.get("bloodGroup"),
+            "nationality": employee_data.get("nationality"),
+            "attendance_number": employee_data.get("attendanceNumber"),
+            "probation_end_date": self._parse_datetime(employee_data.get("probationEndDate")),
+            "current_address": employee_data.get("currentAddress"),
+            "permanent_address": employee_data.get("permanentAddress"),
+            "relations": employee_data.get("relations"),
+            "education_details": employee_data.get("educationDetails"),
+            "experience_details": employee_data.get("experienceDetails"),
+            "custom_fields": employee_data.get("customFields"),
+            "groups": employee_data.get("groups"),
+            "leave_plan_identifier": employee_data.get("leavePlanInfo", {}).get("identifier"),
+            "leave_plan_title": employee_data.get("leavePlanInfo", {}).get("title"),
+            "holiday_calendar_id": employee_data.get("holidayCalendarId"),
+            "band_info_identifier": employee_data.get("bandInfo", {}).get("identifier"),
+            "band_info_title": employee_data.get("bandInfo", {}).get("title"),
+            "pay_grade_identifier": employee_data.get("payGradeInfo", {}).get("identifier"),
+            "pay_grade_title": employee_data.get("payGradeInfo", {}).get("title"),
+            "shift_policy_identifier": employee_data.get("shiftPolicyInfo", {}).get("identifier"),
+            "shift_policy_title": employee_data.get("shiftPolicyInfo", {}).get("title"),
+            "weekly_off_policy_identifier": employee_data.get("weeklyOffPolicyInfo", {}).get("identifier"),
+            "weekly_off_policy_title": employee_data.get("weeklyOffPolicyInfo", {}).get("title"),
+            "capture_scheme_identifier": employee_data.get("captureSchemeInfo", {}).get("identifier"),
+            "capture_scheme_title": employee_data.get("captureSchemeInfo", {}).get("title"),
+            "tracking_policy_identifier": employee_data.get("trackingPolicyInfo", {}).get("identifier"),
+            "tracking_policy_title": employee_data.get("trackingPolicyInfo", {}).get("title"),
+            "expense_policy_identifier": employee_data.get("expensePolicyInfo", {}).get("identifier"),
+            "expense_policy_title": employee_data.get("expensePolicyInfo", {}).get("title"),
+            "overtime_policy_identifier": employee_data.get("overtimePolicyInfo", {}).get("identifier"),
+            "overtime_policy_title": employee_data.get("overtimePolicyInfo", {}).get("title"),
+            "raw_data": employee_data,
+            "last_synced_at": synced_at,
+            "updated_at": synced_at
+        }
     
     async def sync_employee_leave_balances(self) -> Dict[str, Any]:
         """Sync leave balances for all employees using global endpoint"""
@@ -257,46 +221,37 @@ class KekaEmployeeSyncService:
             await self._update_sync_status("leave_balances", "in_progress", 0, 0)
             
             # Fetch all leave balances from global endpoint
-            leave_balances_data = await self._make_keka_request(
-                "GET",
-                "time/leavebalance"
-            )
-            
-            leave_balances = leave_balances_data.get("data", [])
+            leave_balances = await keka_client.get_leave_balances(priority=PRIORITY_BACKGROUND)
             logger.info(f"Found {len(leave_balances)} leave balance records to sync")
             
-            processed = 0
             failed = 0
-            
-            # Clear existing leave balances
-            supabase_admin_client.table("keka_employee_leave_balances").delete().execute()
-            
+            snapshot = []
             for balance in leave_balances:
-                try:
-                    # Extract employee ID from the balance record
-                    employee_id = balance.get("employeeId") or balance.get("employee_id")
-                    if not employee_id:
-                        logger.warning(f"Leave balance record missing employee ID: {balance}")
-                        failed += 1
-                        continue
-                    
-                    balance_record = {
-                        "keka_employee_id": employee_id,
-                        "leave_type": balance.get("leaveType") or balance.get("leave_type"),
-                        "total_allocated": balance.get("allocated", 0),
-                        "used": balance.get("consumed", 0),
-                        "remaining": balance.get("balance", 0),
-                        "carry_forward": balance.get("carryForward", 0),
-                        "last_synced_at": datetime.now().isoformat(),
-                        "updated_at": datetime.now().isoformat()
-                    }
-                    
-                    supabase_admin_client.table("keka_employee_leave_balances").insert(balance_record).execute()
-                    processed += 1
-                    
-                except Exception as e:
-                    logger.error(f"Failed to sync leave balance record: {str(e)}")
+                balance_record = self._build_leave_balance_record(balance)
+                if balance_record is None:
                     failed += 1
+                    continue
+                snapshot.append(balance_record)
+            
+            if not snapshot:
+                # Keep the current balances rather than replacing them with nothing
+                raise Exception("Keka returned no usable leave balances; existing balances kept")
+            
+            # One RPC diffs the snapshot against the table and applies it in a single transaction
+            started = time.monotonic()
+            response = await asyncio.get_running_loop().run_in_executor(
+                None,
+                lambda: supabase_admin_client.rpc("keka_replace_leave_balances", {"p_rows": snapshot}).execute()
+            )
+            record_db_time(time.monotonic() - started)
+            changes = response.data or {}
+            processed = len(snapshot) - changes.get("skipped", 0)
+            failed += changes.get("skipped", 0)
+            logger.info(
+                f"Leave balance changes: {changes.get('inserted', 0)} inserted, {changes.get('updated', 0)} updated, "
+                f"{changes.get('deleted', 0)} deleted, {changes.get('unchanged', 0)} unchanged, "
+                f"{changes.get('skipped', 0)} skipped for unknown employees"
+            )
             
             # Update sync status
             await self._update_sync_status("leave_balances", "success", processed, failed)
@@ -306,6 +261,7 @@ class KekaEmployeeSyncService:
                 "success": True,
                 "processed": processed,
                 "failed": failed,
+                "changes": changes,
                 "message": f"Synced {processed} leave balance records"
             }
             
@@ -319,71 +275,61 @@ class KekaEmployeeSyncService:
             }
     
     
-    async def sync_employee_attendance(self, from_date: date, to_date: date) -> Dict[str, Any]:
-        """Sync attendance records for all employees using global endpoint"""
+    async def sync_employee_attendance(self, from_date: date = None, to_date: date = None, repair: bool = False) -> Dict[str, Any]:
+        """
+        Sync attendance records for all employees using global endpoint.
+        Without dates only the trailing window since the last successful sync
+        is fetched and upserted. repair re-syncs the whole range and removes
+        rows Keka no longer returns.
+        """
         try:
-            logger.info(f"Starting attendance sync from {from_date} to {to_date}...")
+            run_started = datetime.now(timezone.utc)
+            incremental = from_date is None and not repair
+            from_date, to_date = await self._resolve_sync_window(
+                "attendance", from_date, to_date, self.attendance_lookback_days
+            )
+            logger.info(
+                f"Starting {'incremental' if incremental else 'repair' if repair else 'range'} "
+                f"attendance sync from {from_date} to {to_date}..."
+            )
             
             # Update sync status
             await self._update_sync_status("attendance", "in_progress", 0, 0)
             
-            # Fetch all attendance records from global endpoint
-            attendance_data = await self._make_keka_request(
-                "GET",
-                "time/attendance",
-                params={
-                    "from": from_date.isoformat(),
-                    "to": to_date.isoformat()
-                }
+            synced_at = run_started.isoformat()
+            upsert = await self._stream_upsert(
+                keka_client.iter_attendance(
+                    from_date=from_date.isoformat(),
+                    to_date=to_date.isoformat(),
+                    cache_scope=None,
+                    priority=PRIORITY_BACKGROUND
+                ),
+                lambda record: self._build_attendance_record(record, synced_at),
+                "keka_employee_attendance",
+                "keka_employee_id,attendance_date"
             )
+            processed = upsert["processed"]
+            failed = upsert["failed"]
             
-            attendance_records = attendance_data.get("data", [])
-            logger.info(f"Found {len(attendance_records)} attendance records to sync")
+            if repair and not upsert["failed"]:
+                # Anything in the range this run didn't touch no longer exists in Keka
+                supabase_admin_client.table("keka_employee_attendance").delete().gte(
+                    "attendance_date", from_date.isoformat()
+                ).lte("attendance_date", to_date.isoformat()).lt("last_synced_at", synced_at).execute()
             
-            processed = 0
-            failed = 0
-            
-            # Clear existing attendance records for the date range
-            supabase_admin_client.table("keka_employee_attendance").delete().gte("attendance_date", from_date.isoformat()).lte("attendance_date", to_date.isoformat()).execute()
-            
-            for record in attendance_records:
-                try:
-                    # Extract employee ID from the attendance record
-                    employee_id = record.get("employeeId") or record.get("employee_id")
-                    if not employee_id:
-                        logger.warning(f"Attendance record missing employee ID: {record}")
-                        failed += 1
-                        continue
-                    
-                    attendance_record = {
-                        "keka_employee_id": employee_id,
-                        "attendance_date": record.get("date"),
-                        "status": record.get("status"),
-                        "check_in": self._parse_datetime(record.get("checkIn")),
-                        "check_out": self._parse_datetime(record.get("checkOut")),
-                        "break_hours": record.get("breakHours"),
-                        "total_hours": record.get("totalHours"),
-                        "overtime_hours": record.get("overtimeHours"),
-                        "location": record.get("location"),
-                        "last_synced_at": datetime.now().isoformat(),
-                        "updated_at": datetime.now().isoformat()
-                    }
-                    
-                    supabase_admin_client.table("keka_employee_attendance").insert(attendance_record).execute()
-                    processed += 1
-                    
-                except Exception as e:
-                    logger.error(f"Failed to sync attendance record: {str(e)}")
-                    failed += 1
-            
-            # Update sync status
-            await self._update_sync_status("attendance", "success", processed, failed)
+            # Update sync status; only a run that covers the gap since the last one moves the cursor
+            await self._update_sync_status(
+                "attendance", "success", processed, failed,
+                cursor=run_started if incremental or repair else None
+            )
             
             logger.info(f"Attendance sync completed: {processed} processed, {failed} failed")
             return {
                 "success": True,
                 "processed": processed,
                 "failed": failed,
+                "from_date": from_date.isoformat(),
+                "to_date": to_date.isoformat(),
                 "message": f"Synced {processed} attendance records"
             }
             
@@ -396,80 +342,71 @@ class KekaEmployeeSyncService:
                 "message": "Attendance sync failed"
             }
     
-    async def sync_employee_leave_history(self, from_date: date = None, to_date: date = None) -> Dict[str, Any]:
-        """Sync leave history for all employees using global endpoint"""
+    async def sync_employee_leave_history(self, from_date: date = None, to_date: date = None, repair: bool = False) -> Dict[str, Any]:
+        """
+        Sync leave history for all employees using global endpoint.
+        Without dates only requests modified since the last successful sync
+        are fetched and upserted. repair re-syncs the whole range and removes
+        requests Keka no longer returns.
+        """
         try:
-            logger.info(f"Starting leave history sync from {from_date} to {to_date}...")
+            run_started = datetime.now(timezone.utc)
+            incremental = from_date is None and not repair
+            cursor = await self._get_sync_cursor("leave_history") if incremental else None
             
-            # Update sync status
-            await self._update_sync_status("leave_history", "in_progress", 0, 0)
-            
-            # Set default date range if not provided (last 3 months)
+            # Leave requests can be edited long after they start, so the date window stays
+            # wide and the modified-since filter does the narrowing
             if not from_date:
-                from_date = date.today() - timedelta(days=90)
+                from_date = date.today() - timedelta(days=self.leave_history_window_days)
             if not to_date:
                 to_date = date.today()
+            modified_since = (cursor - self.cursor_overlap).isoformat() if cursor else None
             
-            # Fetch all leave requests from global endpoint
-            leave_requests_data = await self._make_keka_request(
-                "GET",
-                "time/leaverequests",
-                params={
-                    "from": from_date.isoformat(),
-                    "to": to_date.isoformat()
-                }
+            logger.info(
+                f"Starting {'incremental' if incremental else 'repair' if repair else 'range'} "
+                f"leave history sync from {from_date} to {to_date}"
+                f"{f' modified since {modified_since}' if modified_since else ''}..."
             )
             
-            leave_requests = leave_requests_data.get("data", [])
-            logger.info(f"Found {len(leave_requests)} leave request records to sync")
-            
-            processed = 0
-            failed = 0
+            # Update sync status
+            await self._update_sync_status("leave_history", "in_progress", 0, 0)
             
-            # Clear existing leave history for the date range
-            supabase_admin_client.table("keka_employee_leave_history").delete().gte("from_date", from_date.isoformat()).lte("from_date", to_date.isoformat()).execute()
+            synced_at = run_started.isoformat()
+            upsert = await self._stream_upsert(
+                keka_client.iter_leave_requests(
+                    from_date=from_date.isoformat(),
+                    to_date=to_date.isoformat(),
+                    modified_since=modified_since,
+                    cache_scope=None,
+                    priority=PRIORITY_BACKGROUND
+                ),
+                lambda request: self._build_leave_history_record(request, synced_at),
+                "keka_employee_leave_history",
+                "keka_employee_id,leave_request_id"
+            )
+            processed = upsert["processed"]
+            failed = upsert["failed"]
             
-            for request in leave_requests:
-                try:
-                    # Extract employee ID from the leave request record
-                    employee_id = request.get("employeeId") or request.get("employee_id")
-                    if not employee_id:
-                        logger.warning(f"Leave request record missing employee ID: {request}")
-                        failed += 1
-                        continue
-                    
-                    leave_record = {
-                        "keka_employee_id": employee_id,
-                        "leave_request_id": request.get("id"),
-                        "leave_type": request.get("leaveType") or request.get("leave_type"),
-                        "from_date": request.get("fromDate") or request.get("from_date"),
-                        "to_date": request.get("toDate") or request.get("to_date"),
-                        "days_count": request.get("daysCount") or request.get("days_count"),
-                        "reason": request.get("reason"),
-                        "status": request.get("status"),
-                        "applied_date": self._parse_datetime(request.get("appliedDate") or request.get("applied_date")),
-                        "approved_date": self._parse_datetime(request.get("approvedDate") or request.get("approved_date")),
-                        "approved_by": request.get("approvedBy") or request.get("approved_by"),
-                        "comments": request.get("comments"),
-                        "last_synced_at": datetime.now().isoformat(),
-                        "updated_at": datetime.now().isoformat()
-                    }
-                    
-                    supabase_admin_client.table("keka_employee_leave_history").insert(leave_record).execute()
-                    processed += 1
-                    
-                except Exception as e:
-                    logger.error(f"Failed to sync leave request record: {str(e)}")
-                    failed += 1
+            if repair and not upsert["failed"]:
+                # Requests in the range this run didn't touch were deleted in Keka
+                supabase_admin_client.table("keka_employee_leave_history").delete().gte(
+                    "from_date", from_date.isoformat()
+                ).lte("from_date", to_date.isoformat()).lt("last_synced_at", synced_at).execute()
             
-            # Update sync status
-            await self._update_sync_status("leave_history", "success", processed, failed)
+            # Update sync status; only a run that covers the gap since the last one moves the cursor
+            await self._update_sync_status(
+                "leave_history", "success", processed, failed,
+                cursor=run_started if incremental or repair else None
+            )
             
             logger.info(f"Leave history sync completed: {processed} processed, {failed} failed")
             return {
                 "success": True,
                 "processed": processed,
                 "failed": failed,
+                "from_date": from_date.isoformat(),
+                "to_date": to_date.isoformat(),
+                "modified_since": modified_since,
                 "message": f"Synced {processed} leave request records"
             }
             
@@ -482,6 +419,160 @@ class KekaEmployeeSyncService:
                 "message": "Leave history sync failed"
             }
     
+    def _build_leave_balance_record(self, balance: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Map one Keka leave balance to a keka_employee_leave_balances row (without sync times)"""
+        employee_id = balance.get("employeeId") or balance.get("employee_id")
+        leave_type = balance.get("leaveType") or balance.get("leave_type")
+        if not employee_id or not leave_type:
+            logger.warning(f"Leave balance record missing employee ID or leave type: {balance}")
+            return None
+        return {
+            "keka_employee_id": employee_id,
+            "leave_type": leave_type,
+            "total_allocated": balance.get("allocated", 0),
+            "used": balance.get("consumed", 0),
+            "remaining": balance.get("balance", 0),
+            "carry_forward": balance.get("carryForward", 0)
+        }
+    
+    def _build_attendance_record(self, record: Dict[str, Any], synced_at: str) -> Optional[Dict[str, Any]]:
+        """Map one Keka attendance entry to a keka_employee_attendance row"""
+        employee_id = record.get("employeeId") or record.get("employee_id")
+        if not employee_id or not record.get("date"):
+            logger.warning(f"Attendance record missing employee ID or date: {record}")
+            return None
+        return {
+            "keka_employee_id": employee_id,
+            "attendance_date": record.get("date"),
+            "status": record.get("status"),
+            "check_in": self._parse_datetime(record.get("checkIn")),
+            "check_out": self._parse_datetime(record.get("checkOut")),
+            "break_hours": record.get("breakHours"),
+            "total_hours": record.get("totalHours"),
+            "overtime_hours": record.get("overtimeHours"),
+            "location": record.get("location"),
+            "last_synced_at": synced_at,
+            "updated_at": synced_at
+        }
+    
+    def _build_leave_history_record(self, request: Dict[str, Any], synced_at: str) -> Optional[Dict[str, Any]]:
+        """Map one Keka leave request to a keka_employee_leave_history row"""
+        employee_id = request.get("employeeId") or request.get("employee_id")
+        if not employee_id or not request.get("id"):
+            logger.warning(f"Leave request record missing employee ID or request ID: {request}")
+            return None
+        return {
+            "keka_employee_id": employee_id,
+            "leave_request_id": request.get("id"),
+            "leave_type": request.get("leaveType") or request.get("leave_type"),
+            "from_date": request.get("fromDate") or request.get("from_date"),
+            "to_date": request.get("toDate") or request.get("to_date"),
+            "days_count": request.get("daysCount") or request.get("days_count"),
+            "reason": request.get("reason"),
+            "status": request.get("status"),
+            "applied_date": self._parse_datetime(request.get("appliedDate") or request.get("applied_date")),
+            "approved_date": self._parse_datetime(request.get("approvedDate") or request.get("approved_date")),
+            "approved_by": request.get("approvedBy") or request.get("approved_by"),
+            "comments": request.get("comments"),
+            "last_synced_at": synced_at,
+            "updated_at": synced_at
+        }
+    
+    async def _stream_upsert(
+        self,
+        pages: AsyncIterator[List[Dict[str, Any]]],
+        build_record: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+        table: str,
+        on_conflict: str
+    ) -> Dict[str, Any]:
+        """
+        Write pages from a Keka page iterator as they arrive. A producer task
+        keeps up to self.prefetch_pages pages fetched ahead, so page N+1 is
+        downloading while page N is mapped and upserted, and memory stays at a
+        few pages whatever the organization size. build_record returns None to
+        reject an item. Fetch errors are raised once the pages already
+        fetched have been written.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.prefetch_pages)
+        
+        async def _produce() -> None:
+            try:
+                async for page in pages:
+                    await queue.put(page)
+                await queue.put(None)
+            except Exception as e:
+                await queue.put(e)
+        
+        producer = asyncio.ensure_future(_produce())
+        totals = {"pages": 0, "fetched": 0, "processed": 0, "failed": 0, "batches": 0}
+        started = time.monotonic()
+        try:
+            while True:
+                page = await queue.get()
+                if page is None:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                
+                records = []
+                for item in page:
+                    try:
+                        record = build_record(item)
+                    except Exception as e:
+                        logger.error(f"Failed to map {table} record: {str(e)}")
+                        record = None
+                    if record is None:
+                        totals["failed"] += 1
+                    else:
+                        records.append(record)
+                
+                result = await self._bulk_upsert(table, records, on_conflict)
+                totals["pages"] += 1
+                totals["fetched"] += len(page)
+                totals["processed"] += result["processed"]
+                totals["failed"] += result["failed"]
+                totals["batches"] += result["batches"]
+        finally:
+            if not producer.done():
+                producer.cancel()
+        
+        elapsed = time.monotonic() - started
+        totals["seconds"] = round(elapsed, 3)
+        totals["rows_per_second"] = round(totals["processed"] / elapsed, 1) if elapsed > 0 else 0.0
+        logger.info(
+            f"Streamed {totals['fetched']} records from {totals['pages']} pages into {table}: "
+            f"{totals['processed']} written, {totals['failed']} failed ({totals['rows_per_second']} rows/s)"
+        )
+        return totals
+    
+    async def _resolve_sync_window(self, sync_type: str, from_date: Optional[date], to_date: Optional[date], lookback_days: int) -> Tuple[date, date]:
+        """
+        Default range for an incremental sync: from a few days before the last
+        successful sync (records in that trailing window can still change) to
+        today, or from the start of the month on the first run.
+        """
+        to_date = to_date or date.today()
+        if from_date:
+            return from_date, to_date
+        
+        cursor = await self._get_sync_cursor(sync_type)
+        if cursor is None:
+            return date(to_date.year, to_date.month, 1), to_date
+        return min(cursor.date() - timedelta(days=lookback_days), to_date), to_date
+    
+    async def _get_sync_cursor(self, sync_type: str) -> Optional[datetime]:
+        """Start time of the last successful incremental or repair sync of a data type"""
+        try:
+            response = supabase_admin_client.table("keka_sync_status").select("sync_cursor").eq("sync_type", sync_type).limit(1).execute()
+            value = response.data[0].get("sync_cursor") if response.data else None
+            if not value:
+                return None
+            cursor = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            return cursor if cursor.tzinfo else cursor.replace(tzinfo=timezone.utc)
+        except Exception as e:
+            logger.warning(f"Could not read {sync_type} sync cursor, falling back to the default window: {str(e)}")
+            return None
+    
     async def sync_holiday_calendars(self) -> Dict[str, Any]:
         """Sync holiday calendars from Keka"""
         try:
@@ -491,37 +582,27 @@ class KekaEmployeeSyncService:
             await self._update_sync_status("holiday_calendars", "in_progress", 0, 0)
             
             # Fetch holiday calendars from Keka API
-            calendars_data = await self._make_keka_request(
-                "GET",
-                "time/holidayscalendar"
-            )
-            
-            calendars = calendars_data.get("data", [])
+            calendars = await keka_client.get_holiday_calendars(priority=PRIORITY_BACKGROUND)
             
-            processed = 0
-            failed = 0
+            synced_at = datetime.now(timezone.utc).isoformat()
+            calendar_records = [
+                {
+                    "calendar_id": calendar.get("id"),
+                    "name": calendar.get("name"),
+                    "description": calendar.get("description"),
+                    "year": calendar.get("year", datetime.now().year),
+                    "is_active": calendar.get("isActive", True),
+                    "last_synced_at": synced_at,
+                    "updated_at": synced_at
+                }
+                for calendar in calendars
+                if calendar.get("id")
+            ]
             
-            for calendar in calendars:
-                try:
-                    calendar_record = {
-                        "calendar_id": calendar.get("id"),
-                        "name": calendar.get("name"),
-                        "description": calendar.get("description"),
-                        "year": calendar.get("year", datetime.now().year),
-                        "is_active": calendar.get("isActive", True),
-                        "last_synced_at": datetime.now().isoformat(),
-                        "updated_at": datetime.now().isoformat()
-                    }
-                    
-                    supabase_admin_client.table("keka_holiday_calendars").upsert(
-                        calendar_record,
-                        on_conflict="calendar_id, year"
-                    ).execute()
-                    
-                    processed += 1
-                except Exception as e:
-                    logger.error(f"Failed to sync holiday calendar {calendar.get('name')}: {str(e)}")
-                    failed += 1
+            processed, failed = await self._upsert_in_batches(
+                "keka_holiday_calendars", calendar_records, "calendar_id, year"
+            )
+            failed += len(calendars) - len(calendar_records)
             
             # Update sync status
             await self._update_sync_status("holiday_calendars", "success", processed, failed)
@@ -531,6 +612,7 @@ class KekaEmployeeSyncService:
                 "success": True,
                 "processed": processed,
                 "failed": failed,
+                "calendar_ids": [record["calendar_id"] for record in calendar_records if record["is_active"]],
                 "message": f"Synced {processed} holiday calendars"
             }
             
@@ -543,8 +625,13 @@ class KekaEmployeeSyncService:
                 "message": "Holiday calendars sync failed"
             }
     
-    async def sync_company_holidays(self, year: int = None) -> Dict[str, Any]:
-        """Sync company holidays"""
+    async def sync_company_holidays(self, year: int = None, refresh_calendars: bool = False) -> Dict[str, Any]:
+        """
+        Sync company holidays for every active calendar.
+        Calendars are fetched concurrently and written in one bulk upsert;
+        calendar metadata is only re-synced when older than
+        KEKA_SYNC_HOLIDAY_CALENDAR_MAX_AGE_HOURS or when refresh_calendars is set.
+        """
         try:
             if not year:
                 year = datetime.now().year
@@ -554,69 +641,72 @@ class KekaEmployeeSyncService:
             # Update sync status
             await self._update_sync_status("holidays", "in_progress", 0, 0)
             
-            # First sync holiday calendars to get available calendar IDs
-            await self.sync_holiday_calendars()
-            
-            # Get available calendar IDs
-            calendars_response = supabase_admin_client.table("keka_holiday_calendars").select("calendar_id").eq("is_active", True).execute()
-            calendar_ids = [cal["calendar_id"] for cal in calendars_response.data]
+            calendar_ids = await self._active_holiday_calendar_ids(refresh_calendars)
             
             if not calendar_ids:
                 # Fallback to environment variable
                 calendar_id = os.getenv("KEKA_CALENDAR_ID", "default")
                 calendar_ids = [calendar_id]
             
-            processed = 0
-            failed = 0
+            semaphore = asyncio.Semaphore(self.holiday_fetch_concurrency)
             
-            for calendar_id in calendar_ids:
-                try:
-                    # Fetch holidays from Keka API for this calendar
-                    holidays_data = await self._make_keka_request(
-                        "GET",
-                        f"time/holidayscalendar/{calendar_id}/holidays",
-                        params={"year": year}
-                    )
-                    
-                    holidays = holidays_data.get("data", [])
-                    
-                    # Clear existing holidays for this calendar and year
-                    supabase_admin_client.table("keka_company_holidays").delete().eq("calendar_id", calendar_id).gte("holiday_date", f"{year}-01-01").lte("holiday_date", f"{year}-12-31").execute()
-                    
-                    for holiday in holidays:
-                        try:
-                            holiday_record = {
-                                "holiday_date": holiday.get("date"),
-                                "name": holiday.get("name"),
-                                "type": holiday.get("type", "company"),
-                                "is_optional": holiday.get("isOptional", False),
-                                "calendar_id": calendar_id,
-                                "last_synced_at": datetime.now().isoformat(),
-                                "updated_at": datetime.now().isoformat()
-                            }
-                            
-                            supabase_admin_client.table("keka_company_holidays").upsert(
-                                holiday_record,
-                                on_conflict="holiday_date, name, calendar_id"
-                            ).execute()
-                            
-                            processed += 1
-                        except Exception as e:
-                            logger.error(f"Failed to sync holiday {holiday.get('name')}: {str(e)}")
-                            failed += 1
-                            
-                except Exception as e:
-                    logger.error(f"Failed to sync holidays for calendar {calendar_id}: {str(e)}")
+            async def _fetch(calendar_id: str) -> List[Dict[str, Any]]:
+                async with semaphore:
+                    return await keka_client.get_holidays(calendar_id, year=year, priority=PRIORITY_BACKGROUND)
+            
+            results = await asyncio.gather(*(_fetch(calendar_id) for calendar_id in calendar_ids), return_exceptions=True)
+            
+            synced_at = datetime.now(timezone.utc).isoformat()
+            holiday_records = []
+            fetched_calendar_ids = []
+            failed = 0
+            for calendar_id, holidays in zip(calendar_ids, results):
+                if isinstance(holidays, Exception):
+                    logger.error(f"Failed to sync holidays for calendar {calendar_id}: {str(holidays)}")
                     failed += 1
+                    continue
+                
+                fetched_calendar_ids.append(calendar_id)
+                for holiday in holidays:
+                    if not holiday.get("date") or not holiday.get("name"):
+                        logger.warning(f"Holiday missing date or name in calendar {calendar_id}: {holiday}")
+                        failed += 1
+                        continue
+                    holiday_records.append({
+                        "holiday_date": holiday.get("date"),
+                        "name": holiday.get("name"),
+                        "type": holiday.get("type", "company"),
+                        "is_optional": holiday.get("isOptional", False),
+                        "calendar_id": calendar_id,
+                        "last_synced_at": synced_at,
+                        "updated_at": synced_at
+                    })
+            
+            processed, upsert_failed = await self._upsert_in_batches(
+                "keka_company_holidays", holiday_records, "holiday_date, name, calendar_id"
+            )
+            failed += upsert_failed
+            
+            if fetched_calendar_ids and not upsert_failed:
+                # Holidays removed in Keka are the ones this run didn't rewrite
+                supabase_admin_client.table("keka_company_holidays").delete().in_(
+                    "calendar_id", fetched_calendar_ids
+                ).gte("holiday_date", f"{year}-01-01").lte("holiday_date", f"{year}-12-31").lt(
+                    "last_synced_at", synced_at
+                ).execute()
             
             # Update sync status
             await self._update_sync_status("holidays", "success", processed, failed)
             
-            logger.info(f"Holidays sync completed: {processed} holidays synced, {failed} failed")
+            logger.info(
+                f"Holidays sync completed: {processed} holidays from {len(fetched_calendar_ids)} calendars synced, "
+                f"{failed} failed"
+            )
             return {
                 "success": True,
                 "processed": processed,
                 "failed": failed,
+                "calendars": len(fetched_calendar_ids),
                 "message": f"Synced {processed} holidays for {year}"
             }
             
@@ -629,8 +719,279 @@ class KekaEmployeeSyncService:
                 "message": "Holidays sync failed"
             }
     
-    async def _update_sync_status(self, sync_type: str, status: str, processed: int, failed: int, error_message: str = None) -> None:
-        """Update sync status in database"""
+    async def _active_holiday_calendar_ids(self, refresh: bool = False) -> List[str]:
+        """Active calendar IDs, re-syncing calendar metadata from Keka only when it is stale"""
+        calendars_response = supabase_admin_client.table("keka_holiday_calendars").select(
+            "calendar_id, last_synced_at"
+        ).eq("is_active", True).execute()
+        calendars = calendars_response.data or []
+        
+        if not refresh and calendars:
+            cutoff = datetime.now(timezone.utc) - self.holiday_calendar_max_age
+            try:
+                synced = [
+                    datetime.fromisoformat(calendar["last_synced_at"].replace("Z", "+00:00"))
+                    for calendar in calendars
+                ]
+                if all(
+                    (synced_at if synced_at.tzinfo else synced_at.replace(tzinfo=timezone.utc)) >= cutoff
+                    for synced_at in synced
+                ):
+                    return [calendar["calendar_id"] for calendar in calendars]
+            except (TypeError, ValueError, AttributeError):
+                # Missing or unparseable sync time: treat the metadata as stale
+                pass
+        
+        logger.info("Holiday calendars are stale, re-syncing them first")
+        result = await self.sync_holiday_calendars()
+        if result.get("success"):
+            return result["calendar_ids"]
+        # Keka failed: carry on with the calendars we already know about
+        return [calendar["calendar_id"] for calendar in calendars]
+    
+    async def sync_employee_payslips(self, months: int = 6, force: bool = False) -> Dict[str, Any]:
+        """
+        Sync processed pay registers into keka_employee_payslips.
+        Each processed pay cycle's register is fetched once; a cycle whose
+        rows were all written is checkpointed on the payslips status row and
+        skipped unless force is set, since processed payroll is final. A
+        cycle with any failed row is fetched again on the next run.
+        """
+        try:
+            logger.info("Starting payslips sync...")
+            
+            # Update sync status
+            await self._update_sync_status("payslips", "in_progress", 0, 0)
+            
+            pay_groups = await keka_client.get_all("payroll/paygroups", priority=PRIORITY_BACKGROUND)
+            
+            processed = 0
+            failed = 0
+            cycles_synced = 0
+            cycles_skipped = 0
+            completed_cycles = self._load_completed_pay_cycles()
+            
+            for pay_group in pay_groups:
+                pay_group_id = pay_group.get("payGroupId") or pay_group.get("id")
+                if not pay_group_id:
+                    continue
+                
+                pay_cycles = await keka_client.get_all(
+                    f"payroll/paygroups/{pay_group_id}/paycycles",
+                    priority=PRIORITY_BACKGROUND
+                )
+                
+                # Only processed cycles, most recent first
+                processed_cycles = [cycle for cycle in pay_cycles if cycle.get("runStatus", 0) == 1]
+                processed_cycles.sort(
+                    key=lambda cycle: self._parse_pay_period_date(cycle.get("startDate")) or date.min,
+                    reverse=True
+                )
+                
+                for cycle in processed_cycles[:months]:
+                    pay_cycle_id = cycle.get("payCycleId") or cycle.get("id") or cycle.get("identifier")
+                    if not pay_cycle_id:
+                        continue
+                    
+                    if not force and str(pay_cycle_id) in completed_cycles:
+                        cycles_skipped += 1
+                        continue
+                    
+                    try:
+                        records = await self._fetch_pay_register_records(pay_group_id, pay_cycle_id, cycle)
+                        ok, bad = await self._upsert_in_batches(
+                            "keka_employee_payslips", records, "keka_employee_id,pay_slip_id"
+                        )
+                        processed += ok
+                        failed += bad
+                        cycles_synced += 1
+                        if bad == 0:
+                            # Only a cycle written in full is final; a partial one is retried next run
+                            completed_cycles[str(pay_cycle_id)] = None
+                            self._save_completed_pay_cycles(completed_cycles)
+                    except Exception as e:
+                        logger.error(f"Failed to sync pay register for cycle {pay_cycle_id}: {str(e)}")
+                        failed += 1
+            
+            # Update sync status
+            await self._update_sync_status("payslips", "success", processed, failed)
+            
+            logger.info(
+                f"Payslips sync completed: {processed} payslips from {cycles_synced} pay cycles "
+                f"({cycles_skipped} already synced), {failed} failed"
+            )
+            return {
+                "success": True,
+                "processed": processed,
+                "failed": failed,
+                "cycles_synced": cycles_synced,
+                "cycles_skipped": cycles_skipped,
+                "message": f"Synced {processed} payslips from {cycles_synced} pay cycles"
+            }
+            
+        except Exception as e:
+            logger.error(f"Payslips sync failed: {str(e)}")
+            await self._update_sync_status("payslips", "failed", 0, 0, str(e))
+            return {
+                "success": False,
+                "error": str(e),
+                "message": "Payslips sync failed"
+            }
+    
+    def _load_completed_pay_cycles(self) -> Dict[str, None]:
+        """Pay cycles fully written by earlier runs, oldest first, from the payslips checkpoint"""
+        try:
+            response = supabase_admin_client.table("keka_sync_status").select("checkpoint").eq("sync_type", "payslips").limit(1).execute()
+            checkpoint = (response.data[0].get("checkpoint") if response.data else None) or {}
+            return dict.fromkeys(checkpoint.get("completed_cycles") or [])
+        except Exception as e:
+            # Without the checkpoint every cycle is refetched; upserts make that safe
+            logger.warning(f"Could not read the payslips checkpoint: {str(e)}")
+            return {}
+    
+    def _save_completed_pay_cycles(self, completed_cycles: Dict[str, None]) -> None:
+        # Keep the newest entries; cycles that old have long left the sync window
+        cycle_ids = list(completed_cycles)[-self.pay_cycle_checkpoint_size:]
+        try:
+            supabase_admin_client.table("keka_sync_status").update(
+                {"checkpoint": {"completed_cycles": cycle_ids}}
+            ).eq("sync_type", "payslips").execute()
+        except Exception as e:
+            logger.warning(f"Could not save the payslips checkpoint: {str(e)}")
+    
+    async def _fetch_pay_register_records(self, pay_group_id: str, pay_cycle_id: str, cycle: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Fetch every page of one pay register and map it to payslip rows"""
+        period_start = self._parse_pay_period_date(cycle.get("startDate"))
+        period_end = self._parse_pay_period_date(cycle.get("endDate"))
+        now = datetime.now().isoformat()
+        
+        records = []
+        async for page in keka_client.iter_pages(
+            f"payroll/paygroups/{pay_group_id}/paycycles/{pay_cycle_id}/payregister",
+            params={"payrollStatus": "Processed", "includeOutSideCTCPayables": "false"},
+            priority=PRIORITY_BACKGROUND
+        ):
+            for record in page:
+                employee_id = record.get("employeeId")
+                if not employee_id:
+                    continue
+                records.append({
+                    "keka_employee_id": employee_id,
+                    "pay_period": cycle.get("month", ""),
+                    "start_date": period_start.isoformat() if period_start else None,
+                    "end_date": period_end.isoformat() if period_end else None,
+                    "period_year": period_start.year if period_start else None,
+                    "period_month": period_start.month if period_start else None,
+                    "gross_amount": record.get("grossAmount", 0),
+                    "net_amount": record.get("netAmount", 0),
+                    "working_days": record.get("workingDays", 0),
+                    "loss_of_pay_days": record.get("lossOfPayDays", 0),
+                    "no_of_pay_days": record.get("noOfPayDays", 0),
+                    "earnings": record.get("earnings", []),
+                    "deductions": record.get("deductions", []),
+                    "contributions": record.get("contributions", []),
+                    "reimbursements": record.get("reimbursements", []),
+                    "pay_slip_id": pay_cycle_id,
+                    "pay_group_id": pay_group_id,
+                    "status": "Processed",
+                    "last_synced_at": now,
+                    "updated_at": now
+                })
+        
+        logger.info(f"Fetched {len(records)} pay register records for cycle {pay_cycle_id}")
+        return records
+    
+    async def _upsert_in_batches(self, table: str, records: List[Dict[str, Any]], on_conflict: str) -> Tuple[int, int]:
+        """Upsert records in batches; returns (processed, failed)"""
+        result = await self._bulk_upsert(table, records, on_conflict)
+        return result["processed"], result["failed"]
+    
+    async def _bulk_upsert(self, table: str, records: List[Dict[str, Any]], on_conflict: str) -> Dict[str, Any]:
+        """
+        Upsert records in chunks of self.upsert_batch_size, with up to
+        self.upsert_concurrency chunks in flight. A failed chunk is retried
+        row by row so one bad record doesn't drop the rest.
+        """
+        # Postgres rejects an upsert that touches the same row twice, so keep the last copy of each key
+        conflict_columns = [column.strip() for column in on_conflict.split(",")]
+        unique_records = list({
+            tuple(record.get(column) for column in conflict_columns): record
+            for record in records
+        }.values())
+        
+        batches = [
+            unique_records[start:start + self.upsert_batch_size]
+            for start in range(0, len(unique_records), self.upsert_batch_size)
+        ]
+        semaphore = asyncio.Semaphore(self.upsert_concurrency)
+        loop = asyncio.get_running_loop()
+        
+        def _upsert(rows) -> None:
+            supabase_admin_client.table(table).upsert(rows, on_conflict=on_conflict).execute()
+        
+        async def _write_batch(number: int, batch: List[Dict[str, Any]]) -> Tuple[int, int]:
+            async with semaphore:
+                started = time.monotonic()
+                try:
+                    # supabase-py is synchronous; run batches on the default executor
+                    await loop.run_in_executor(None, _upsert, batch)
+                    elapsed = time.monotonic() - started
+                    record_db_time(elapsed)
+                    logger.info(
+                        f"Upserted batch {number}/{len(batches)} into {table}: {len(batch)} rows "
+                        f"in {elapsed:.2f}s ({len(batch) / max(elapsed, 1e-6):.0f} rows/s)"
+                    )
+                    return len(batch), 0
+                except Exception as e:
+                    record_db_time(time.monotonic() - started)
+                    logger.warning(f"Batch {number} upsert into {table} failed, retrying row by row: {str(e)}")
+                
+                processed = 0
+                failed = 0
+                started = time.monotonic()
+                for record in batch:
+                    try:
+                        await loop.run_in_executor(None, _upsert, record)
+                        processed += 1
+                    except Exception as row_error:
+                        logger.error(f"Failed to upsert into {table}: {str(row_error)}")
+                        failed += 1
+                record_db_time(time.monotonic() - started)
+                return processed, failed
+        
+        started = time.monotonic()
+        results = await asyncio.gather(*(
+            _write_batch(number, batch) for number, batch in enumerate(batches, start=1)
+        ))
+        elapsed = time.monotonic() - started
+        
+        processed = sum(ok for ok, _ in results)
+        return {
+            "processed": processed,
+            "failed": sum(bad for _, bad in results),
+            "batches": len(batches),
+            "duplicates_dropped": len(records) - len(unique_records),
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(processed / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+    
+    @staticmethod
+    def _parse_pay_period_date(value: Optional[str]) -> Optional[date]:
+        """Parse Keka pay cycle dates, which come as ISO strings or like '01 Jul 2024'"""
+        if not value:
+            return None
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).date()
+        except ValueError:
+            pass
+        try:
+            return datetime.strptime(value.strip(), "%d %b %Y").date()
+        except ValueError:
+            logger.warning(f"Failed to parse pay period date '{value}'")
+            return None
+    
+    async def _update_sync_status(self, sync_type: str, status: str, processed: int, failed: int, error_message: str = None, cursor: Optional[datetime] = None) -> None:
+        """Update sync status in database; cursor, when given, becomes the incremental watermark"""
         try:
             status_record = {
                 "sync_type": sync_type,
@@ -641,6 +1002,14 @@ class KekaEmployeeSyncService:
                 "error_message": error_message,
                 "updated_at": datetime.now().isoformat()
             }
+            if cursor is not None:
+                status_record["sync_cursor"] = cursor.isoformat()
+            
+            # Each in_progress -> success/failed pair becomes one keka_sync_runs record
+            if status == "in_progress":
+                keka_sync_run_service.stage_started(sync_type)
+            else:
+                keka_sync_run_service.stage_finished(sync_type, status, processed, failed, error_message)
             
             supabase_admin_client.table("keka_sync_status").upsert(
                 status_record,
@@ -669,13 +1038,62 @@ class KekaEmployeeSyncService:
             logger.warning(f"Failed to parse date '{date_string}': {str(e)}")
             return None
     
+    async def apply_employee_changes(self, employees: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Upsert changed Keka employee objects (e.g. from a webhook) into keka_employees"""
+        synced_at = datetime.now(timezone.utc).isoformat()
+        records = [record for record in (self._build_employee_record(e, synced_at) for e in employees) if record]
+        result = await self._bulk_upsert("keka_employees", records, "keka_employee_id")
+        employee_directory_service.invalidate(
+            emails=[record["email"] for record in records if record.get("email")],
+            employee_ids=[record["keka_employee_id"] for record in records]
+        )
+        return result
+    
+    async def apply_leave_request_changes(self, leave_requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Upsert changed Keka leave requests into keka_employee_leave_history"""
+        synced_at = datetime.now(timezone.utc).isoformat()
+        records = [record for record in (self._build_leave_history_record(r, synced_at) for r in leave_requests) if record]
+        return await self._bulk_upsert("keka_employee_leave_history", records, "keka_employee_id,leave_request_id")
+    
+    async def apply_attendance_changes(self, attendance_records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Upsert changed Keka attendance entries into keka_employee_attendance"""
+        synced_at = datetime.now(timezone.utc).isoformat()
+        records = [record for record in (self._build_attendance_record(r, synced_at) for r in attendance_records) if record]
+        return await self._bulk_upsert("keka_employee_attendance", records, "keka_employee_id,attendance_date")
+    
+    async def refresh_employee(self, employee_id: str) -> Dict[str, Any]:
+        """Re-read one employee from Keka and upsert it"""
+        employee = await keka_client.get_employee(employee_id, priority=PRIORITY_BACKGROUND)
+        return await self.apply_employee_changes([employee] if employee else [])
+    
+    async def refresh_employee_leave_balances(self, employee_id: str) -> Dict[str, Any]:
+        """
+        Re-read one employee's leave balances from Keka, upsert them, then drop
+        leave types Keka no longer returns for them
+        """
+        balances = await keka_client.get_leave_balances(employee_id=employee_id, priority=PRIORITY_BACKGROUND)
+        synced_at = datetime.now(timezone.utc).isoformat()
+        records = []
+        for balance in balances:
+            record = self._build_leave_balance_record({"employeeId": employee_id, **balance})
+            if record:
+                records.append({**record, "last_synced_at": synced_at, "updated_at": synced_at})
+        
+        result = await self._bulk_upsert("keka_employee_leave_balances", records, "keka_employee_id,leave_type")
+        if records and not result["failed"]:
+            supabase_admin_client.table("keka_employee_leave_balances").delete().eq(
+                "keka_employee_id", employee_id
+            ).lt("last_synced_at", synced_at).execute()
+        return result
+    
     async def get_sync_status(self) -> Dict[str, Any]:
-        """Get current sync status for all data types"""
+        """Get current sync status for all data types, with the latest run history"""
         try:
             response = supabase_admin_client.table("keka_sync_status").select("*").execute()
             return {
                 "success": True,
-                "data": response.data
+                "data": response.data,
+                "recent_runs": keka_sync_run_service.get_recent_runs()
             }
         except Exception as e:
             logger.error(f"Failed to get sync status: {str(e)}")
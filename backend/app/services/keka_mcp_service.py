@@ -4,23 +4,58 @@ Handles all Keka API interactions with email-based authentication using per-user
 """
 
 import os
+import copy
 import json
 import asyncio
 import logging
 from typing import Optional, Dict, List, Any
-from datetime import datetime, date, timedelta
+from datetime import datetime, date
 from fastapi import HTTPException
-import httpx
 from app.models.hr import (
     EmployeeProfile, LeaveBalance, LeaveHistory, AttendanceRecord,
     Payslip, Holiday, KekaMCPResponse, LeaveApplication, LeaveStatus
 )
 from app.services.keka_token_service import keka_token_service
+from app.services.keka_client import keka_client, KekaError, KekaCircuitOpenError
+from app.services.hr_read_cache_service import hr_read_cache_service
+from app.services.keka_db_cache_service import keka_db_cache_service
+from app.services.employee_directory_service import employee_directory_service
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+class _UserTokenProvider:
+    """
+    Token provider for keka_client backed by one user's OAuth tokens.
+    Reuses the request-scoped token memo and refreshes through keka_token_service.
+    """
+
+    def __init__(self, server: "KekaMCPServer"):
+        self.server = server
+
+    async def get_token(self, force_refresh: bool = False) -> Optional[str]:
+        if not force_refresh:
+            return await self.server._ensure_authenticated()
+        
+        email = self.server.authenticated_user_email
+        logger.warning(f"401 error for {email}, attempting token refresh")
+        refreshed_tokens = await keka_token_service.refresh_user_tokens(email)
+        if not refreshed_tokens:
+            return None
+        
+        # Later calls in this request should use the new token
+        refreshed_future = asyncio.get_event_loop().create_future()
+        refreshed_future.set_result(refreshed_tokens.access_token)
+        self.server._request_memo["access_token"] = refreshed_future
+        return refreshed_tokens.access_token
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        # The forced refresh above replaces the memoized token
+        pass
+
+
 class KekaMCPServer:
     """
     Keka MCP Server for ESS Integration  
@@ -39,23 +74,39 @@ class KekaMCPServer:
             # Fallback to environment variable if company name not provided
             self.api_base_url = os.getenv("KEKA_API_BASE_URL", "https://api.keka.com/v1")
         
-        # Current user context
+        # Current user context; only set on request-scoped copies from for_user()
         self.authenticated_user_email: Optional[str] = None
         
-        # Employee ID cache for email-to-ID mapping (per user)
-        self.employee_cache: Dict[str, str] = {}
-        
-        # Rate limiting (per user)
-        self.request_count: Dict[str, Dict] = {}
-        self.rate_limit_per_minute = 50
+        # Per-request memo (access token, employee ID); fresh on every for_user() copy
+        self._request_memo: Dict[str, asyncio.Future] = {}
+
+    def for_user(self, email: str) -> "KekaMCPServer":
+        """
+        Return a request-scoped copy of this service bound to one user.
 
-    def set_authenticated_user(self, email: str) -> None:
-        """Set the authenticated user's email for this session"""
+        Config stays shared with the global instance; only the user
+        identity lives on the copy, so concurrent requests can't see each
+        other's user across an await.
+        """
         if not email or not self._is_valid_email(email):
             raise ValueError("Invalid email address")
         
-        self.authenticated_user_email = email
-        logger.info(f"Set authenticated user: {email}")
+        scoped = copy.copy(self)
+        scoped.authenticated_user_email = email
+        scoped._request_memo = {}
+        return scoped
+
+    async def _memoized(self, key: str, factory) -> Any:
+        """
+        Run `factory` at most once per request-scoped instance.
+        Concurrent callers share the same in-flight result.
+        """
+        future = self._request_memo.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._request_memo[key] = future
+        # Shield so one caller timing out doesn't cancel the lookup for the others
+        return await asyncio.shield(future)
 
     def _is_valid_email(self, email: str) -> bool:
         """Basic email validation"""
@@ -63,6 +114,10 @@ class KekaMCPServer:
 
     async def _ensure_authenticated(self) -> str:
         """Ensure we have a valid access token for the current user and return it"""
+        return await self._memoized("access_token", self._resolve_access_token)
+
+    async def _resolve_access_token(self) -> str:
+        """Check the user's Keka authentication and return a valid access token"""
         if not self.authenticated_user_email:
             raise HTTPException(status_code=401, detail="User not authenticated")
 
@@ -85,151 +140,69 @@ class KekaMCPServer:
 
         return tokens.access_token
 
-    def _check_rate_limit(self, email: str) -> None:
-        """Check and enforce rate limiting per user"""
-        current_time = datetime.now()
-        
-        if email not in self.request_count:
-            self.request_count[email] = {"count": 0, "reset_time": current_time + timedelta(minutes=1)}
-        
-        user_data = self.request_count[email]
-        
-        if current_time > user_data["reset_time"]:
-            user_data["count"] = 0
-            user_data["reset_time"] = current_time + timedelta(minutes=1)
-        
-        if user_data["count"] >= self.rate_limit_per_minute:
-            raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
-        
-        user_data["count"] += 1
-
     async def get_employee_id_by_email(self, email: str) -> str:
-        """Get employee ID by email with caching and database storage"""
-        # Check cache first
-        if email in self.employee_cache:
-            return self.employee_cache[email]
-        
-        # Check database cache
-        try:
-            from app.utils.supabase_client import supabase_admin_client
-            
-            cache_response = supabase_admin_client.table("keka_employee_cache").select("employee_id, employee_data, cache_expires_at").eq("user_email", email).single().execute()
-            
-            if cache_response.data:
-                cache_expires_at = datetime.fromisoformat(cache_response.data["cache_expires_at"])
-                if cache_expires_at > datetime.now():
-                    employee_id = cache_response.data["employee_id"]
-                    self.employee_cache[email] = employee_id
-                    return employee_id
-        except Exception as e:
-            logger.debug(f"Database cache miss for employee lookup: {str(e)}")
-        
-        # Fetch from API
-        access_token = await self._ensure_authenticated()
-        
+        """Get employee ID by email from the shared employee directory"""
+        # Misses are searched in Keka with the current user's token
+        employee_id = await employee_directory_service.resolve(email, lookup=self._find_employee_by_email)
+        if not employee_id:
+            raise HTTPException(status_code=404, detail=f"Employee not found with email: {email}")
+        return employee_id
+
+    async def _find_employee_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Search Keka for an employee by email using the current user's token"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.api_base_url}/hris/employees",
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "Content-Type": "application/json"
-                    },
-                    params={"email": email}
-                )
-                
-                if response.status_code == 200:
-                    employees = response.json()
-                    if employees and len(employees) > 0:
-                        employee_data = employees[0]
-                        employee_id = employee_data["id"]
-                        
-                        # Cache in memory
-                        self.employee_cache[email] = employee_id
-                        
-                        # Cache in database (expires in 24 hours)
-                        try:
-                            cache_expires_at = datetime.now() + timedelta(hours=24)
-                            supabase_admin_client.table("keka_employee_cache").upsert({
-                                "user_email": email,
-                                "employee_id": employee_id,
-                                "employee_data": employee_data,
-                                "cache_expires_at": cache_expires_at.isoformat(),
-                                "updated_at": datetime.now().isoformat()
-                            }, on_conflict="user_email").execute()
-                        except Exception as e:
-                            logger.warning(f"Failed to cache employee data: {str(e)}")
-                        
-                        return employee_id
-                    else:
-                        raise HTTPException(status_code=404, detail=f"Employee not found with email: {email}")
-                else:
-                    logger.error(f"Employee lookup failed: {response.status_code} - {response.text}")
-                    raise HTTPException(status_code=response.status_code, detail="Failed to fetch employee data")
-                    
-        except httpx.HTTPError as e:
-            logger.error(f"HTTP error during employee lookup: {str(e)}")
-            raise HTTPException(status_code=500, detail="Employee lookup service unavailable")
+            return await keka_client.find_employee_by_email(
+                email,
+                token_provider=_UserTokenProvider(self),
+                cache_scope=self.authenticated_user_email or "global",
+            )
+        except KekaError as e:
+            if e.status_code is None or e.status_code >= 500:
+                logger.error(f"HTTP error during employee lookup: {str(e)}")
+                raise HTTPException(status_code=500, detail="Employee lookup service unavailable")
+            logger.error(f"Employee lookup failed: {e.status_code} - {e.body}")
+            raise HTTPException(status_code=e.status_code, detail="Failed to fetch employee data")
 
     async def _make_keka_request(self, method: str, endpoint: str, **kwargs) -> Dict[str, Any]:
-        """Make authenticated request to Keka API"""
+        """Make authenticated request to Keka API through the shared Keka client"""
         if not self.authenticated_user_email:
             raise HTTPException(status_code=401, detail="User not authenticated")
         
-        self._check_rate_limit(self.authenticated_user_email)
-        access_token = await self._ensure_authenticated()
-        
         start_time = datetime.now()
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await getattr(client, method.lower())(
-                    f"{self.api_base_url}/{endpoint.lstrip('/')}",
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "Content-Type": "application/json",
-                        **kwargs.get("headers", {})
-                    },
-                    **{k: v for k, v in kwargs.items() if k != "headers"}
-                )
-                
-                # Log API usage for monitoring
-                response_time = int((datetime.now() - start_time).total_seconds() * 1000)
-                await self._log_api_usage(endpoint, method, response.status_code, response_time)
-                
-                if response.status_code == 200:
-                    return response.json()
-                elif response.status_code == 404:
-                    raise HTTPException(status_code=404, detail="Resource not found")
-                elif response.status_code == 403:
-                    raise HTTPException(status_code=403, detail="Access denied")
-                elif response.status_code == 401:
-                    # Token might be invalid, try refreshing
-                    logger.warning(f"401 error for {self.authenticated_user_email}, attempting token refresh")
-                    refreshed_tokens = await keka_token_service.refresh_user_tokens(self.authenticated_user_email)
-                    if refreshed_tokens:
-                        # Retry the request with new token
-                        response = await getattr(client, method.lower())(
-                            f"{self.api_base_url}/{endpoint.lstrip('/')}",
-                            headers={
-                                "Authorization": f"Bearer {refreshed_tokens.access_token}",
-                                "Content-Type": "application/json",
-                                **kwargs.get("headers", {})
-                            },
-                            **{k: v for k, v in kwargs.items() if k != "headers"}
-                        )
-                        if response.status_code == 200:
-                            return response.json()
-                    
-                    raise HTTPException(status_code=401, detail="Keka authentication failed")
-                else:
-                    logger.error(f"Keka API error: {response.status_code} - {response.text}")
-                    raise HTTPException(status_code=response.status_code, detail="Keka API request failed")
+            data = await keka_client.request_json(
+                method,
+                endpoint,
+                params=kwargs.get("params"),
+                json=kwargs.get("json"),
+                token_provider=_UserTokenProvider(self),
+                cache_scope=self.authenticated_user_email,
+            )
+            response_time = int((datetime.now() - start_time).total_seconds() * 1000)
+            await self._log_api_usage(endpoint, method, 200, response_time)
+            return data
                     
-        except httpx.HTTPError as e:
-            logger.error(f"HTTP error during Keka request: {str(e)}")
-            await self._log_api_usage(endpoint, method, 500, (datetime.now() - start_time).total_seconds() * 1000, str(e))
-            raise HTTPException(status_code=500, detail="Keka service unavailable")
+        except KekaError as e:
+            response_time = int((datetime.now() - start_time).total_seconds() * 1000)
+            await self._log_api_usage(endpoint, method, e.status_code or 500, response_time, str(e))
+            
+            if e.status_code == 404:
+                raise HTTPException(status_code=404, detail="Resource not found")
+            elif e.status_code == 403:
+                raise HTTPException(status_code=403, detail="Access denied")
+            elif e.status_code == 401:
+                raise HTTPException(status_code=401, detail="Keka authentication failed")
+            elif isinstance(e, KekaCircuitOpenError):
+                raise HTTPException(
+                    status_code=503,
+                    detail="Keka service unavailable",
+                    headers={"Retry-After": str(int(e.retry_after) + 1)}
+                )
+            elif e.status_code is None:
+                raise HTTPException(status_code=500, detail="Keka service unavailable")
+            else:
+                raise HTTPException(status_code=e.status_code, detail="Keka API request failed")
 
     async def _log_api_usage(self, endpoint: str, method: str, status_code: int, response_time: int, error_message: Optional[str] = None):
         """Log API usage for monitoring and analytics"""
@@ -251,50 +224,28 @@ class KekaMCPServer:
 
     # Employee Profile Methods
     async def _get_current_user_employee_id(self) -> str:
-        """Get employee ID for current authenticated user from stored tokens"""
+        """Get employee ID for current authenticated user, resolved once per request"""
+        return await self._memoized("employee_id", self._resolve_current_user_employee_id)
+
+    async def _resolve_current_user_employee_id(self) -> str:
+        """Look up the employee ID from stored tokens, falling back to the employee directory"""
         if not self.authenticated_user_email:
             raise HTTPException(status_code=401, detail="No authenticated user")
         
         try:
             # Get from stored tokens first
             tokens = await keka_token_service.get_user_tokens(self.authenticated_user_email)
-            if tokens and hasattr(tokens, 'keka_employee_id') and tokens.keka_employee_id:
+            if tokens and getattr(tokens, 'keka_employee_id', None):
                 return tokens.keka_employee_id
-                
-            # If not stored, search by email (no /hris/me endpoint exists)
-            logger.info(f"Employee ID not cached, searching by email: {self.authenticated_user_email}")
-            
-            try:
-                # Search employees by email - this is the correct approach
-                params = {'email': self.authenticated_user_email}
-                response = await self._make_keka_request("GET", "hris/employees", params=params)
-                
-                employees = response if isinstance(response, list) else response.get('data', [])
-                if employees and len(employees) > 0:
-                    employee_id = employees[0]['id']
-                    logger.info(f"Found employee ID: {employee_id} for {self.authenticated_user_email}")
-                    return employee_id
-                else:
-                    logger.error(f"No employee found with email: {self.authenticated_user_email}")
-                    raise HTTPException(
-                        status_code=404, 
-                        detail=f"Employee not found with email: {self.authenticated_user_email}"
-                    )
-            except HTTPException as e:
-                # Re-raise HTTP exceptions
-                raise e
-            except Exception as e:
-                logger.error(f"Error searching for employee by email: {str(e)}")
-                raise HTTPException(
-                    status_code=500, 
-                    detail="Failed to search for employee information"
-                )
-                
-            raise HTTPException(
-                status_code=404, 
-                detail="Could not find employee ID for authenticated user"
-            )
-            
+        except Exception as e:
+            logger.warning(f"Could not read stored Keka tokens for {self.authenticated_user_email}: {str(e)}")
+        
+        try:
+            # Not stored: the shared directory (no /hris/me endpoint exists)
+            return await self.get_employee_id_by_email(self.authenticated_user_email)
+        except HTTPException:
+            # 404 for an unknown email, or the lookup's own status
+            raise
         except Exception as e:
             logger.error(f"Error getting employee ID: {str(e)}")
             raise HTTPException(status_code=500, detail="Failed to get employee information")
@@ -391,6 +342,7 @@ class KekaMCPServer:
             payload["halfDayType"] = leave_application.half_day_type
             
         data = await self._make_keka_request("POST", "time/leaverequests", json=payload)
+        await self._invalidate_cached_leave_data()
         
         return {
             "application_id": data["id"],
@@ -399,6 +351,14 @@ class KekaMCPServer:
         }
 
     # Attendance Methods
+    async def _invalidate_cached_leave_data(self) -> None:
+        """Make the HR read cache refetch balances and requests after a leave write"""
+        try:
+            employee_id = await self._get_current_user_employee_id()
+            hr_read_cache_service.invalidate_employee(employee_id)
+        except Exception as e:
+            logger.warning(f"Failed to invalidate cached leave data: {str(e)}")
+
     async def get_my_attendance(self, from_date: date, to_date: date) -> List[AttendanceRecord]:
         """Get attendance records for the authenticated user"""
         # Note: Employee ID may not be required as request is authenticated per user
@@ -428,6 +388,61 @@ class KekaMCPServer:
 
     # Payslip Methods - Updated based on salary-variance implementation
     async def get_my_payslips(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Get user's payslips/salary information.
+        Served from the synced payslip index; falls back to scanning the
+        Keka pay registers only when nothing has been synced for the user.
+        """
+        try:
+            employee_id = await self._get_current_user_employee_id()
+            rows = await keka_db_cache_service.get_cached_payslips(
+                employee_id,
+                from_date=self._parse_period_bound(start_date),
+                to_date=self._parse_period_bound(end_date)
+            )
+            if rows:
+                payslips = [self._payslip_from_row(row) for row in rows]
+                return {
+                    "success": True,
+                    "data": payslips,
+                    "message": f"Retrieved {len(payslips)} payslips successfully"
+                }
+        except Exception as e:
+            logger.warning(f"Payslip index lookup failed, scanning pay registers: {str(e)}")
+        
+        return await self._scan_pay_registers(start_date, end_date)
+
+    @staticmethod
+    def _parse_period_bound(value: Any) -> Optional[date]:
+        """Parse an ISO date filter; anything else means no bound"""
+        if not isinstance(value, str) or not value:
+            return None
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).date()
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _payslip_from_row(row: Dict[str, Any]) -> Dict[str, Any]:
+        """Map a keka_employee_payslips row to the pay-register payslip shape"""
+        return {
+            "payPeriod": row.get("pay_period", ""),
+            "startDate": row.get("start_date", ""),
+            "endDate": row.get("end_date", ""),
+            "grossAmount": float(row.get("gross_amount") or 0),
+            "netAmount": float(row.get("net_amount") or 0),
+            "workingDays": row.get("working_days", 0),
+            "lossOfPayDays": row.get("loss_of_pay_days", 0),
+            "noOfPayDays": row.get("no_of_pay_days", 0),
+            "earnings": row.get("earnings") or [],
+            "deductions": row.get("deductions") or [],
+            "contributions": row.get("contributions") or [],
+            "reimbursements": row.get("reimbursements") or [],
+            "paySlipId": row.get("pay_slip_id"),
+            "status": row.get("status", "Processed")
+        }
+
+    async def _scan_pay_registers(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict[str, Any]:
         """
         Get user's payslips/salary information from pay register
         Based on salary-variance implementation using correct Keka endpoints
@@ -546,6 +561,12 @@ class KekaMCPServer:
     async def get_my_payslip(self, month: int, year: int) -> Payslip:
         """Get payslip for the authenticated user - Updated to use correct endpoints"""
         try:
+            # Direct (employee, period) lookup in the synced payslip index
+            employee_id = await self._get_current_user_employee_id()
+            row = await keka_db_cache_service.get_cached_payslip(employee_id, year, month)
+            if row:
+                return self._payslip_model(employee_id, month, year, self._payslip_from_row(row))
+            
             # Use the new payslips method to get all payslips, then filter
             payslips_response = await self.get_my_payslips()
             
@@ -580,19 +601,7 @@ class KekaMCPServer:
             if not target_payslip:
                 raise HTTPException(status_code=404, detail=f"Payslip not found for {month}/{year}")
             
-            return Payslip(
-                employee_id=await self._get_current_user_employee_id(),
-                month=month,
-                year=year,
-                pay_period=target_payslip.get("payPeriod", ""),
-                gross_salary=target_payslip.get("grossAmount", 0),
-                net_salary=target_payslip.get("netAmount", 0),
-                total_deductions=target_payslip.get("grossAmount", 0) - target_payslip.get("netAmount", 0),
-                earnings=target_payslip.get("earnings", []),
-                deductions=target_payslip.get("deductions", []),
-                ytd_gross=None,  # Not available in pay register
-                ytd_net=None     # Not available in pay register
-            )
+            return self._payslip_model(employee_id, month, year, target_payslip)
             
         except HTTPException:
             raise
@@ -600,6 +609,22 @@ class KekaMCPServer:
             logger.error(f"Error getting payslip for {month}/{year}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Failed to retrieve payslip: {str(e)}")
 
+    @staticmethod
+    def _payslip_model(employee_id: str, month: int, year: int, payslip: Dict[str, Any]) -> Payslip:
+        return Payslip(
+            employee_id=employee_id,
+            month=month,
+            year=year,
+            pay_period=payslip.get("payPeriod", ""),
+            gross_salary=payslip.get("grossAmount", 0),
+            net_salary=payslip.get("netAmount", 0),
+            total_deductions=payslip.get("grossAmount", 0) - payslip.get("netAmount", 0),
+            earnings=payslip.get("earnings", []),
+            deductions=payslip.get("deductions", []),
+            ytd_gross=None,  # Not available in pay register
+            ytd_net=None     # Not available in pay register
+        )
+
     # General Information Methods
     async def get_leave_types(self) -> List[Dict[str, Any]]:
         """Get available leave types"""
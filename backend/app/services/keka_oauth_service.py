@@ -12,9 +12,9 @@ import logging
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, Tuple
 from urllib.parse import urlencode, parse_qs
-import httpx
 from sqlalchemy import text
 from ..db.database import get_db_connection
+from app.utils.keka_http import keka_http
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -117,7 +117,7 @@ class KekaOAuthService:
             logger.error(f"Failed to generate authorization URL: {str(e)}")
             raise Exception(f"Failed to generate Keka authorization URL: {str(e)}")
 
-    def handle_oauth_callback(self, code: str, state: str) -> Dict[str, Any]:
+    async def handle_oauth_callback(self, code: str, state: str) -> Dict[str, Any]:
         """
         Handle OAuth2 callback and exchange code for tokens
         
@@ -134,10 +134,10 @@ class KekaOAuthService:
             user_email = state_data['user_email']
             
             # Exchange code for tokens
-            tokens = self._exchange_code_for_tokens(code)
+            tokens = await self._exchange_code_for_tokens(code)
             
             # Get user info from Keka by searching with email
-            user_info = self._get_keka_user_info(tokens['access_token'], user_email)
+            user_info = await self._get_keka_user_info(tokens['access_token'], user_email)
             
             # Store tokens in database
             self._store_user_tokens(user_email, tokens, user_info)
@@ -174,7 +174,7 @@ class KekaOAuthService:
         
         return state_data
 
-    def _exchange_code_for_tokens(self, code: str) -> Dict[str, Any]:
+    async def _exchange_code_for_tokens(self, code: str) -> Dict[str, Any]:
         """Exchange authorization code for access and refresh tokens"""
         token_data = {
             'grant_type': 'authorization_code',
@@ -184,8 +184,8 @@ class KekaOAuthService:
             'code': code
         }
         
-        with httpx.Client() as client:
-            response = client.post(
+        async with keka_http.session() as client:
+            response = await client.post(
                 self.token_endpoint,
                 data=token_data,
                 headers={'Content-Type': 'application/x-www-form-urlencoded'}
@@ -203,17 +203,17 @@ class KekaOAuthService:
             
             return tokens
 
-    def _get_keka_user_info(self, access_token: str, user_email: str) -> Dict[str, Any]:
+    async def _get_keka_user_info(self, access_token: str, user_email: str) -> Dict[str, Any]:
         """Get user information from Keka API by searching employees by email"""
         headers = {'Authorization': f'Bearer {access_token}'}
         
-        with httpx.Client() as client:
+        async with keka_http.session() as client:
             try:
                 # Search employees by email (no /hris/me endpoint exists)
                 api_base = f"https://{self.company_name}.{self.environment}.com/api/v1"
                 search_url = f"{api_base}/hris/employees"
                 
-                response = client.get(
+                response = await client.get(
                     search_url,
                     headers=headers,
                     params={'email': user_email}
@@ -328,7 +328,7 @@ class KekaOAuthService:
             logger.error(f"Failed to get tokens for {user_email}: {str(e)}")
             return None
 
-    def refresh_user_tokens(self, user_email: str) -> bool:
+    async def refresh_user_tokens(self, user_email: str) -> bool:
         """
         Refresh user's expired Keka tokens
         
@@ -353,8 +353,8 @@ class KekaOAuthService:
                 'refresh_token': current_tokens['refresh_token']
             }
             
-            with httpx.Client() as client:
-                response = client.post(
+            async with keka_http.session() as client:
+                response = await client.post(
                     self.token_endpoint,
                     data=refresh_data,
                     headers={'Content-Type': 'application/x-www-form-urlencoded'}
@@ -396,7 +396,7 @@ class KekaOAuthService:
             logger.error(f"Failed to refresh tokens for {user_email}: {str(e)}")
             return False
 
-    def get_valid_access_token(self, user_email: str) -> Optional[str]:
+    async def get_valid_access_token(self, user_email: str) -> Optional[str]:
         """
         Get valid access token for user, refreshing if necessary
         
@@ -412,7 +412,7 @@ class KekaOAuthService:
         
         # If token is expired, try to refresh
         if tokens['is_expired']:
-            if self.refresh_user_tokens(user_email):
+            if await self.refresh_user_tokens(user_email):
                 # Get refreshed tokens
                 tokens = self.get_user_tokens(user_email)
                 if not tokens or tokens['is_expired']:
@@ -0,0 +1,198 @@
+"""
+Keka Request Scheduler
+Token-bucket pacing for outbound Keka calls, shared across workers through a
+Postgres function, with interactive requests served ahead of background sync
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class LocalTokenBucket:
+    """In-process token bucket, used when the shared bucket is unavailable"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def acquire(self, requested: float = 1.0, reserve: float = 0.0) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+        if self.tokens - requested >= reserve:
+            self.tokens -= requested
+            return 0.0
+        return (requested + reserve - self.tokens) / self.refill_per_second
+
+
+class KekaRequestScheduler:
+    """
+    Queues outbound Keka calls and releases them as bucket tokens allow.
+
+    Waiters are kept in a priority heap and a single pump task per worker
+    hands out tokens, so an interactive call that arrives while sync traffic
+    is queued goes to the front. Across workers, background calls must leave
+    a reserve of tokens in the shared bucket for interactive ones.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("KEKA_RATE_LIMIT_ENABLED", "true").lower() == "true"
+        self.backend = os.getenv("KEKA_RATE_LIMIT_BACKEND", "postgres")  # "postgres" or "local"
+        self.bucket_key = os.getenv("KEKA_RATE_LIMIT_BUCKET", "keka_api")
+        self.requests_per_minute = float(os.getenv("KEKA_RATE_LIMIT_PER_MINUTE", "50"))
+        self.burst = float(os.getenv("KEKA_RATE_LIMIT_BURST", "10"))
+        # Share of the burst background traffic may not dip into
+        self.background_reserve = float(os.getenv("KEKA_RATE_LIMIT_BACKGROUND_RESERVE", "0.3")) * self.burst
+        # How long a call may sit in the queue before giving up
+        self.max_wait = float(os.getenv("KEKA_RATE_LIMIT_MAX_WAIT", "60"))
+        # With the local fallback each worker only gets its share of the quota
+        self.local_workers = int(os.getenv("KEKA_RATE_LIMIT_WORKERS", os.getenv("WEB_CONCURRENCY", "4")))
+
+        self.refill_per_second = self.requests_per_minute / 60.0
+        self._local_bucket = LocalTokenBucket(
+            capacity=max(1.0, self.burst / self.local_workers),
+            refill_per_second=self.refill_per_second / self.local_workers,
+        )
+        self._shared_failed_at: Optional[float] = None
+
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.stats = {
+            "granted_interactive": 0,
+            "granted_background": 0,
+            "timed_out": 0,
+            "total_wait_seconds": 0.0,
+            "shared_backend_errors": 0,
+        }
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """
+        Wait for a token. Lower priority values are served first; callers
+        queue instead of being rejected, up to KEKA_RATE_LIMIT_MAX_WAIT.
+        Raises asyncio.TimeoutError if the wait runs out.
+        """
+        if not self.enabled:
+            return
+
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # New event loop (tests, reloads): drop state bound to the old one
+            self._waiters = []
+            self._pump_task = None
+            self._loop = loop
+
+        started = time.monotonic()
+        waiter = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = loop.create_task(self._pump())
+
+        try:
+            await asyncio.wait_for(waiter, timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.stats["timed_out"] += 1
+            logger.warning(f"Keka request waited {self.max_wait:.0f}s for a rate limit token")
+            raise
+
+        self.stats["total_wait_seconds"] += time.monotonic() - started
+        if priority == PRIORITY_INTERACTIVE:
+            self.stats["granted_interactive"] += 1
+        else:
+            self.stats["granted_background"] += 1
+
+    async def _pump(self) -> None:
+        """Hand tokens to the highest-priority waiter until the queue drains"""
+        while self._waiters:
+            priority, _, waiter = self._waiters[0]
+            if waiter.done():
+                # Timed out or cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+
+            reserve = self.background_reserve if priority != PRIORITY_INTERACTIVE else 0.0
+            wait_seconds = await self._take_token(reserve)
+            if wait_seconds <= 0:
+                # The heap may have changed during the await: hand the token to
+                # whoever heads it now. A newcomer can only rank at or above the
+                # peeked waiter, so the reserve we checked still holds for it.
+                self._grant_head(priority)
+                continue
+
+            # Re-check soon: a higher-priority caller may have joined the queue
+            await asyncio.sleep(min(wait_seconds, 1.0))
+
+    def _grant_head(self, max_priority: int) -> None:
+        """Resolve the first pending waiter the token was taken for"""
+        while self._waiters:
+            priority, _, waiter = self._waiters[0]
+            if priority > max_priority:
+                # Everyone the token was checked for left the queue; a
+                # lower-priority waiter must pass its own reserve check
+                return
+            heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def _take_token(self, reserve: float) -> float:
+        if self.backend == "postgres" and not self._shared_backend_cooling_down():
+            try:
+                return await self._take_shared_token(reserve)
+            except Exception as e:
+                self.stats["shared_backend_errors"] += 1
+                self._shared_failed_at = time.monotonic()
+                logger.warning(f"Shared Keka rate limit unavailable, using per-worker bucket: {str(e)}")
+
+        local_reserve = reserve / self.local_workers
+        return self._local_bucket.acquire(reserve=local_reserve)
+
+    def _shared_backend_cooling_down(self) -> bool:
+        # After a failure, stay on the local bucket for a while before retrying Postgres
+        return self._shared_failed_at is not None and time.monotonic() - self._shared_failed_at < 30
+
+    async def _take_shared_token(self, reserve: float) -> float:
+        from app.utils.supabase_client import supabase_admin_client
+
+        def _call():
+            return supabase_admin_client.rpc("keka_rate_limit_acquire", {
+                "p_bucket": self.bucket_key,
+                "p_capacity": self.burst,
+                "p_refill_per_second": self.refill_per_second,
+                "p_requested": 1,
+                "p_reserve": reserve,
+            }).execute()
+
+        # supabase-py is synchronous; keep it off the event loop
+        response = await asyncio.get_running_loop().run_in_executor(None, _call)
+        return float(response.data or 0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Scheduler counters for health endpoints"""
+        granted = self.stats["granted_interactive"] + self.stats["granted_background"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "backend": "local" if self.backend != "postgres" or self._shared_backend_cooling_down() else "postgres",
+            "queued": sum(1 for _, _, waiter in self._waiters if not waiter.done()),
+            "avg_wait_seconds": round(self.stats["total_wait_seconds"] / granted, 3) if granted else 0.0,
+            "requests_per_minute": self.requests_per_minute,
+        }
+
+
+# Global instance
+keka_request_scheduler = KekaRequestScheduler()
@@ -0,0 +1,202 @@
+"""
+Keka Sync Cron Service
+Fires the daily, weekly and monthly Keka syncs on cron schedules from inside
+the app, on whichever worker currently holds the leader lease
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Any, Dict, Optional, Set
+
+from app.services.keka_sync_lease_service import keka_sync_lease_service, LEADER_LEASE
+
+logger = logging.getLogger(__name__)
+
+# Run name -> default cron expression (minute hour day-of-month month day-of-week)
+DEFAULT_SCHEDULES: Dict[str, str] = {
+    "daily": "0 2 * * *",
+    "weekly": "0 3 * * 1",
+    "monthly": "0 4 1 * *",
+}
+
+
+class CronSchedule:
+    """
+    A five-field cron expression. Fields accept `*`, numbers, `a-b` ranges,
+    `/n` steps and comma lists. Day of week runs 0-6 from Sunday (7 is also
+    Sunday); as in cron, when both day fields are restricted either may match.
+    """
+
+    _BOUNDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse_field(field, low, high) for field, (low, high) in zip(fields, self._BOUNDS)
+        )
+        self.weekdays = {0 if day == 7 else day for day in weekdays}
+        self.days_restricted = fields[2] != "*"
+        self.weekdays_restricted = fields[4] != "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values: Set[int] = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start_text, end_text = part.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Cron field '{field}' is out of range {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def matches(self, moment: datetime) -> bool:
+        if moment.minute not in self.minutes or moment.hour not in self.hours or moment.month not in self.months:
+            return False
+        day_match = moment.day in self.days
+        # Python counts weekdays from Monday, cron from Sunday
+        weekday_match = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+
+class KekaSyncCronService:
+    """
+    Runs in every worker. Once a minute each worker tries to take or renew
+    the leader lease; only the leader checks the schedules and starts due
+    runs. The scheduler's run lease additionally rejects a run while another
+    is still going, so a slow daily sync never overlaps the next trigger.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("KEKA_SYNC_CRON_ENABLED", "true").lower() == "true"
+        # Leader lease TTL; renewed every minute, so a dead leader is replaced after this
+        self.leader_ttl = float(os.getenv("KEKA_SYNC_LEADER_TTL", "180"))
+        self.timezone = self._load_timezone(os.getenv("KEKA_SYNC_TIMEZONE", "UTC"))
+        self.schedules: Dict[str, CronSchedule] = {}
+        for run_type, default in DEFAULT_SCHEDULES.items():
+            expression = os.getenv(f"KEKA_SYNC_SCHEDULE_{run_type.upper()}", default)
+            if expression.strip().lower() in ("", "off", "disabled"):
+                continue
+            try:
+                self.schedules[run_type] = CronSchedule(expression)
+            except ValueError as e:
+                logger.error(f"Ignoring invalid {run_type} sync schedule: {str(e)}")
+
+        self._task: Optional[asyncio.Task] = None
+        self._runs: Set[asyncio.Task] = set()
+        self._last_fired: Dict[str, datetime] = {}
+        self.last_results: Dict[str, Any] = {}
+
+    @staticmethod
+    def _load_timezone(name: str) -> tzinfo:
+        if name.upper() == "UTC":
+            return timezone.utc
+        try:
+            from zoneinfo import ZoneInfo
+            return ZoneInfo(name)
+        except Exception as e:
+            logger.error(f"Unknown KEKA_SYNC_TIMEZONE '{name}', using UTC: {str(e)}")
+            return timezone.utc
+
+    def start(self) -> None:
+        """Start the schedule loop in this worker (call from app startup)"""
+        if not self.enabled or not self.schedules:
+            logger.info("Keka sync cron is disabled")
+            return
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.ensure_future(self._loop())
+        logger.info(
+            "Keka sync cron started: "
+            + ", ".join(f"{run_type} '{schedule.expression}'" for run_type, schedule in self.schedules.items())
+        )
+
+    async def stop(self) -> None:
+        """Stop the loop and give up leadership; runs in progress are left to finish or expire"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if keka_sync_lease_service.holds(LEADER_LEASE):
+            await keka_sync_lease_service.release(LEADER_LEASE)
+
+    async def _loop(self) -> None:
+        while True:
+            now = datetime.now(self.timezone)
+            next_minute = (now + timedelta(minutes=1)).replace(second=0, microsecond=0)
+            await asyncio.sleep((next_minute - now).total_seconds())
+            try:
+                await self._tick(next_minute)
+            except Exception as e:
+                logger.error(f"Keka sync cron tick failed: {str(e)}")
+
+    async def _tick(self, moment: datetime) -> None:
+        due = [
+            run_type for run_type, schedule in self.schedules.items()
+            if schedule.matches(moment) and self._last_fired.get(run_type) != moment
+        ]
+        was_leader = keka_sync_lease_service.holds(LEADER_LEASE)
+        # Renew every minute, not only when something is due, so leadership stays put
+        is_leader = await keka_sync_lease_service.acquire(LEADER_LEASE, self.leader_ttl)
+        if is_leader != was_leader:
+            logger.info(f"Keka sync cron leadership {'acquired' if is_leader else 'lost'} by {keka_sync_lease_service.holder_id}")
+        if not is_leader:
+            return
+
+        for run_type in due:
+            self._last_fired[run_type] = moment
+            task = asyncio.ensure_future(self._fire(run_type))
+            self._runs.add(task)
+            task.add_done_callback(self._runs.discard)
+
+    async def _fire(self, run_type: str) -> None:
+        logger.info(f"Starting scheduled {run_type} Keka sync")
+        try:
+            # Imported here: the sync service refuses to load without Keka credentials
+            from app.services.keka_sync_scheduler import keka_sync_scheduler
+            result = await getattr(keka_sync_scheduler, f"run_{run_type}_sync")()
+        except Exception as e:
+            logger.error(f"Scheduled {run_type} Keka sync failed: {str(e)}")
+            result = {"overall_success": False, "error": str(e)}
+        self.last_results[run_type] = {
+            "fired_at": datetime.now(self.timezone).isoformat(),
+            "overall_success": result.get("overall_success"),
+            "rejected": result.get("rejected", False),
+            "cancelled": result.get("cancelled", False),
+            "error": result.get("error"),
+        }
+
+    def get_status(self) -> Dict[str, Any]:
+        """Schedule and leadership state for health endpoints"""
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None and not self._task.done(),
+            "leader": keka_sync_lease_service.holds(LEADER_LEASE),
+            "holder_id": keka_sync_lease_service.holder_id,
+            "schedules": {run_type: schedule.expression for run_type, schedule in self.schedules.items()},
+            "timezone": str(self.timezone),
+            "last_results": self.last_results,
+        }
+
+
+# Global instance
+keka_sync_cron_service = KekaSyncCronService()
@@ -0,0 +1,90 @@
+"""
+Keka Sync Lease Service
+Expiring leases in Postgres that elect one worker to drive scheduled syncs
+and keep sync runs from overlapping across workers and nodes
+"""
+
+import os
+import socket
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+LEADER_LEASE = "keka_sync_leader"
+RUN_LEASE = "keka_sync_run"
+
+
+class KekaSyncLeaseService:
+    """
+    Take, renew and release named leases through the keka_sync_lease_*
+    functions. Every worker has its own holder ID; a lease is held until it
+    is released or its TTL runs out, so a crashed worker frees it on expiry.
+    Leases are per worker, not per task: callers guard against overlap
+    inside one worker themselves.
+    """
+
+    def __init__(self):
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._held: Set[str] = set()
+
+    async def acquire(self, name: str, ttl_seconds: float, fail_open: bool = False) -> bool:
+        """
+        Take or renew a lease; True when this worker holds it afterwards.
+        If Postgres can't be reached the answer is fail_open.
+        """
+        try:
+            response = await self._rpc("keka_sync_lease_acquire", {
+                "p_name": name,
+                "p_holder": self.holder_id,
+                "p_ttl_seconds": ttl_seconds,
+            })
+            acquired = bool(response.data)
+        except Exception as e:
+            logger.warning(f"Could not take sync lease {name}, treating it as {'free' if fail_open else 'held elsewhere'}: {str(e)}")
+            acquired = fail_open
+
+        if acquired:
+            self._held.add(name)
+        else:
+            self._held.discard(name)
+        return acquired
+
+    async def release(self, name: str) -> None:
+        """Give up a lease held by this worker"""
+        self._held.discard(name)
+        try:
+            await self._rpc("keka_sync_lease_release", {"p_name": name, "p_holder": self.holder_id})
+        except Exception as e:
+            logger.warning(f"Failed to release sync lease {name}; it will expire on its own: {str(e)}")
+
+    def holds(self, name: str) -> bool:
+        """Whether this worker took the lease last time it tried"""
+        return name in self._held
+
+    def current_holder(self, name: str) -> Optional[Dict[str, Any]]:
+        """The unexpired holder of a lease, from any worker, or None"""
+        try:
+            from app.utils.supabase_client import supabase_admin_client
+
+            response = supabase_admin_client.table("keka_sync_leases").select(
+                "holder, acquired_at, expires_at"
+            ).eq("lease_name", name).gt("expires_at", datetime.now(timezone.utc).isoformat()).limit(1).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.warning(f"Could not read sync lease {name}: {str(e)}")
+            return None
+
+    async def _rpc(self, function: str, params: Dict[str, Any]) -> Any:
+        from app.utils.supabase_client import supabase_admin_client
+
+        # supabase-py is synchronous; keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(
+            None, lambda: supabase_admin_client.rpc(function, params).execute()
+        )
+
+
+# Global instance
+keka_sync_lease_service = KekaSyncLeaseService()
@@ -0,0 +1,194 @@
+"""
+Keka Sync Run Service
+History of sync stages in keka_sync_runs (timings split into Keka API and
+database time, rows read and written, retries) and trend summaries over it
+"""
+
+import time
+import uuid
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SyncStageMetrics:
+    """Counters for one sync stage, filled in by the Keka client and the sync writer"""
+
+    def __init__(self, sync_type: str, parent: Optional["SyncStageMetrics"] = None):
+        self.sync_type = sync_type
+        self.parent = parent
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.monotonic()
+        self.api_requests = 0
+        self.api_retries = 0
+        self.api_seconds = 0.0
+        self.api_wait_seconds = 0.0
+        self.db_seconds = 0.0
+        self.rows_read = 0
+
+
+# The stage being measured in the current task; tasks started inside it inherit it
+current_stage_metrics: ContextVar[Optional[SyncStageMetrics]] = ContextVar("keka_sync_stage_metrics", default=None)
+# (run_id, run_type) of the scheduled run a stage belongs to
+current_sync_run: ContextVar[Optional[Tuple[str, str]]] = ContextVar("keka_sync_run", default=None)
+
+
+def record_api_call(seconds: float, wait_seconds: float = 0.0) -> None:
+    """One Keka HTTP attempt: time on the wire and time queued for a rate-limit token"""
+    metrics = current_stage_metrics.get()
+    if metrics is not None:
+        metrics.api_requests += 1
+        metrics.api_seconds += seconds
+        metrics.api_wait_seconds += wait_seconds
+
+
+def record_api_retry() -> None:
+    metrics = current_stage_metrics.get()
+    if metrics is not None:
+        metrics.api_retries += 1
+
+
+def record_db_time(seconds: float) -> None:
+    metrics = current_stage_metrics.get()
+    if metrics is not None:
+        metrics.db_seconds += seconds
+
+
+def record_rows_read(count: int) -> None:
+    metrics = current_stage_metrics.get()
+    if metrics is not None:
+        metrics.rows_read += count
+
+
+class KekaSyncRunService:
+    """
+    Records one keka_sync_runs row per finished sync stage. Stages are
+    opened and closed from the sync service's status updates; a stage that
+    runs inside another (calendars during a holiday sync) is measured on
+    its own and the outer one resumes afterwards.
+    """
+
+    def stage_started(self, sync_type: str) -> None:
+        current_stage_metrics.set(SyncStageMetrics(sync_type, parent=current_stage_metrics.get()))
+
+    def stage_finished(self, sync_type: str, status: str, processed: int, failed: int, error_message: Optional[str] = None) -> None:
+        metrics = current_stage_metrics.get()
+        if metrics is None or metrics.sync_type != sync_type:
+            return
+        current_stage_metrics.set(metrics.parent)
+
+        duration = time.monotonic() - metrics.started
+        run_id, run_type = current_sync_run.get() or (str(uuid.uuid4()), "manual")
+        record = {
+            "run_id": run_id,
+            "run_type": run_type,
+            "sync_type": sync_type,
+            "status": status,
+            "started_at": metrics.started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "duration_seconds": round(duration, 3),
+            "api_seconds": round(metrics.api_seconds, 3),
+            "api_wait_seconds": round(metrics.api_wait_seconds, 3),
+            "db_seconds": round(metrics.db_seconds, 3),
+            "api_requests": metrics.api_requests,
+            "api_retries": metrics.api_retries,
+            "rows_read": metrics.rows_read,
+            "rows_written": processed,
+            "rows_failed": failed,
+            "rows_per_second": round(processed / duration, 2) if duration > 0 else 0.0,
+            "error_message": error_message,
+        }
+        logger.info(
+            f"Sync stage {sync_type} {status} in {duration:.1f}s: {metrics.rows_read} read, {processed} written, "
+            f"api {metrics.api_seconds:.1f}s (+{metrics.api_wait_seconds:.1f}s queued, {metrics.api_retries} retries), "
+            f"db {metrics.db_seconds:.1f}s"
+        )
+
+        try:
+            from app.utils.supabase_client import supabase_admin_client
+
+            supabase_admin_client.table("keka_sync_runs").insert(record).execute()
+        except Exception as e:
+            logger.error(f"Failed to record sync run history: {str(e)}")
+
+    def get_recent_runs(self, limit: int = 20, sync_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Most recent stage records, newest first"""
+        try:
+            from app.utils.supabase_client import supabase_admin_client
+
+            query = supabase_admin_client.table("keka_sync_runs").select("*")
+            if sync_type:
+                query = query.eq("sync_type", sync_type)
+            return query.order("started_at", desc=True).limit(limit).execute().data or []
+        except Exception as e:
+            logger.error(f"Failed to load sync run history: {str(e)}")
+            return []
+
+    def get_trends(self, days: int = 30, sync_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Per-day aggregates for each sync type over the last `days` days, and
+        how average duration and throughput moved between the first and
+        second half of the window.
+        """
+        from app.utils.supabase_client import supabase_admin_client
+
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+        query = supabase_admin_client.table("keka_sync_runs").select(
+            "sync_type, status, started_at, duration_seconds, api_seconds, api_wait_seconds, db_seconds, "
+            "api_retries, rows_read, rows_written, rows_failed, rows_per_second"
+        ).gte("started_at", since)
+        if sync_type:
+            query = query.eq("sync_type", sync_type)
+        rows = query.order("started_at").execute().data or []
+
+        by_type: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_type.setdefault(row["sync_type"], []).append(row)
+
+        trends = {}
+        for name, runs in by_type.items():
+            daily: Dict[str, List[Dict[str, Any]]] = {}
+            for run in runs:
+                daily.setdefault(run["started_at"][:10], []).append(run)
+
+            half = len(runs) // 2
+            earlier, later = self._summarize(runs[:half]), self._summarize(runs[half:])
+            trends[name] = {
+                "summary": self._summarize(runs),
+                "daily": [{"date": day, **self._summarize(day_runs)} for day, day_runs in sorted(daily.items())],
+                "duration_change_pct": self._change_pct(earlier["avg_duration_seconds"], later["avg_duration_seconds"]) if half else None,
+                "throughput_change_pct": self._change_pct(earlier["avg_rows_per_second"], later["avg_rows_per_second"]) if half else None,
+            }
+
+        return {"days": days, "since": since, "sync_types": trends}
+
+    @staticmethod
+    def _summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        def _avg(field: str) -> float:
+            values = [float(run.get(field) or 0) for run in runs]
+            return round(sum(values) / len(values), 3) if values else 0.0
+
+        return {
+            "runs": len(runs),
+            "failed_runs": sum(1 for run in runs if run.get("status") != "success"),
+            "avg_duration_seconds": _avg("duration_seconds"),
+            "avg_api_seconds": _avg("api_seconds"),
+            "avg_api_wait_seconds": _avg("api_wait_seconds"),
+            "avg_db_seconds": _avg("db_seconds"),
+            "avg_rows_per_second": _avg("rows_per_second"),
+            "rows_written": sum(int(run.get("rows_written") or 0) for run in runs),
+            "api_retries": sum(int(run.get("api_retries") or 0) for run in runs),
+        }
+
+    @staticmethod
+    def _change_pct(before: float, after: float) -> Optional[float]:
+        if not before:
+            return None
+        return round((after - before) / before * 100, 1)
+
+
+# Global instance
+keka_sync_run_service = KekaSyncRunService()
@@ -1,193 +1,317 @@
 """
 Keka Data Sync Scheduler
-Scheduled jobs to sync employee data from Keka API
+Scheduled jobs to sync employee data from Keka API, run as a dependency graph
+of stages with a checkpoint per run so an interrupted run can resume
 """
 
+import os
+import uuid
 import asyncio
 import logging
-from datetime import datetime, date, timedelta
-from typing import Dict, Any
+from datetime import datetime, date, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+from app.utils.supabase_client import supabase_admin_client
 from app.services.keka_employee_sync_service import keka_employee_sync_service
+from app.services.keka_sync_lease_service import keka_sync_lease_service, RUN_LEASE
+from app.services.keka_sync_run_service import current_sync_run
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# name -> (stages it depends on, coroutine factory)
+SyncStages = Dict[str, Tuple[Tuple[str, ...], Callable[[], Awaitable[Dict[str, Any]]]]]
+
 class KekaSyncScheduler:
     """
-    Scheduler for running Keka data sync operations
+    Scheduler for running Keka data sync operations.
+    
+    Each run is a set of stages with dependencies: a stage starts as soon as
+    everything it depends on has succeeded, so independent stages (holidays
+    and attendance, say) run side by side. Completed stages are checkpointed
+    to a `<run>_sync` row in keka_sync_status; rerunning after a failure or a
+    restart skips them and picks up the rest. Only one run of any kind goes
+    at a time across all workers.
     """
     
     def __init__(self):
         self.sync_service = keka_employee_sync_service
+        # How long an unfinished run's checkpoint stays resumable
+        self.resume_window = timedelta(hours=int(os.getenv("KEKA_SYNC_RESUME_WINDOW_HOURS", "12")))
+        # Run lease TTL; renewed every third of it while a run is going
+        self.run_lease_ttl = float(os.getenv("KEKA_SYNC_RUN_LEASE_TTL", "600"))
+        self._active_run: Optional[str] = None
     
-    async def run_daily_sync(self) -> Dict[str, Any]:
+    async def run_daily_sync(self, resume: bool = True) -> Dict[str, Any]:
         """Run daily sync operations"""
-        logger.info("Starting daily Keka data sync...")
-        
-        results = {
-            "employees": None,
-            "leave_balances": None,
-            "attendance": None,
-            "holiday_calendars": None,
-            "holidays": None,
-            "overall_success": False,
-            "started_at": datetime.now().isoformat(),
-            "completed_at": None
+        today = date.today()
+        stages: SyncStages = {
+            # Everything keyed by employee needs the employee rows first
+            "employees": ((), self.sync_service.sync_all_employees),
+            "leave_balances": (("employees",), self.sync_service.sync_employee_leave_balances),
+            # Attendance and leave history sync incrementally from their watermarks
+            "attendance": (("employees",), self.sync_service.sync_employee_attendance),
+            "leave_history": (("employees",), self.sync_service.sync_employee_leave_history),
         }
         
-        try:
-            # 1. Sync all employees (daily)
-            logger.info("Syncing employees...")
-            results["employees"] = await self.sync_service.sync_all_employees()
-            
-            # 2. Sync leave balances (daily)
-            logger.info("Syncing leave balances...")
-            results["leave_balances"] = await self.sync_service.sync_employee_leave_balances()
-            
-            # 3. Sync attendance for current month (daily)
-            logger.info("Syncing attendance...")
-            today = date.today()
-            month_start = date(today.year, today.month, 1)
-            results["attendance"] = await self.sync_service.sync_employee_attendance(month_start, today)
-            
-            # 4. Sync leave history for last 3 months (daily)
-            logger.info("Syncing leave history...")
-            three_months_ago = today - timedelta(days=90)
-            results["leave_history"] = await self.sync_service.sync_employee_leave_history(three_months_ago, today)
-            
-            # 5. Sync holiday calendars (weekly - only on Mondays)
-            if today.weekday() == 0:  # Monday
-                logger.info("Syncing holiday calendars...")
-                results["holiday_calendars"] = await self.sync_service.sync_holiday_calendars()
-            
-            # 6. Sync holidays for current year (monthly - only on 1st of month)
-            if today.day == 1:
-                logger.info("Syncing holidays...")
-                results["holidays"] = await self.sync_service.sync_company_holidays(today.year)
-            
-            results["overall_success"] = True
-            results["completed_at"] = datetime.now().isoformat()
-            
-            logger.info("Daily sync completed successfully")
-            
-        except Exception as e:
-            logger.error(f"Daily sync failed: {str(e)}")
-            results["error"] = str(e)
-            results["completed_at"] = datetime.now().isoformat()
+        # Holiday calendars (weekly - only on Mondays)
+        if today.weekday() == 0:
+            stages["holiday_calendars"] = ((), self.sync_service.sync_holiday_calendars)
         
-        return results
+        # Holidays for current year (monthly - only on 1st of month)
+        if today.day == 1:
+            stages["holidays"] = (
+                ("holiday_calendars",) if "holiday_calendars" in stages else (),
+                lambda: self.sync_service.sync_company_holidays(today.year)
+            )
+        
+        return await self._run_stages("daily", stages, resume)
     
-    async def run_weekly_sync(self) -> Dict[str, Any]:
+    async def run_weekly_sync(self, resume: bool = True) -> Dict[str, Any]:
         """Run weekly sync operations"""
-        logger.info("Starting weekly Keka data sync...")
-        
-        results = {
-            "holiday_calendars": None,
-            "overall_success": False,
-            "started_at": datetime.now().isoformat(),
-            "completed_at": None
+        stages: SyncStages = {
+            "holiday_calendars": ((), self.sync_service.sync_holiday_calendars),
         }
-        
+        return await self._run_stages("weekly", stages, resume)
+    
+    async def run_monthly_sync(self, resume: bool = True) -> Dict[str, Any]:
+        """Run monthly sync operations"""
+        stages: SyncStages = {
+            "holidays": ((), lambda: self.sync_service.sync_company_holidays(datetime.now().year)),
+            # Processed pay registers into the payslip index
+            "payslips": ((), self.sync_service.sync_employee_payslips),
+        }
+        return await self._run_stages("monthly", stages, resume)
+    
+    async def run_full_sync(self, resume: bool = True) -> Dict[str, Any]:
+        """Run full sync of all data; attendance and leave history run in repair mode"""
+        today = date.today()
+        three_months_ago = today - timedelta(days=90)
+        stages: SyncStages = {
+            "employees": ((), self.sync_service.sync_all_employees),
+            "leave_balances": (("employees",), self.sync_service.sync_employee_leave_balances),
+            "attendance": (
+                ("employees",),
+                lambda: self.sync_service.sync_employee_attendance(three_months_ago, today, repair=True)
+            ),
+            "leave_history": (
+                ("employees",),
+                lambda: self.sync_service.sync_employee_leave_history(three_months_ago, today, repair=True)
+            ),
+            "payslips": (("employees",), self.sync_service.sync_employee_payslips),
+            "holiday_calendars": ((), self.sync_service.sync_holiday_calendars),
+            "holidays": (("holiday_calendars",), lambda: self.sync_service.sync_company_holidays(today.year)),
+        }
+        return await self._run_stages("full", stages, resume)
+    
+    async def run_stage(self, name: str, factory: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Run one sync stage on its own (the manual /sync/<stage> endpoints),
+        under the same in-worker guard and run lease as scheduled runs so it
+        can't overlap them. It keeps no checkpoint: there is nothing to resume.
+        """
+        return await self._run_stages(name, {name: ((), factory)}, resume=False, checkpointed=False)
+    
+    async def _run_stages(
+        self, run_type: str, stages: SyncStages, resume: bool, checkpointed: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Run a sync unless another one is in progress in this worker or, via
+        the run lease, in any other worker. The lease is renewed while the
+        run lasts and expires on its own if the worker dies; if a renewal
+        fails the run is cancelled rather than risk two workers running the
+        repair and prune stages at once. The checkpoint lets it resume later.
+        """
+        if self._active_run is not None:
+            return self._rejected_run(run_type, f"A {self._active_run} sync is already running")
+        # Claimed before the first await so two triggers in one worker can't both pass
+        self._active_run = run_type
         try:
-            # Sync holiday calendars (weekly)
-            logger.info("Syncing holiday calendars...")
-            results["holiday_calendars"] = await self.sync_service.sync_holiday_calendars()
-            
-            results["overall_success"] = True
-            results["completed_at"] = datetime.now().isoformat()
+            # Fail closed: if Postgres can't confirm the lease, another worker may hold it
+            if not await keka_sync_lease_service.acquire(RUN_LEASE, self.run_lease_ttl):
+                holder = keka_sync_lease_service.current_holder(RUN_LEASE)
+                return self._rejected_run(
+                    run_type, f"A sync is already running on {holder['holder'] if holder else 'another worker'}"
+                )
             
-            logger.info("Weekly sync completed successfully")
-            
-        except Exception as e:
-            logger.error(f"Weekly sync failed: {str(e)}")
-            results["error"] = str(e)
-            results["completed_at"] = datetime.now().isoformat()
-        
-        return results
+            run = asyncio.ensure_future(self._execute_stages(run_type, stages, resume, checkpointed))
+            heartbeat = asyncio.ensure_future(self._renew_run_lease())
+            try:
+                await asyncio.wait({run, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+                if not run.done():
+                    # The heartbeat only returns once the lease is lost
+                    run.cancel()
+                    await asyncio.gather(run, return_exceptions=True)
+                    return {
+                        "overall_success": False,
+                        "cancelled": True,
+                        "error": "Lost the sync run lease mid-run; cancelled the remaining stages",
+                        "completed_at": datetime.now().isoformat()
+                    }
+                return run.result()
+            finally:
+                heartbeat.cancel()
+                if not run.done():
+                    run.cancel()
+                await keka_sync_lease_service.release(RUN_LEASE)
+        finally:
+            self._active_run = None
     
-    async def run_monthly_sync(self) -> Dict[str, Any]:
-        """Run monthly sync operations"""
-        logger.info("Starting monthly Keka data sync...")
-        
-        results = {
-            "holidays": None,
-            "payslips": None,
+    async def _renew_run_lease(self) -> None:
+        """Renew the run lease until a renewal fails, then return"""
+        while True:
+            await asyncio.sleep(self.run_lease_ttl / 3)
+            if not await keka_sync_lease_service.acquire(RUN_LEASE, self.run_lease_ttl):
+                logger.error("Could not renew the Keka sync run lease; cancelling the run in progress")
+                return
+    
+    def _rejected_run(self, run_type: str, reason: str) -> Dict[str, Any]:
+        logger.warning(f"Not starting {run_type} sync: {reason}")
+        return {
             "overall_success": False,
-            "started_at": datetime.now().isoformat(),
-            "completed_at": None
+            "rejected": True,
+            "error": reason,
+            "started_at": None,
+            "completed_at": datetime.now().isoformat()
         }
+    
+    def current_run(self) -> Optional[Dict[str, Any]]:
+        """The sync run in progress in this worker or any other, or None"""
+        if self._active_run is not None:
+            return {"run_type": self._active_run, "holder": keka_sync_lease_service.holder_id}
+        return keka_sync_lease_service.current_holder(RUN_LEASE)
+    
+    async def _execute_stages(
+        self, run_type: str, stages: SyncStages, resume: bool, checkpointed: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Run stages as soon as their dependencies succeed. A stage whose
+        dependency failed is skipped (and retried on the next resume).
+        """
+        def _checkpoint(status: str, error_message: str = None) -> None:
+            if checkpointed:
+                self._save_checkpoint(run_type, status, started_at, completed, failed, error_message)
         
-        try:
-            # Sync holidays for current year (monthly)
-            logger.info("Syncing holidays...")
-            results["holidays"] = await self.sync_service.sync_company_holidays(datetime.now().year)
-            
-            # Note: Payslips sync would be added here when implemented
-            # results["payslips"] = await self.sync_service.sync_employee_payslips()
-            
-            results["overall_success"] = True
-            results["completed_at"] = datetime.now().isoformat()
-            
-            logger.info("Monthly sync completed successfully")
-            
-        except Exception as e:
-            logger.error(f"Monthly sync failed: {str(e)}")
-            results["error"] = str(e)
-            results["completed_at"] = datetime.now().isoformat()
+        started_at = datetime.now(timezone.utc)
+        completed: Set[str] = set()
+        resumed = False
         
-        return results
-    
-    async def run_full_sync(self) -> Dict[str, Any]:
-        """Run full sync of all data"""
-        logger.info("Starting full Keka data sync...")
+        checkpoint = self._load_checkpoint(run_type) if resume and checkpointed else None
+        if checkpoint is not None:
+            started_at = checkpoint["started_at"]
+            completed = set(checkpoint["completed"]) & set(stages)
+            resumed = True
+            logger.info(f"Resuming {run_type} Keka sync from {started_at.isoformat()}; already done: {sorted(completed)}")
+        else:
+            logger.info(f"Starting {run_type} Keka data sync...")
         
-        results = {
-            "employees": None,
-            "leave_balances": None,
-            "attendance": None,
-            "leave_history": None,
-            "holiday_calendars": None,
-            "holidays": None,
+        results: Dict[str, Any] = {name: None for name in stages}
+        results.update({
             "overall_success": False,
-            "started_at": datetime.now().isoformat(),
+            "resumed": resumed,
+            "skipped": sorted(completed),
+            "started_at": started_at.isoformat(),
             "completed_at": None
-        }
+        })
+        failed: Set[str] = set()
+        _checkpoint("in_progress")
         
-        try:
-            # Sync all data types
-            logger.info("Syncing employees...")
-            results["employees"] = await self.sync_service.sync_all_employees()
-            
-            logger.info("Syncing leave balances...")
-            results["leave_balances"] = await self.sync_service.sync_employee_leave_balances()
-            
-            logger.info("Syncing attendance for last 3 months...")
-            today = date.today()
-            three_months_ago = today - timedelta(days=90)
-            results["attendance"] = await self.sync_service.sync_employee_attendance(three_months_ago, today)
-            
-            logger.info("Syncing leave history for last 3 months...")
-            results["leave_history"] = await self.sync_service.sync_employee_leave_history(three_months_ago, today)
-            
-            logger.info("Syncing holiday calendars...")
-            results["holiday_calendars"] = await self.sync_service.sync_holiday_calendars()
-            
-            logger.info("Syncing holidays...")
-            results["holidays"] = await self.sync_service.sync_company_holidays(today.year)
-            
-            results["overall_success"] = True
-            results["completed_at"] = datetime.now().isoformat()
+        tasks: Dict[str, asyncio.Future] = {}
+        # Stage tasks inherit this, so their keka_sync_runs records share the run ID
+        run_token = current_sync_run.set((str(uuid.uuid4()), run_type))
+        
+        async def _run(name: str) -> bool:
+            dependencies, factory = stages[name]
+            # Wait for every dependency; a dependency outside this run counts as met
+            outcomes = await asyncio.gather(*(tasks[dep] for dep in dependencies if dep in tasks))
+            if not all(outcomes):
+                logger.warning(f"Skipping {name}: a stage it depends on failed")
+                results[name] = {"success": False, "message": "Skipped: dependency failed"}
+                failed.add(name)
+                return False
+            if name in completed:
+                return True
             
-            logger.info("Full sync completed successfully")
+            logger.info(f"Syncing {name}...")
+            try:
+                result = await factory()
+            except Exception as e:
+                logger.error(f"Sync stage {name} failed: {str(e)}")
+                result = {"success": False, "error": str(e)}
+            results[name] = result
             
-        except Exception as e:
-            logger.error(f"Full sync failed: {str(e)}")
-            results["error"] = str(e)
-            results["completed_at"] = datetime.now().isoformat()
+            if result and result.get("success"):
+                completed.add(name)
+            else:
+                failed.add(name)
+            # Checkpoint after every stage so a crash loses at most the stages in flight
+            _checkpoint("in_progress")
+            return name in completed
+        
+        for name in stages:
+            tasks[name] = asyncio.ensure_future(_run(name))
+        current_sync_run.reset(run_token)
+        await asyncio.gather(*tasks.values())
         
+        results["overall_success"] = not failed
+        results["completed_at"] = datetime.now().isoformat()
+        if failed:
+            results["error"] = f"Failed stages: {', '.join(sorted(failed))}"
+        _checkpoint("success" if not failed else "failed", results.get("error"))
+        
+        logger.info(
+            f"{run_type.capitalize()} sync {'completed successfully' if not failed else 'finished with failures'}: "
+            f"{len(completed)}/{len(stages)} stages done"
+        )
         return results
     
+    def _load_checkpoint(self, run_type: str) -> Optional[Dict[str, Any]]:
+        """The unfinished run to resume, if there is a recent one"""
+        try:
+            response = supabase_admin_client.table("keka_sync_status").select(
+                "sync_status, sync_cursor, checkpoint"
+            ).eq("sync_type", f"{run_type}_sync").limit(1).execute()
+            if not response.data:
+                return None
+            row = response.data[0]
+            if row.get("sync_status") == "success" or not row.get("sync_cursor") or not row.get("checkpoint"):
+                return None
+            
+            started_at = datetime.fromisoformat(row["sync_cursor"].replace("Z", "+00:00"))
+            if started_at.tzinfo is None:
+                started_at = started_at.replace(tzinfo=timezone.utc)
+            if datetime.now(timezone.utc) - started_at > self.resume_window:
+                return None
+            return {"started_at": started_at, "completed": row["checkpoint"].get("completed", [])}
+        except Exception as e:
+            logger.warning(f"Could not load {run_type} sync checkpoint, starting fresh: {str(e)}")
+            return None
+    
+    def _save_checkpoint(
+        self,
+        run_type: str,
+        status: str,
+        started_at: datetime,
+        completed: Set[str],
+        failed: Set[str],
+        error_message: str = None
+    ) -> None:
+        """Record which stages of a run are done in its keka_sync_status row"""
+        try:
+            supabase_admin_client.table("keka_sync_status").upsert({
+                "sync_type": f"{run_type}_sync",
+                "last_sync_at": datetime.now().isoformat(),
+                "sync_status": status,
+                "records_processed": len(completed),
+                "records_failed": len(failed),
+                "error_message": error_message,
+                "sync_cursor": started_at.isoformat(),
+                "checkpoint": {"completed": sorted(completed), "failed": sorted(failed)},
+                "updated_at": datetime.now().isoformat()
+            }, on_conflict="sync_type").execute()
+        except Exception as e:
+            logger.error(f"Failed to save {run_type} sync checkpoint: {str(e)}")
+    
     async def get_sync_status(self) -> Dict[str, Any]:
         """Get current sync status"""
         return await self.sync_service.get_sync_status()
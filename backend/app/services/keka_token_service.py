@@ -8,7 +8,7 @@ from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
 from app.utils.supabase_client import supabase_admin_client
 from app.models.hr import UserKekaTokens, KekaAuthRequest, KekaAuthResponse
-import httpx
+from app.utils.keka_http import keka_http
 import os
 
 logger = logging.getLogger(__name__)
@@ -104,7 +104,7 @@ class KekaTokenService:
             return None
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with keka_http.session() as client:
                 response = await client.post(
                     f"{self.api_base_url.replace('/v1', '')}/oauth/token",
                     data={
@@ -147,7 +147,7 @@ class KekaTokenService:
                     requires_setup=True
                 )
 
-            async with httpx.AsyncClient() as client:
+            async with keka_http.session() as client:
                 response = await client.post(
                     f"{self.api_base_url.replace('/v1', '')}/oauth/token",
                     data={
@@ -247,7 +247,7 @@ class KekaTokenService:
             tokens = await self.get_user_tokens(user_email)
             if tokens:
                 try:
-                    async with httpx.AsyncClient() as client:
+                    async with keka_http.session() as client:
                         # Note: Revoke endpoint may not be available in Keka API
                         await client.post(
                             f"{self.token_endpoint.replace('/connect/token', '/connect/revoke')}",
@@ -310,5 +310,25 @@ class KekaTokenService:
                 "expires_at": expires_at.isoformat()
             }
 
+class KekaUserTokenProvider:
+    """
+    Token provider for keka_client that uses one user's OAuth tokens
+    """
+
+    def __init__(self, user_email: str, token_service: KekaTokenService):
+        self.user_email = user_email
+        self.token_service = token_service
+
+    async def get_token(self, force_refresh: bool = False) -> Optional[str]:
+        if force_refresh:
+            tokens = await self.token_service.refresh_user_tokens(self.user_email)
+        else:
+            tokens = await self.token_service.ensure_valid_tokens(self.user_email)
+        return tokens.access_token if tokens else None
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        # Tokens live in Supabase; a forced refresh overwrites them
+        pass
+
 # Global instance
 keka_token_service = KekaTokenService()
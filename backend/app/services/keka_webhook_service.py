@@ -0,0 +1,285 @@
+"""
+Keka Webhook Service
+Verifies and de-duplicates Keka change events, applies them to the sync
+tables record by record and queues targeted refreshes from the Keka API
+"""
+
+import os
+import hmac
+import json
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class KekaWebhookError(Exception):
+    """A webhook delivery that must be refused; status_code is the HTTP answer"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class KekaWebhookService:
+    """
+    Entry point for Keka webhook deliveries.
+
+    Each delivery is checked against an HMAC-SHA256 signature of the raw
+    body, then claimed in keka_webhook_events by event ID so a redelivery is
+    acknowledged without being applied twice (one that failed earlier, or
+    was left unprocessed past KEKA_WEBHOOK_RECLAIM_AFTER, is retried).
+    Events carrying a full record are upserted straight into the sync
+    tables; the rest, and anything derived (leave balances after a leave
+    request changes), become per-employee refreshes that are debounced so
+    a burst of events costs one Keka call.
+    """
+
+    def __init__(self):
+        self.secret = os.getenv("KEKA_WEBHOOK_SECRET", "")
+        self.signature_header = os.getenv("KEKA_WEBHOOK_SIGNATURE_HEADER", "X-Keka-Signature")
+        self.event_id_header = os.getenv("KEKA_WEBHOOK_EVENT_ID_HEADER", "X-Keka-Event-Id")
+        # Seconds to wait before a queued refresh runs, so events for one employee coalesce
+        self.refresh_delay = float(os.getenv("KEKA_WEBHOOK_REFRESH_DELAY", "5"))
+        self.refresh_concurrency = int(os.getenv("KEKA_WEBHOOK_REFRESH_CONCURRENCY", "2"))
+        # Seconds after which a claimed event that never finished counts as abandoned
+        self.reclaim_after = float(os.getenv("KEKA_WEBHOOK_RECLAIM_AFTER", "300"))
+
+        self._pending_refreshes: Set[Tuple[str, str]] = set()
+        self._background_tasks: Set[asyncio.Task] = set()
+        self._refresh_semaphore: Optional[asyncio.Semaphore] = None
+        self.stats = {"received": 0, "duplicates": 0, "applied": 0, "failed": 0, "refreshes": 0, "refresh_failures": 0}
+
+    # ------------------------------------------------------------------
+    # Verification and de-duplication
+    # ------------------------------------------------------------------
+
+    def verify_signature(self, body: bytes, signature: Optional[str]) -> None:
+        """Raise KekaWebhookError unless the signature matches the body"""
+        if not self.secret:
+            # Refuse rather than accept unsigned events when no secret is configured
+            raise KekaWebhookError("Keka webhooks are not configured", 503)
+        if not signature:
+            raise KekaWebhookError(f"Missing {self.signature_header} header", 401)
+
+        expected = hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+        provided = signature.strip()
+        if provided.lower().startswith("sha256="):
+            provided = provided[len("sha256="):]
+        if not hmac.compare_digest(expected, provided.lower()):
+            raise KekaWebhookError("Invalid webhook signature", 401)
+
+    def parse_event(self, body: bytes, event_id_header: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Normalize a delivery to {event_id, event_type, records}. Without an
+        event ID from Keka the body hash stands in, so identical
+        redeliveries still collapse.
+        """
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise KekaWebhookError("Webhook body is not valid JSON", 400)
+        if not isinstance(payload, dict):
+            raise KekaWebhookError("Webhook body must be a JSON object", 400)
+
+        event_type = payload.get("eventType") or payload.get("event_type") or payload.get("event") or payload.get("type")
+        if not event_type:
+            raise KekaWebhookError("Webhook event type is missing", 400)
+
+        event_id = event_id_header or payload.get("eventId") or payload.get("event_id") or payload.get("id")
+        if not event_id:
+            event_id = hashlib.sha256(body).hexdigest()
+
+        data = payload.get("data", payload.get("payload"))
+        if isinstance(data, dict):
+            records = [data]
+        elif isinstance(data, list):
+            records = [record for record in data if isinstance(record, dict)]
+        else:
+            records = []
+
+        return {"event_id": str(event_id), "event_type": str(event_type).lower(), "records": records}
+
+    def claim_event(self, event: Dict[str, Any]) -> bool:
+        """
+        Record the event; False when it was already received and is neither
+        a failed delivery worth retrying nor one abandoned mid-processing
+        """
+        from app.utils.supabase_client import supabase_admin_client
+
+        self.stats["received"] += 1
+        now = datetime.now(timezone.utc)
+        response = supabase_admin_client.table("keka_webhook_events").upsert({
+            "event_id": event["event_id"],
+            "event_type": event["event_type"],
+            "status": "received",
+            "received_at": now.isoformat(),
+        }, on_conflict="event_id", ignore_duplicates=True).execute()
+        if response.data:
+            return True
+
+        existing = supabase_admin_client.table("keka_webhook_events").select("status, received_at").eq(
+            "event_id", event["event_id"]
+        ).limit(1).execute()
+        status = existing.data[0].get("status") if existing.data else None
+        reclaim = supabase_admin_client.table("keka_webhook_events").update({
+            "status": "received", "received_at": now.isoformat(), "error_message": None
+        }).eq("event_id", event["event_id"])
+        # Only one redelivery gets to take the row back: the update is conditional on its old state
+        if status == "failed":
+            retried = reclaim.eq("status", "failed").execute()
+        elif status == "received":
+            # The worker that claimed it died before processing it (BackgroundTasks don't survive a restart)
+            cutoff = now - timedelta(seconds=self.reclaim_after)
+            retried = reclaim.eq("status", "received").lt("received_at", cutoff.isoformat()).execute()
+        else:
+            retried = None
+        if retried is not None and retried.data:
+            return True
+
+        self.stats["duplicates"] += 1
+        return False
+
+    # ------------------------------------------------------------------
+    # Processing
+    # ------------------------------------------------------------------
+
+    async def process_event(self, event: Dict[str, Any]) -> None:
+        """Apply one claimed event and mark it processed or failed"""
+        event_type = event["event_type"]
+        try:
+            if event_type.startswith("employee"):
+                await self._apply_employee_event(event)
+            elif event_type.startswith("leave"):
+                await self._apply_leave_event(event)
+            elif event_type.startswith("attendance"):
+                await self._apply_attendance_event(event)
+            else:
+                logger.info(f"Ignoring Keka webhook event of type {event_type}")
+            self.stats["applied"] += 1
+            self._mark_event(event["event_id"], "processed")
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error(f"Failed to apply Keka webhook event {event['event_id']} ({event_type}): {str(e)}")
+            self._mark_event(event["event_id"], "failed", str(e))
+
+    async def _apply_employee_event(self, event: Dict[str, Any]) -> None:
+        sync_service = self._sync_service()
+        # A full employee object has more than its ID; otherwise read it back from Keka
+        full_records = [record for record in event["records"] if record.get("id") and (record.get("email") or record.get("firstName"))]
+        if full_records:
+            self._check_written(await sync_service.apply_employee_changes(full_records))
+
+        full_ids = {record["id"] for record in full_records}
+        for employee_id in self._employee_ids(event["records"], "id", "employeeId"):
+            if employee_id not in full_ids:
+                self.queue_refresh("employee", employee_id)
+
+    async def _apply_leave_event(self, event: Dict[str, Any]) -> None:
+        from app.services.hr_read_cache_service import hr_read_cache_service
+
+        sync_service = self._sync_service()
+        requests = [record for record in event["records"] if record.get("id") and record.get("employeeId")]
+        if requests:
+            self._check_written(await sync_service.apply_leave_request_changes(requests))
+
+        for employee_id in self._employee_ids(event["records"], "employeeId", "employee_id"):
+            hr_read_cache_service.invalidate_employee(employee_id)
+            # Balances move with every leave change but aren't in the event
+            self.queue_refresh("leave_balances", employee_id)
+
+    async def _apply_attendance_event(self, event: Dict[str, Any]) -> None:
+        from app.services.hr_read_cache_service import hr_read_cache_service
+
+        sync_service = self._sync_service()
+        entries = [record for record in event["records"] if record.get("date")]
+        if entries:
+            self._check_written(await sync_service.apply_attendance_changes(entries))
+
+        for employee_id in self._employee_ids(event["records"], "employeeId", "employee_id"):
+            hr_read_cache_service.invalidate_employee(employee_id, ("attendance",))
+
+    @staticmethod
+    def _employee_ids(records: List[Dict[str, Any]], *fields: str) -> List[str]:
+        ids: List[str] = []
+        for record in records:
+            employee_id = next((record.get(field) for field in fields if record.get(field)), None)
+            if employee_id and employee_id not in ids:
+                ids.append(str(employee_id))
+        return ids
+
+    @staticmethod
+    def _check_written(result: Dict[str, Any]) -> None:
+        # The bulk writer reports rows it couldn't store instead of raising
+        if result.get("failed"):
+            raise RuntimeError(f"{result['failed']} of {result['failed'] + result['processed']} rows failed to upsert")
+
+    @staticmethod
+    def _sync_service():
+        # Imported here: the sync service refuses to load without Keka credentials
+        from app.services.keka_employee_sync_service import keka_employee_sync_service
+        return keka_employee_sync_service
+
+    def _mark_event(self, event_id: str, status: str, error_message: Optional[str] = None) -> None:
+        try:
+            from app.utils.supabase_client import supabase_admin_client
+
+            supabase_admin_client.table("keka_webhook_events").update({
+                "status": status,
+                "processed_at": datetime.now(timezone.utc).isoformat(),
+                "error_message": error_message,
+            }).eq("event_id", event_id).execute()
+        except Exception as e:
+            logger.error(f"Failed to mark Keka webhook event {event_id} {status}: {str(e)}")
+
+    # ------------------------------------------------------------------
+    # Targeted refreshes
+    # ------------------------------------------------------------------
+
+    def queue_refresh(self, kind: str, employee_id: str) -> None:
+        """Refresh one employee's rows of a kind ('employee' or 'leave_balances') shortly"""
+        key = (kind, employee_id)
+        if key in self._pending_refreshes:
+            return
+        self._pending_refreshes.add(key)
+        task = asyncio.ensure_future(self._run_refresh(kind, employee_id))
+        # Hold a reference so the task isn't garbage collected mid-flight
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _run_refresh(self, kind: str, employee_id: str) -> None:
+        if self._refresh_semaphore is None:
+            self._refresh_semaphore = asyncio.Semaphore(self.refresh_concurrency)
+        try:
+            await asyncio.sleep(self.refresh_delay)
+        finally:
+            # Events arriving from here on queue a new refresh, which will see their change
+            self._pending_refreshes.discard((kind, employee_id))
+
+        async with self._refresh_semaphore:
+            try:
+                sync_service = self._sync_service()
+                if kind == "employee":
+                    await sync_service.refresh_employee(employee_id)
+                else:
+                    await sync_service.refresh_employee_leave_balances(employee_id)
+                self.stats["refreshes"] += 1
+            except Exception as e:
+                self.stats["refresh_failures"] += 1
+                # The next reconciliation sync picks up whatever this missed
+                logger.error(f"Targeted Keka {kind} refresh for {employee_id} failed: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters for health endpoints"""
+        return {
+            **self.stats,
+            "configured": bool(self.secret),
+            "pending_refreshes": len(self._pending_refreshes),
+        }
+
+
+# Global instance
+keka_webhook_service = KekaWebhookService()
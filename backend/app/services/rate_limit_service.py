@@ -0,0 +1,223 @@
+"""
+Rate Limit Service
+Per-route sliding-window request limits, counted in Postgres so every worker
+shares one budget, with an in-process fallback that evicts idle keys
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import Request, Response
+
+logger = logging.getLogger(__name__)
+
+# Policy name -> (path prefix, requests per window, window seconds, key by "ip" or "user").
+# Overridable with RATE_LIMIT_<NAME>="<requests>/<seconds>", or "off".
+DEFAULT_POLICIES: Dict[str, Tuple[str, int, int, str]] = {
+    "auth_token": ("/api/auth/token", 30, 10 * 60, "ip"),
+    "chat": ("/api/chat/", 30, 60, "user"),
+    "hr": ("/api/hr/", 120, 60, "user"),
+    "sync": ("/api/sync/", 20, 60, "user"),
+}
+
+
+class RateLimitPolicy:
+    """One route's limit; the longest matching path prefix wins"""
+
+    def __init__(self, name: str, prefix: str, limit: int, window_seconds: int, key_by: str):
+        self.name = name
+        self.prefix = prefix
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.key_by = key_by
+
+
+class SlidingWindowCounter:
+    """
+    In-process sliding-window counters: per key, the counts of the current
+    and previous fixed windows, with the previous one weighted by how much of
+    it still overlaps the sliding window. Keys idle for two windows are
+    swept out every so often.
+    """
+
+    def __init__(self, sweep_interval: float = 60.0):
+        # key -> [window_start, current_count, previous_count, window_seconds]
+        self._counters: Dict[str, List[float]] = {}
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.time()
+
+    def hit(self, key: str, limit: int, window_seconds: int) -> Tuple[bool, int, float]:
+        """Count one request; returns (allowed, remaining, retry_after_seconds)"""
+        now = time.time()
+        if now - self._last_sweep > self.sweep_interval:
+            self._sweep(now)
+
+        window_start = now - now % window_seconds
+        counter = self._counters.get(key)
+        if counter is None or counter[0] <= window_start - 2 * window_seconds:
+            counter = [window_start, 0, 0, window_seconds]
+            self._counters[key] = counter
+        elif counter[0] < window_start:
+            # Rolled into the next window; older windows no longer overlap
+            counter[2] = counter[1] if counter[0] == window_start - window_seconds else 0
+            counter[1] = 0
+            counter[0] = window_start
+
+        allowed, remaining, retry_after = _evaluate(counter[1], counter[2], limit, window_seconds, now - window_start)
+        if allowed:
+            counter[1] += 1
+        return allowed, remaining, retry_after
+
+    def _sweep(self, now: float) -> None:
+        self._last_sweep = now
+        for key in [key for key, counter in self._counters.items() if counter[0] + 2 * counter[3] <= now]:
+            del self._counters[key]
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+
+def _evaluate(current: float, previous: float, limit: int, window_seconds: int, elapsed: float) -> Tuple[bool, int, float]:
+    """Sliding-window estimate for one more request; mirrors rate_limit_hit() in SQL"""
+    weight = 1 - elapsed / window_seconds
+    estimate = previous * weight + current
+    if estimate + 1 <= limit:
+        return True, max(0, int(limit - estimate - 1)), 0.0
+    if previous > 0 and current + 1 <= limit:
+        # Wait until enough of the previous window has slid out
+        needed_weight = (limit - current - 1) / previous
+        return False, 0, max(0.0, (weight - needed_weight) * window_seconds)
+    return False, 0, window_seconds - elapsed
+
+
+class RateLimitService:
+    """
+    Applies per-route policies to incoming requests.
+
+    Requests are counted with sliding-window counters keyed by policy and
+    client: the verified user ID from the bearer token for "user" policies,
+    falling back to the client IP when there is no token or it doesn't
+    verify locally; "ip" policies always use the IP. Counts live in
+    Postgres via rate_limit_hit() so the limit holds across workers; if
+    Postgres is unreachable each worker enforces its share locally for a
+    while. Over the limit answers 429 with Retry-After.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+        self.backend = os.getenv("RATE_LIMIT_BACKEND", "postgres")  # "postgres" or "local"
+        # With the local fallback each worker only gets its share of the limit
+        self.local_workers = int(os.getenv("RATE_LIMIT_WORKERS", os.getenv("WEB_CONCURRENCY", "4")))
+
+        self.policies: List[RateLimitPolicy] = []
+        for name, (prefix, limit, window_seconds, key_by) in DEFAULT_POLICIES.items():
+            override = os.getenv(f"RATE_LIMIT_{name.upper()}", "").strip().lower()
+            if override in ("off", "disabled"):
+                continue
+            if override:
+                try:
+                    limit_text, window_text = override.split("/", 1)
+                    limit, window_seconds = int(limit_text), int(window_text)
+                except ValueError:
+                    logger.error(f"Ignoring invalid RATE_LIMIT_{name.upper()}='{override}', expected <requests>/<seconds>")
+            self.policies.append(RateLimitPolicy(name, prefix, limit, window_seconds, key_by))
+        self.policies.sort(key=lambda policy: len(policy.prefix), reverse=True)
+
+        self._local = SlidingWindowCounter()
+        self._shared_failed_at: Optional[float] = None
+        self.stats = {"allowed": 0, "limited": 0, "shared_backend_errors": 0}
+
+    def match(self, path: str) -> Optional[RateLimitPolicy]:
+        for policy in self.policies:
+            if path == policy.prefix or (policy.prefix.endswith("/") and path.startswith(policy.prefix)):
+                return policy
+        return None
+
+    async def dispatch(self, request: Request, call_next) -> Response:
+        """HTTP middleware body: count the request against its route's policy"""
+        # Skip preflight requests
+        if not self.enabled or request.method == "OPTIONS":
+            return await call_next(request)
+        policy = self.match(request.url.path)
+        if policy is None:
+            return await call_next(request)
+
+        allowed, remaining, retry_after = await self.hit(policy, await self._client_key(request, policy))
+        headers = {"X-RateLimit-Limit": str(policy.limit), "X-RateLimit-Remaining": str(remaining)}
+        if not allowed:
+            headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+            return Response(status_code=429, content="Too Many Requests", headers=headers)
+
+        response = await call_next(request)
+        for header, value in headers.items():
+            response.headers.setdefault(header, value)
+        return response
+
+    @staticmethod
+    async def _client_key(request: Request, policy: RateLimitPolicy) -> str:
+        if policy.key_by == "user":
+            authorization = request.headers.get("Authorization", "")
+            if authorization.lower().startswith("bearer ") and len(authorization) > 7:
+                from app.utils.supabase_jwt import supabase_jwt_verifier
+
+                # Only a token that verifies names a user; anything else the
+                # client sends would otherwise buy it a fresh bucket
+                user_id = await supabase_jwt_verifier.verified_subject(authorization[7:])
+                if user_id:
+                    return f"user:{user_id}"
+        client_ip = (request.client.host if request.client else "unknown") or "unknown"
+        return f"ip:{client_ip}"
+
+    async def hit(self, policy: RateLimitPolicy, client_key: str) -> Tuple[bool, int, float]:
+        """Count one request for a client under a policy; returns (allowed, remaining, retry_after)"""
+        key = f"{policy.name}:{client_key}"
+        result = None
+        if self.backend == "postgres" and not self._shared_backend_cooling_down():
+            try:
+                result = await self._hit_shared(key, policy)
+            except Exception as e:
+                self.stats["shared_backend_errors"] += 1
+                self._shared_failed_at = time.monotonic()
+                logger.warning(f"Shared rate limit unavailable, using per-worker counters: {str(e)}")
+        if result is None:
+            local_limit = max(1, policy.limit // self.local_workers)
+            result = self._local.hit(key, local_limit, policy.window_seconds)
+
+        self.stats["allowed" if result[0] else "limited"] += 1
+        return result
+
+    def _shared_backend_cooling_down(self) -> bool:
+        # After a failure, stay on the local counters for a while before retrying Postgres
+        return self._shared_failed_at is not None and time.monotonic() - self._shared_failed_at < 30
+
+    async def _hit_shared(self, key: str, policy: RateLimitPolicy) -> Tuple[bool, int, float]:
+        from app.utils.supabase_client import supabase_admin_client
+
+        def _call():
+            return supabase_admin_client.rpc("rate_limit_hit", {
+                "p_key": key,
+                "p_limit": policy.limit,
+                "p_window_seconds": policy.window_seconds,
+            }).execute()
+
+        # supabase-py is synchronous; keep it off the event loop
+        response = await asyncio.get_running_loop().run_in_executor(None, _call)
+        data = response.data or {}
+        return bool(data.get("allowed")), int(data.get("remaining") or 0), float(data.get("retry_after") or 0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Limiter counters for health endpoints"""
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "backend": "local" if self.backend != "postgres" or self._shared_backend_cooling_down() else "postgres",
+            "local_keys": len(self._local),
+            "policies": {policy.name: f"{policy.limit}/{policy.window_seconds}s {policy.prefix}" for policy in self.policies},
+        }
+
+
+# Global instance
+rate_limit_service = RateLimitService()
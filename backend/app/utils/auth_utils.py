@@ -7,7 +7,7 @@ from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
 from app.models.user import TokenData, User as UserModel
 from dotenv import load_dotenv
-from .supabase_client import supabase_admin_client
+from .supabase_jwt import supabase_jwt_verifier, SupabaseTokenError, SupabaseAuthUnavailableError
 import logging
 
 # Load environment variables
@@ -154,46 +154,17 @@ async def get_current_supabase_user(request: Request, token: Optional[str] = Dep
     if not token:
         raise credentials_exception
 
-    if supabase_admin_client is None:
-        logger.error("Supabase admin client not available for token validation.")
+    try:
+        # Verified locally against the project's JWT secret or JWKS; cached briefly
+        user_data_for_endpoints = await supabase_jwt_verifier.verify(token)
+        logger.debug(f"Supabase token validated for user: {user_data_for_endpoints.get('email')}")
+        return user_data_for_endpoints
+    except SupabaseTokenError as e:
+        logger.warning(f"Supabase token validation failed: {e}")
+        raise credentials_exception
+    except SupabaseAuthUnavailableError as e:
+        logger.error(f"Supabase token could not be validated: {e}")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Authentication service is unavailable",
         )
-
-    try:
-        logger.debug("Calling supabase_admin_client.auth.get_user(token)...")
-        # Use the Supabase admin client to validate the token
-        user_response = supabase_admin_client.auth.get_user(token)
-        logger.debug(f"Supabase get_user response received.")
-        
-        supabase_user = user_response.user
-        
-        if supabase_user is None:
-            logger.warning("Supabase token deemed valid by library, but no user object returned.")
-            raise credentials_exception
-        
-        logger.info(f"Supabase token validated successfully for user: {supabase_user.email}")
-        
-        # Map Supabase user data to a dictionary format expected by endpoints
-        user_data_for_endpoints = {
-            "username": supabase_user.email,
-            "email": supabase_user.email,
-            "role": supabase_user.user_metadata.get('role', 'authenticated'),
-            "permissions": supabase_user.user_metadata.get('permissions', []),
-            "id": supabase_user.id
-        }
-        logger.debug(f"Returning user data: {user_data_for_endpoints}")
-        return user_data_for_endpoints
-        
-    except Exception as e:
-        logger.error(f"Supabase token validation failed! Error type: {type(e).__name__}, Error: {e}", exc_info=True)
-        # Log details about the exception
-        # Check for specific Supabase/GoTrue errors if possible, e.g., invalid JWT
-        if "invalid" in str(e).lower() or "expired" in str(e).lower() or "401" in str(e):
-             logger.warning(f"Potential invalid/expired token based on error string: {e}")
-             raise credentials_exception
-        else:
-            # For unexpected errors, raise a 500 or the original credentials exception
-            logger.error("Unexpected error during Supabase token validation.")
-            raise credentials_exception
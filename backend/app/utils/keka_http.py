@@ -0,0 +1,86 @@
+"""
+Keka HTTP Client
+One long-lived, pooled async HTTP client shared by every Keka service:
+keep-alive connections, HTTP/2 when available and configured limits
+"""
+
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (HTTP/2 support for httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class KekaHTTPClient:
+    """
+    Shared httpx.AsyncClient for login.keka.com and <company>.keka.com
+    """
+
+    def __init__(self):
+        self.http2 = os.getenv("KEKA_HTTP2", "true").lower() == "true"
+        self.max_connections = int(os.getenv("KEKA_MAX_CONNECTIONS", "50"))
+        self.max_keepalive_connections = int(os.getenv("KEKA_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        self.keepalive_expiry = float(os.getenv("KEKA_KEEPALIVE_EXPIRY", "60"))
+        self.timeout = float(os.getenv("KEKA_HTTP_TIMEOUT", "30"))
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Get the shared client, creating it on first use in the running loop"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if self._client is None or self._client.is_closed or (loop is not None and loop is not self._loop):
+            use_http2 = self.http2 and HTTP2_AVAILABLE
+            if self.http2 and not HTTP2_AVAILABLE:
+                logger.warning("KEKA_HTTP2 is enabled but the 'h2' package is not installed; using HTTP/1.1")
+
+            self._client = httpx.AsyncClient(
+                http2=use_http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+            )
+            self._loop = loop
+            logger.info(f"Keka HTTP client initialized (http2={use_http2}, max_connections={self.max_connections})")
+        return self._client
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[httpx.AsyncClient]:
+        """
+        Drop-in replacement for `async with httpx.AsyncClient() as client:`
+        that hands out the shared client and leaves it open afterwards
+        """
+        yield self.client
+
+    async def start(self) -> None:
+        """Open the pool on app startup"""
+        _ = self.client
+
+    async def aclose(self) -> None:
+        """Close the pool on app shutdown"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+
+# Global instance
+keka_http = KekaHTTPClient()
@@ -0,0 +1,66 @@
+"""
+Keyword Matcher
+Aho-Corasick automaton that finds every occurrence of a fixed keyword set
+in one left-to-right pass over the text
+"""
+
+from collections import deque
+from typing import Dict, Iterable, List, Set
+
+
+class KeywordMatcher:
+    """
+    Multi-keyword substring matcher built once and reused for every message.
+
+    Matching is plain substring matching (same semantics as `keyword in text`),
+    including overlapping keywords such as "leave" inside "sick leave".
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        # goto[state] maps a character to the next state; state 0 is the root
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Set[str]] = [set()]
+
+        for keyword in keywords:
+            if keyword:
+                self._add(keyword)
+        self._build_failure_links()
+
+    def _add(self, keyword: str) -> None:
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].add(keyword)
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                # Inherit matches that end at the failure state (suffix keywords)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def find_all(self, text: str) -> Set[str]:
+        """Return the set of keywords that occur anywhere in the text"""
+        found: Set[str] = set()
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._output[state]:
+                found |= self._output[state]
+        return found
@@ -0,0 +1,315 @@
+"""
+LLM Gateway
+Single entry point for all OpenAI calls: one pooled HTTP client shared by
+completions and embeddings, per-model concurrency limits, jittered
+exponential retry on 429/5xx and hard deadlines
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import (
+    AsyncOpenAI,
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: rate limiting, timeouts and upstream failures
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMUsage:
+    """Tokens used by the LLM calls made while it is the current usage tracker"""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.calls = 0
+        # Calls whose usage had to be estimated (a stream that ended without a usage chunk)
+        self.estimated_calls = 0
+
+    def add(self, prompt_tokens: int, completion_tokens: int, total_tokens: Optional[int] = None, estimated: bool = False) -> None:
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.total_tokens += total_tokens if total_tokens is not None else prompt_tokens + completion_tokens
+        self.calls += 1
+        if estimated:
+            self.estimated_calls += 1
+
+
+# Usage tracker for the current request; calls made without one aren't counted
+current_llm_usage: ContextVar[Optional[LLMUsage]] = ContextVar("llm_usage", default=None)
+
+
+def _record_usage(usage: Any) -> bool:
+    """Add an SDK usage object (or dict) to the current tracker; False if there was none"""
+    if usage is None:
+        return False
+    tracker = current_llm_usage.get()
+    if tracker is not None:
+        read = usage.get if isinstance(usage, dict) else lambda field: getattr(usage, field, None)
+        tracker.add(int(read("prompt_tokens") or 0), int(read("completion_tokens") or 0), read("total_tokens"))
+    return True
+
+
+def _estimate_tokens(characters: int) -> int:
+    # Roughly four characters per token for English text
+    return characters // 4 + 1
+
+
+class LLMError(Exception):
+    """Base error raised by the LLM gateway"""
+
+    def __init__(self, message: str, model: Optional[str] = None, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.model = model
+        self.status_code = status_code
+
+
+class LLMRateLimitError(LLMError):
+    """OpenAI kept returning 429 after all retries"""
+
+
+class LLMTimeoutError(LLMError):
+    """The call did not finish within its hard deadline"""
+
+
+class LLMUnavailableError(LLMError):
+    """OpenAI returned 5xx or could not be reached after all retries"""
+
+
+class LLMRequestError(LLMError):
+    """Non-retryable request error (bad request, auth, unknown model, ...)"""
+
+
+class LLMGateway:
+    """
+    Shared OpenAI client with pooling, concurrency limits, retries and deadlines
+    """
+
+    def __init__(self):
+        self.api_key = os.getenv("OPENAI_API_KEY")
+
+        # Connection pool for the shared HTTP client
+        self.max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+        self.max_keepalive_connections = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+
+        # Concurrent in-flight calls allowed per model
+        self.max_concurrency_per_model = int(os.getenv("OPENAI_MAX_CONCURRENCY_PER_MODEL", "16"))
+
+        # Retry policy (attempts after the first one)
+        self.max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+        self.retry_base_delay = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+        self.retry_max_delay = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "8"))
+
+        # Per-attempt HTTP timeout and hard deadlines (seconds) for the whole call
+        self.request_timeout = float(os.getenv("OPENAI_REQUEST_TIMEOUT", "30"))
+        self.completion_deadline = float(os.getenv("OPENAI_COMPLETION_DEADLINE", "60"))
+        self.embedding_deadline = float(os.getenv("OPENAI_EMBEDDING_DEADLINE", "20"))
+        self.stream_first_chunk_timeout = float(os.getenv("OPENAI_STREAM_FIRST_CHUNK_TIMEOUT", "20"))
+        self.stream_deadline = float(os.getenv("OPENAI_STREAM_DEADLINE", "120"))
+        # Ask for a final usage chunk on streams so token budgets see real counts
+        self.stream_include_usage = os.getenv("OPENAI_STREAM_INCLUDE_USAGE", "true").lower() == "true"
+
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._client: Optional[AsyncOpenAI] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """Lazily create the shared AsyncOpenAI client on top of one pooled httpx client"""
+        if self._client is None:
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                ),
+                timeout=httpx.Timeout(self.request_timeout, connect=10.0),
+            )
+            # Retries are handled here, not inside the SDK
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                http_client=self._http_client,
+                max_retries=0,
+                timeout=self.request_timeout,
+            )
+            logger.info("LLM gateway client initialized")
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the pooled HTTP client (called on app shutdown)"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self._http_client = None
+        self._client = None
+        self._semaphores = {}
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        """Get (or create) the concurrency limiter for a model"""
+        semaphore = self._semaphores.get(model)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency_per_model)
+            self._semaphores[model] = semaphore
+        return semaphore
+
+    def _translate_error(self, error: Exception, model: str) -> LLMError:
+        """Map SDK / transport exceptions onto gateway error types"""
+        if isinstance(error, LLMError):
+            return error
+        if isinstance(error, (asyncio.TimeoutError, APITimeoutError)):
+            return LLMTimeoutError(f"OpenAI call timed out for {model}", model=model)
+        if isinstance(error, APIStatusError):
+            status_code = error.status_code
+            if status_code == 429:
+                return LLMRateLimitError(f"OpenAI rate limit hit for {model}", model=model, status_code=status_code)
+            if status_code in RETRYABLE_STATUS_CODES:
+                return LLMUnavailableError(f"OpenAI returned {status_code} for {model}", model=model, status_code=status_code)
+            return LLMRequestError(f"OpenAI rejected request for {model}: {status_code}", model=model, status_code=status_code)
+        if isinstance(error, (APIConnectionError, httpx.HTTPError)):
+            return LLMUnavailableError(f"Could not reach OpenAI for {model}: {error}", model=model)
+        return LLMError(f"Unexpected OpenAI error for {model}: {error}", model=model)
+
+    def _is_retryable(self, error: LLMError) -> bool:
+        return isinstance(error, (LLMRateLimitError, LLMUnavailableError, LLMTimeoutError))
+
+    def _retry_delay(self, attempt: int, original: Exception) -> float:
+        """Full-jitter exponential backoff, honouring Retry-After when OpenAI sends one"""
+        retry_after = None
+        response = getattr(original, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after", ""))
+            except (TypeError, ValueError):
+                retry_after = None
+
+        ceiling = min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.retry_max_delay))
+        return delay
+
+    async def _bounded(self, awaitable: Awaitable[Any], deadline: float) -> Any:
+        """Await with whatever is left of the hard deadline"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        return await asyncio.wait_for(awaitable, timeout=remaining)
+
+    async def _call(self, model: str, operation: Callable[[], Awaitable[Any]], deadline_seconds: float) -> Any:
+        """Run one OpenAI operation under the model semaphore with retries and a deadline"""
+        deadline = time.monotonic() + deadline_seconds
+        semaphore = self._semaphore(model)
+        attempt = 0
+
+        while True:
+            try:
+                async with semaphore:
+                    return await self._bounded(operation(), deadline)
+            except Exception as e:
+                error = self._translate_error(e, model)
+                out_of_time = deadline - time.monotonic() <= 0
+                if not self._is_retryable(error) or attempt >= self.max_retries or out_of_time:
+                    logger.error(f"LLM call failed for {model} after {attempt + 1} attempt(s): {error}")
+                    raise error from e
+
+                delay = min(self._retry_delay(attempt, e), max(0.0, deadline - time.monotonic()))
+                logger.warning(f"LLM call to {model} failed ({error}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def chat_completion(self, messages: List[Dict[str, str]], model: str, **kwargs) -> Any:
+        """Create a (non-streaming) chat completion and return the raw SDK response"""
+        response = await self._call(
+            model,
+            lambda: self.client.chat.completions.create(model=model, messages=messages, **kwargs),
+            self.completion_deadline,
+        )
+        _record_usage(getattr(response, "usage", None))
+        return response
+
+    async def chat_completion_stream(self, messages: List[Dict[str, str]], model: str, **kwargs) -> AsyncIterator[str]:
+        """
+        Stream a chat completion as text chunks.
+
+        Retries only happen before the first chunk has been yielded; once the
+        caller has seen output a failure is raised as-is.
+        """
+        deadline = time.monotonic() + self.stream_deadline
+        semaphore = self._semaphore(model)
+        attempt = 0
+        if self.stream_include_usage:
+            # Passed through as-is: this SDK version has no stream_options argument
+            kwargs.setdefault("extra_body", {}).setdefault("stream_options", {"include_usage": True})
+
+        while True:
+            yielded = False
+            streamed_chars = 0
+            usage_recorded = False
+            try:
+                async with semaphore:
+                    first_chunk_deadline = min(deadline, time.monotonic() + self.stream_first_chunk_timeout)
+                    stream = await self._bounded(
+                        self.client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs),
+                        first_chunk_deadline,
+                    )
+                    try:
+                        iterator = stream.__aiter__()
+                        while True:
+                            try:
+                                chunk = await self._bounded(
+                                    iterator.__anext__(),
+                                    deadline if yielded else first_chunk_deadline,
+                                )
+                            except StopAsyncIteration:
+                                return
+                            # The usage chunk comes last, with no choices
+                            usage_recorded = _record_usage(getattr(chunk, "usage", None)) or usage_recorded
+                            if chunk.choices and chunk.choices[0].delta.content is not None:
+                                yielded = True
+                                streamed_chars += len(chunk.choices[0].delta.content)
+                                yield chunk.choices[0].delta.content
+                    finally:
+                        await stream.response.aclose()
+                        tracker = current_llm_usage.get()
+                        if yielded and not usage_recorded and tracker is not None:
+                            # Cut short or no usage chunk: estimate so the tokens still count
+                            prompt_chars = sum(len(str(message.get("content") or "")) for message in messages)
+                            tracker.add(_estimate_tokens(prompt_chars), _estimate_tokens(streamed_chars), estimated=True)
+            except Exception as e:
+                error = self._translate_error(e, model)
+                out_of_time = deadline - time.monotonic() <= 0
+                if yielded or not self._is_retryable(error) or attempt >= self.max_retries or out_of_time:
+                    logger.error(f"LLM stream failed for {model} after {attempt + 1} attempt(s): {error}")
+                    raise error from e
+
+                delay = min(self._retry_delay(attempt, e), max(0.0, deadline - time.monotonic()))
+                logger.warning(f"LLM stream to {model} failed before first chunk ({error}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def embeddings(self, text: str, model: str) -> List[float]:
+        """Create an embedding vector for a single input"""
+        response = await self._call(
+            model,
+            lambda: self.client.embeddings.create(input=text, model=model),
+            self.embedding_deadline,
+        )
+        _record_usage(getattr(response, "usage", None))
+        return response.data[0].embedding
+
+
+# Global instance
+llm_gateway = LLMGateway()
@@ -1,21 +1,23 @@
 import os
 import numpy as np
-# Use AsyncOpenAI for async FastAPI app
-from openai import AsyncOpenAI
 from typing import List, Dict, Any
 from dotenv import load_dotenv
 import hashlib
+# All OpenAI traffic goes through the shared gateway (pooled client, retries, deadlines)
+from app.utils.llm_gateway import llm_gateway, LLMError
 
 # Load environment variables
 load_dotenv()
 
-# Initialize AsyncOpenAI client
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Model tiers used by the chat router: a small model for FAQ / knowledge-base
+# answers and the larger model for personal HR data and open questions
+CHAT_MODEL_LARGE = os.getenv("OPENAI_CHAT_MODEL", "gpt-4.1-mini")
+CHAT_MODEL_SMALL = os.getenv("OPENAI_CHAT_MODEL_SMALL", "gpt-4.1-nano")
 
 # Check if we should use mock embeddings (for testing without OpenAI credits)
 USE_MOCK_EMBEDDINGS = os.getenv("USE_MOCK_EMBEDDINGS", "false").lower() == "true"
 
-async def get_chat_completion(messages: List[Dict[str, str]], model: str = "gpt-4.1-mini"):
+async def get_chat_completion(messages: List[Dict[str, str]], model: str = CHAT_MODEL_LARGE):
     """
     Get a chat completion from OpenAI API.
     
@@ -25,20 +27,14 @@ async def get_chat_completion(messages: List[Dict[str, str]], model: str = "gpt-
         
     Returns:
         The assistant's response text
+
+    Raises:
+        LLMError: (or a subclass) if the call fails after retries or misses its deadline
     """
-    try:
-        # Use await with the async client
-        response = await client.chat.completions.create(
-            model=model,
-            messages=messages
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        # Log the error in a real application
-        print(f"Error calling OpenAI API: {e}")
-        return f"Sorry, I encountered an error: {str(e)}"
+    response = await llm_gateway.chat_completion(messages, model=model)
+    return response.choices[0].message.content.strip()
 
-async def get_chat_completion_stream(messages: List[Dict[str, str]], model: str = "gpt-4.1-mini"):
+async def get_chat_completion_stream(messages: List[Dict[str, str]], model: str = CHAT_MODEL_LARGE):
     """
     Get a chat completion stream from OpenAI API (async).
     
@@ -48,21 +44,12 @@ async def get_chat_completion_stream(messages: List[Dict[str, str]], model: str
         
     Yields:
         Chunks of the assistant's response text as they arrive.
+
+    Raises:
+        LLMError: (or a subclass) if the stream fails; callers decide how to fall back
     """
-    try:
-        # Use await with the async client
-        stream = await client.chat.completions.create(
-            model=model,
-            messages=messages,
-            stream=True,
-        )
-        # Use async for with the async stream
-        async for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
-    except Exception as e:
-        print(f"Error calling OpenAI stream API: {e}")
-        yield f"Sorry, I encountered an error during streaming: {str(e)}"
+    async for chunk in llm_gateway.chat_completion_stream(messages, model=model):
+        yield chunk
 
 def get_mock_embedding(text: str, dimension: int = 1536) -> List[float]:
     """
@@ -99,33 +86,14 @@ async def get_embeddings(text: str, model: str = "text-embedding-3-small") -> Li
         model (str): The OpenAI embedding model to use.
 
     Returns:
-        List[float]: The generated embedding vector, or None if an error occurs.
+        List[float]: The generated embedding vector.
+
+    Raises:
+        LLMError: (or a subclass) if the embedding call fails after retries.
     """
     print(f"Getting real embeddings for text: {text[:50]}...") # Keep this for debugging
     try:
-        # Ensure client is initialized (consider moving initialization if not already done globally)
-        # client = OpenAI(api_key=os.getenv("OPENAI_API_KEY")) # If using synchronous client
-        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")) # Ensure using async client
-
-        # Get the embedding from OpenAI asynchronously
-        response = await client.embeddings.create(
-            input=text,
-            model=model
-        )
-
-        # Extract the embedding
-        embedding = response.data[0].embedding
-        # print(f"Received embedding of length {len(embedding)}") # Optional: keep if needed
-
-        # Ensure we return a list, not a numpy array if applicable (unlikely with OpenAI client)
-        # if hasattr(embedding, 'tolist'):
-        #     embedding = embedding.tolist()
-
-        return embedding
-    except Exception as e:
+        return await llm_gateway.embeddings(text, model=model)
+    except LLMError as e:
         print(f"Error getting embeddings: {e}")
-        import traceback
-        print(traceback.format_exc())
-        # Depending on desired behavior, either return None or re-raise
-        # return None
         raise  # Re-raise the exception so the caller knows something went wrong
@@ -0,0 +1,306 @@
+"""
+Supabase JWT Verification
+Verifies Supabase access tokens locally (project JWT secret or the project's
+JWKS) with a short-lived verified-token cache, falling back to Supabase Auth
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httpx
+from jose import JWTError, jwt
+
+logger = logging.getLogger(__name__)
+
+
+class SupabaseTokenError(Exception):
+    """The token is invalid, expired or revoked"""
+
+
+class SupabaseAuthUnavailableError(Exception):
+    """The token couldn't be checked: no key to verify it locally and Supabase Auth is unreachable"""
+
+
+class SupabaseJWTVerifier:
+    """
+    Checks signature, expiry, audience and issuer of Supabase access tokens
+    without a network call. HS256 tokens are checked against
+    SUPABASE_JWT_SECRET; asymmetric ones against the project's JWKS, which is
+    cached and refetched when an unknown key ID shows up.
+
+    Verified tokens are cached until the sooner of their expiry and a short
+    TTL. Because a local check can't see a sign-out or a deleted user, each
+    session is also confirmed with Supabase Auth in the background at most
+    once per revocation interval; a session found revoked is refused from
+    then on. Tokens that can't be checked locally go to Supabase Auth.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("SUPABASE_AUTH_LOCAL_VERIFY", "true").lower() == "true"
+        supabase_url = (os.getenv("SUPABASE_URL") or "").rstrip("/")
+        self.jwt_secret = os.getenv("SUPABASE_JWT_SECRET", "")
+        self.jwks_url = os.getenv("SUPABASE_JWKS_URL") or (f"{supabase_url}/auth/v1/.well-known/jwks.json" if supabase_url else "")
+        self.issuer = os.getenv("SUPABASE_JWT_ISSUER") or (f"{supabase_url}/auth/v1" if supabase_url else "")
+        self.audience = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+        self.jwks_ttl = float(os.getenv("SUPABASE_JWKS_CACHE_TTL", "3600"))
+        # Seconds a verified token is served from memory
+        self.cache_ttl = float(os.getenv("SUPABASE_AUTH_CACHE_TTL", "60"))
+        self.cache_max_entries = int(os.getenv("SUPABASE_AUTH_CACHE_MAX_ENTRIES", "10000"))
+        # Seconds between Supabase Auth checks per session; 0 turns them off
+        self.revocation_interval = float(os.getenv("SUPABASE_AUTH_REVOCATION_CHECK_INTERVAL", "300"))
+        # Tokens may be a few seconds early or late against our clock
+        self.leeway = int(os.getenv("SUPABASE_JWT_LEEWAY", "10"))
+
+        # sha256(token) -> (cached_until, user, session key)
+        self._verified: "OrderedDict[str, Tuple[float, Dict[str, Any], str]]" = OrderedDict()
+        self._jwks: List[Dict[str, Any]] = []
+        self._jwks_fetched_at: Optional[float] = None
+        self._jwks_lock: Optional[asyncio.Lock] = None
+        # session key -> monotonic time of the last Supabase Auth check
+        self._session_checked: "OrderedDict[str, float]" = OrderedDict()
+        # session key -> when its revocation stops mattering (its tokens have expired)
+        self._revoked_sessions: Dict[str, float] = {}
+        self._background_tasks: Set[asyncio.Task] = set()
+
+        self.stats = {"cache_hits": 0, "local_verified": 0, "remote_verified": 0, "rejected": 0, "revoked": 0, "jwks_fetches": 0}
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        """The user a token belongs to, in the shape endpoints expect; raises SupabaseTokenError"""
+        token_key = hashlib.sha256(token.encode()).hexdigest()
+        now = time.time()
+
+        cached = self._verified.get(token_key)
+        if cached is not None and cached[0] > now:
+            self._verified.move_to_end(token_key)
+            self.stats["cache_hits"] += 1
+            self._schedule_revocation_check(token, cached[2], cached[0])
+            return cached[1]
+
+        claims = await self._verify_locally(token) if self.enabled else None
+        if claims is None:
+            user = await self._verify_remotely(token)
+            self.stats["remote_verified"] += 1
+            # No expiry to go by, so only the short TTL applies
+            self._remember(token_key, user, user["id"], now + self.cache_ttl)
+            return user
+
+        # Supabase puts the session ID in its tokens; older ones only name the user
+        session_key = claims.get("session_id") or claims["sub"]
+        expires_at = float(claims["exp"])
+        revoked_until = self._revoked_sessions.get(session_key)
+        if revoked_until is not None:
+            if revoked_until > now:
+                self.stats["rejected"] += 1
+                raise SupabaseTokenError("Session has been revoked")
+            del self._revoked_sessions[session_key]
+
+        user = self._user_from_claims(claims)
+        self.stats["local_verified"] += 1
+        self._remember(token_key, user, session_key, min(now + self.cache_ttl, expires_at))
+        self._schedule_revocation_check(token, session_key, expires_at)
+        return user
+
+    async def verified_subject(self, token: str) -> Optional[str]:
+        """
+        The user ID of a token that is cached or verifies locally, else None.
+        Never calls Supabase Auth, so it is safe to run on unauthenticated
+        traffic (the rate limiter keys requests by it).
+        """
+        token_key = hashlib.sha256(token.encode()).hexdigest()
+        now = time.time()
+        cached = self._verified.get(token_key)
+        if cached is not None and cached[0] > now:
+            return cached[1]["id"]
+        if not self.enabled:
+            return None
+
+        try:
+            claims = await self._verify_locally(token)
+        except SupabaseTokenError:
+            return None
+        if claims is None:
+            return None
+        session_key = claims.get("session_id") or claims["sub"]
+        revoked_until = self._revoked_sessions.get(session_key)
+        if revoked_until is not None and revoked_until > now:
+            return None
+
+        self._remember(token_key, self._user_from_claims(claims), session_key, min(now + self.cache_ttl, float(claims["exp"])))
+        return claims["sub"]
+
+    # ------------------------------------------------------------------
+    # Local verification
+    # ------------------------------------------------------------------
+
+    async def _verify_locally(self, token: str) -> Optional[Dict[str, Any]]:
+        """Verified claims, or None when there is no key to check this token against"""
+        try:
+            header = jwt.get_unverified_header(token)
+        except JWTError as e:
+            self.stats["rejected"] += 1
+            raise SupabaseTokenError(f"Malformed token: {str(e)}")
+
+        algorithm = header.get("alg")
+        if algorithm == "HS256":
+            if not self.jwt_secret:
+                return None
+            key: Any = self.jwt_secret
+        elif algorithm in ("RS256", "ES256"):
+            key = await self._signing_key(header.get("kid"))
+            if key is None:
+                return None
+        else:
+            self.stats["rejected"] += 1
+            raise SupabaseTokenError(f"Unsupported token algorithm: {algorithm}")
+
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=[algorithm],
+                audience=self.audience or None,
+                issuer=self.issuer or None,
+                options={"verify_aud": bool(self.audience), "require_exp": True, "require_sub": True, "leeway": self.leeway},
+            )
+        except JWTError as e:
+            self.stats["rejected"] += 1
+            raise SupabaseTokenError(str(e))
+        return claims
+
+    async def _signing_key(self, kid: Optional[str]) -> Optional[Dict[str, Any]]:
+        """The JWKS entry for a key ID, refetching the set once if it's unknown"""
+        if not self.jwks_url:
+            return None
+        key = self._find_jwk(kid)
+        if key is not None and self._since_jwks_fetch() <= self.jwks_ttl:
+            return key
+
+        if self._jwks_lock is None:
+            self._jwks_lock = asyncio.Lock()
+        async with self._jwks_lock:
+            # Another request may have refetched while this one waited;
+            # and don't refetch for unknown key IDs more than once a minute
+            since_fetch = self._since_jwks_fetch()
+            if since_fetch > self.jwks_ttl or (self._find_jwk(kid) is None and since_fetch > 60):
+                await self._fetch_jwks()
+        return self._find_jwk(kid)
+
+    def _since_jwks_fetch(self) -> float:
+        return float("inf") if self._jwks_fetched_at is None else time.monotonic() - self._jwks_fetched_at
+
+    def _find_jwk(self, kid: Optional[str]) -> Optional[Dict[str, Any]]:
+        for jwk in self._jwks:
+            if kid is None or jwk.get("kid") == kid:
+                return jwk
+        return None
+
+    async def _fetch_jwks(self) -> None:
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                response = await client.get(self.jwks_url)
+                response.raise_for_status()
+                self._jwks = response.json().get("keys", [])
+            self.stats["jwks_fetches"] += 1
+        except Exception as e:
+            # Keep serving the keys we have; with none, tokens go to Supabase Auth
+            logger.warning(f"Failed to fetch Supabase JWKS from {self.jwks_url}: {str(e)}")
+        self._jwks_fetched_at = time.monotonic()
+
+    @staticmethod
+    def _user_from_claims(claims: Dict[str, Any]) -> Dict[str, Any]:
+        metadata = claims.get("user_metadata") or {}
+        return {
+            "username": claims.get("email"),
+            "email": claims.get("email"),
+            "role": metadata.get("role", "authenticated"),
+            "permissions": metadata.get("permissions", []),
+            "id": claims["sub"],
+        }
+
+    def _remember(self, token_key: str, user: Dict[str, Any], session_key: str, cached_until: float) -> None:
+        self._verified[token_key] = (cached_until, user, session_key)
+        self._verified.move_to_end(token_key)
+        while len(self._verified) > self.cache_max_entries:
+            self._verified.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # Supabase Auth checks
+    # ------------------------------------------------------------------
+
+    async def _verify_remotely(self, token: str) -> Dict[str, Any]:
+        from app.utils.supabase_client import supabase_admin_client
+
+        if supabase_admin_client is None:
+            raise SupabaseAuthUnavailableError("Supabase admin client not available for token validation")
+        try:
+            # supabase-py is synchronous; keep it off the event loop
+            user_response = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: supabase_admin_client.auth.get_user(token)
+            )
+        except Exception as e:
+            # Only an answer from Supabase Auth says anything about the token
+            if getattr(e, "status", None) in (401, 403) or "invalid" in str(e).lower() or "expired" in str(e).lower():
+                self.stats["rejected"] += 1
+                raise SupabaseTokenError(f"Supabase rejected the token: {str(e)}")
+            raise SupabaseAuthUnavailableError(f"Supabase Auth could not be reached: {type(e).__name__}: {str(e)}")
+
+        supabase_user = user_response.user if user_response else None
+        if supabase_user is None:
+            self.stats["rejected"] += 1
+            raise SupabaseTokenError("Supabase returned no user for the token")
+        metadata = supabase_user.user_metadata or {}
+        return {
+            "username": supabase_user.email,
+            "email": supabase_user.email,
+            "role": metadata.get("role", "authenticated"),
+            "permissions": metadata.get("permissions", []),
+            "id": supabase_user.id,
+        }
+
+    def _schedule_revocation_check(self, token: str, session_key: str, expires_at: float) -> None:
+        if self.revocation_interval <= 0 or not self.enabled:
+            return
+        now = time.monotonic()
+        last_checked = self._session_checked.get(session_key)
+        if last_checked is not None and now - last_checked < self.revocation_interval:
+            return
+        # Claimed up front so concurrent requests don't each start a check
+        self._session_checked[session_key] = now
+        self._session_checked.move_to_end(session_key)
+        while len(self._session_checked) > self.cache_max_entries:
+            self._session_checked.popitem(last=False)
+
+        task = asyncio.ensure_future(self._check_revocation(token, session_key, expires_at))
+        # Hold a reference so the task isn't garbage collected mid-flight
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _check_revocation(self, token: str, session_key: str, expires_at: float) -> None:
+        try:
+            await self._verify_remotely(token)
+        except SupabaseTokenError as e:
+            logger.warning(f"Supabase session {session_key} was revoked: {str(e)}")
+            self.stats["revoked"] += 1
+            # Once every token the session issued has expired the entry is moot
+            self._revoked_sessions[session_key] = max(expires_at, time.time() + self.cache_ttl)
+            self._drop_session(session_key)
+        except Exception as e:
+            # Can't tell; try again on the next interval
+            logger.debug(f"Supabase revocation check skipped: {str(e)}")
+
+    def _drop_session(self, session_key: str) -> None:
+        for token_key in [key for key, (_, _, cached_session) in self._verified.items() if cached_session == session_key]:
+            del self._verified[token_key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters for health endpoints"""
+        return {**self.stats, "cached_tokens": len(self._verified), "jwks_keys": len(self._jwks)}
+
+
+# Global instance
+supabase_jwt_verifier = SupabaseJWTVerifier()
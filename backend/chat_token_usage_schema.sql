@@ -0,0 +1,51 @@
+-- Chat Token Usage Schema
+-- Per-user daily LLM token totals behind the chat token budget, shared by
+-- every backend worker
+-- Run this in your Supabase SQL editor or psql
+
+-- One row per (user, UTC day). user_key is "user:<supabase id>" for signed-in
+-- users and "ip:<address>" for public chat.
+CREATE TABLE IF NOT EXISTS public.chat_token_usage (
+    user_key TEXT NOT NULL,
+    usage_date DATE NOT NULL,
+    tokens BIGINT NOT NULL DEFAULT 0,
+    requests INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_key, usage_date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_token_usage_usage_date ON public.chat_token_usage(usage_date);
+
+ALTER TABLE public.chat_token_usage ENABLE ROW LEVEL SECURITY;
+
+-- RLS Policy: Only the backend (service role) touches usage totals
+CREATE POLICY "Service role can manage chat token usage"
+ON public.chat_token_usage
+FOR ALL
+USING (auth.role() = 'service_role');
+
+-- Add one request's tokens to a user's total for the day and return the new total.
+-- The upsert is atomic, so concurrent workers never lose an increment.
+CREATE OR REPLACE FUNCTION public.chat_token_usage_add(
+    p_user_key TEXT,
+    p_usage_date DATE,
+    p_tokens BIGINT
+)
+RETURNS BIGINT AS $$
+DECLARE
+    v_total BIGINT;
+BEGIN
+    INSERT INTO public.chat_token_usage (user_key, usage_date, tokens, requests, updated_at)
+    VALUES (p_user_key, p_usage_date, p_tokens, 1, now())
+    ON CONFLICT (user_key, usage_date) DO UPDATE
+    SET tokens = public.chat_token_usage.tokens + EXCLUDED.tokens,
+        requests = public.chat_token_usage.requests + 1,
+        updated_at = now()
+    RETURNING tokens INTO v_total;
+
+    RETURN v_total;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+COMMENT ON TABLE public.chat_token_usage IS 'Daily LLM token usage per chat user, for the chat token budget';
+COMMENT ON FUNCTION public.chat_token_usage_add IS 'Atomically add tokens to a user''s daily chat usage; returns the new total';
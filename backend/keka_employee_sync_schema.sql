@@ -163,6 +163,9 @@ CREATE TABLE IF NOT EXISTS keka_employee_payslips (
     contributions JSONB,
     reimbursements JSONB,
     pay_slip_id VARCHAR(100),
+    pay_group_id VARCHAR(100),
+    period_year INTEGER,
+    period_month INTEGER,
     status VARCHAR(50),
     last_synced_at TIMESTAMPTZ DEFAULT NOW(),
     created_at TIMESTAMPTZ DEFAULT NOW(),
@@ -245,6 +248,8 @@ CREATE TABLE IF NOT EXISTS keka_sync_status (
     records_processed INTEGER DEFAULT 0,
     records_failed INTEGER DEFAULT 0,
     error_message TEXT,
+    sync_cursor TIMESTAMPTZ, -- watermark for incremental syncs
+    checkpoint JSONB, -- completed stages of a scheduled run, for resuming
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW(),
     
@@ -270,6 +275,8 @@ CREATE INDEX IF NOT EXISTS idx_keka_employee_attendance_status ON keka_employee_
 CREATE INDEX IF NOT EXISTS idx_keka_employee_payslips_employee_id ON keka_employee_payslips(keka_employee_id);
 CREATE INDEX IF NOT EXISTS idx_keka_employee_payslips_start_date ON keka_employee_payslips(start_date);
 CREATE INDEX IF NOT EXISTS idx_keka_employee_payslips_end_date ON keka_employee_payslips(end_date);
+CREATE INDEX IF NOT EXISTS idx_keka_employee_payslips_employee_period ON keka_employee_payslips(keka_employee_id, period_year, period_month);
+CREATE INDEX IF NOT EXISTS idx_keka_employee_payslips_pay_slip_id ON keka_employee_payslips(pay_slip_id);
 
 CREATE INDEX IF NOT EXISTS idx_keka_employee_leave_history_employee_id ON keka_employee_leave_history(keka_employee_id);
 CREATE INDEX IF NOT EXISTS idx_keka_employee_leave_history_from_date ON keka_employee_leave_history(from_date);
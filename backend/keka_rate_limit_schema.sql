@@ -0,0 +1,67 @@
+-- Keka Outbound Rate Limit Schema
+-- Token bucket shared by every backend worker so our combined Keka traffic
+-- stays inside the tenant API quota
+
+CREATE TABLE IF NOT EXISTS public.keka_rate_limit_buckets (
+    bucket_key TEXT PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE public.keka_rate_limit_buckets ENABLE ROW LEVEL SECURITY;
+
+-- RLS Policy: Only the backend (service role) touches the buckets
+CREATE POLICY "Service role can manage rate limit buckets"
+ON public.keka_rate_limit_buckets
+FOR ALL
+USING (auth.role() = 'service_role');
+
+-- Take p_requested tokens from a bucket.
+-- Returns 0 when granted, otherwise the seconds until enough tokens refill.
+-- p_reserve tokens are held back for higher-priority callers: background
+-- traffic passes the reserve, interactive traffic passes 0.
+-- A transaction-scoped advisory lock serializes callers per bucket.
+CREATE OR REPLACE FUNCTION public.keka_rate_limit_acquire(
+    p_bucket TEXT,
+    p_capacity DOUBLE PRECISION,
+    p_refill_per_second DOUBLE PRECISION,
+    p_requested DOUBLE PRECISION DEFAULT 1,
+    p_reserve DOUBLE PRECISION DEFAULT 0
+)
+RETURNS DOUBLE PRECISION AS $$
+DECLARE
+    v_now TIMESTAMPTZ := clock_timestamp();
+    v_tokens DOUBLE PRECISION;
+    v_updated_at TIMESTAMPTZ;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('keka_rate_limit:' || p_bucket));
+
+    SELECT tokens, updated_at INTO v_tokens, v_updated_at
+    FROM public.keka_rate_limit_buckets
+    WHERE bucket_key = p_bucket;
+
+    IF NOT FOUND THEN
+        v_tokens := p_capacity;
+        v_updated_at := v_now;
+        INSERT INTO public.keka_rate_limit_buckets (bucket_key, tokens, updated_at)
+        VALUES (p_bucket, v_tokens, v_now);
+    END IF;
+
+    v_tokens := LEAST(p_capacity, v_tokens + EXTRACT(EPOCH FROM (v_now - v_updated_at)) * p_refill_per_second);
+
+    IF v_tokens - p_requested >= p_reserve THEN
+        UPDATE public.keka_rate_limit_buckets
+        SET tokens = v_tokens - p_requested, updated_at = v_now
+        WHERE bucket_key = p_bucket;
+        RETURN 0;
+    END IF;
+
+    UPDATE public.keka_rate_limit_buckets
+    SET tokens = v_tokens, updated_at = v_now
+    WHERE bucket_key = p_bucket;
+    RETURN (p_requested + p_reserve - v_tokens) / p_refill_per_second;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+COMMENT ON TABLE public.keka_rate_limit_buckets IS 'Shared token buckets for outbound Keka API calls';
+COMMENT ON FUNCTION public.keka_rate_limit_acquire IS 'Atomically take tokens from a Keka rate limit bucket; returns seconds to wait (0 = granted)';
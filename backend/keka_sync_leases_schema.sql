@@ -0,0 +1,74 @@
+-- Keka Sync Leases Schema
+-- Time-limited leases that let exactly one backend worker act at a time:
+-- 'keka_sync_leader' picks the worker that fires scheduled syncs, and
+-- 'keka_sync_run' is held for the duration of any sync run so runs never overlap
+-- Run this in your Supabase SQL editor or psql
+
+CREATE TABLE IF NOT EXISTS public.keka_sync_leases (
+    lease_name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    acquired_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+ALTER TABLE public.keka_sync_leases ENABLE ROW LEVEL SECURITY;
+
+-- RLS Policy: Only the backend (service role) touches the leases
+CREATE POLICY "Service role can manage sync leases"
+ON public.keka_sync_leases
+FOR ALL
+USING (auth.role() = 'service_role');
+
+-- Take or renew a lease. Returns true when p_holder holds it afterwards:
+-- the lease was free, had expired, or already belonged to p_holder.
+-- PostgREST gives every call its own transaction, so a session advisory lock
+-- can't outlive the request; a transaction-scoped one serializes contenders
+-- and the expiry stands in for the session ending.
+CREATE OR REPLACE FUNCTION public.keka_sync_lease_acquire(
+    p_name TEXT,
+    p_holder TEXT,
+    p_ttl_seconds DOUBLE PRECISION
+)
+RETURNS BOOLEAN AS $$
+DECLARE
+    v_now TIMESTAMPTZ := clock_timestamp();
+    v_holder TEXT;
+    v_expires_at TIMESTAMPTZ;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('keka_sync_lease:' || p_name));
+
+    SELECT holder, expires_at INTO v_holder, v_expires_at
+    FROM public.keka_sync_leases
+    WHERE lease_name = p_name;
+
+    IF FOUND AND v_holder <> p_holder AND v_expires_at > v_now THEN
+        RETURN FALSE;
+    END IF;
+
+    INSERT INTO public.keka_sync_leases (lease_name, holder, acquired_at, expires_at)
+    VALUES (p_name, p_holder, v_now, v_now + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (lease_name) DO UPDATE
+    SET holder = EXCLUDED.holder,
+        acquired_at = CASE WHEN keka_sync_leases.holder = EXCLUDED.holder
+                           THEN keka_sync_leases.acquired_at ELSE EXCLUDED.acquired_at END,
+        expires_at = EXCLUDED.expires_at;
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Give a lease up early; only its current holder can
+CREATE OR REPLACE FUNCTION public.keka_sync_lease_release(
+    p_name TEXT,
+    p_holder TEXT
+)
+RETURNS BOOLEAN AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('keka_sync_lease:' || p_name));
+    DELETE FROM public.keka_sync_leases WHERE lease_name = p_name AND holder = p_holder;
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+COMMENT ON TABLE public.keka_sync_leases IS 'Leader and run leases for scheduled Keka syncs';
+COMMENT ON FUNCTION public.keka_sync_lease_acquire IS 'Atomically take or renew a sync lease; true when the caller holds it';
+COMMENT ON FUNCTION public.keka_sync_lease_release IS 'Release a sync lease held by the caller';
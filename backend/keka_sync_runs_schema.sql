@@ -0,0 +1,39 @@
+-- Keka Sync Run History Schema
+-- One row per finished sync stage, for spotting syncs that slow down as headcount grows
+-- Run this in your Supabase SQL editor or psql
+
+CREATE TABLE IF NOT EXISTS public.keka_sync_runs (
+    id BIGSERIAL PRIMARY KEY,
+    run_id UUID NOT NULL, -- shared by the stages of one scheduled run
+    run_type VARCHAR(20) NOT NULL, -- 'daily', 'weekly', 'monthly', 'full' or 'manual'
+    sync_type VARCHAR(50) NOT NULL, -- stage: 'employees', 'leave_balances', 'attendance', ...
+    status VARCHAR(20) NOT NULL, -- 'success' or 'failed'
+    started_at TIMESTAMPTZ NOT NULL,
+    finished_at TIMESTAMPTZ NOT NULL,
+    duration_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    api_seconds DOUBLE PRECISION NOT NULL DEFAULT 0, -- time waiting on Keka responses
+    api_wait_seconds DOUBLE PRECISION NOT NULL DEFAULT 0, -- time queued for rate-limit tokens
+    db_seconds DOUBLE PRECISION NOT NULL DEFAULT 0, -- time in Supabase writes
+    api_requests INTEGER NOT NULL DEFAULT 0,
+    api_retries INTEGER NOT NULL DEFAULT 0,
+    rows_read INTEGER NOT NULL DEFAULT 0,
+    rows_written INTEGER NOT NULL DEFAULT 0,
+    rows_failed INTEGER NOT NULL DEFAULT 0,
+    rows_per_second DOUBLE PRECISION NOT NULL DEFAULT 0,
+    error_message TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_keka_sync_runs_started_at ON public.keka_sync_runs(started_at DESC);
+CREATE INDEX IF NOT EXISTS idx_keka_sync_runs_sync_type_started_at ON public.keka_sync_runs(sync_type, started_at DESC);
+CREATE INDEX IF NOT EXISTS idx_keka_sync_runs_run_id ON public.keka_sync_runs(run_id);
+
+ALTER TABLE public.keka_sync_runs ENABLE ROW LEVEL SECURITY;
+
+-- RLS Policy: Only the backend (service role) touches run history
+CREATE POLICY "Service role can manage sync runs"
+ON public.keka_sync_runs
+FOR ALL
+USING (auth.role() = 'service_role');
+
+COMMENT ON TABLE public.keka_sync_runs IS 'History of Keka sync stages with timings, throughput and retry counts';
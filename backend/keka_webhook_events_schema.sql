@@ -0,0 +1,26 @@
+-- Keka Webhook Events Schema
+-- One row per Keka webhook delivery, keyed by event ID, so redeliveries are
+-- acknowledged without being applied twice
+-- Run this in your Supabase SQL editor or psql
+
+CREATE TABLE IF NOT EXISTS public.keka_webhook_events (
+    event_id TEXT PRIMARY KEY,
+    event_type TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'received' CHECK (status IN ('received', 'processed', 'failed')),
+    received_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    processed_at TIMESTAMPTZ,
+    error_message TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_keka_webhook_events_received_at ON public.keka_webhook_events(received_at);
+CREATE INDEX IF NOT EXISTS idx_keka_webhook_events_status ON public.keka_webhook_events(status) WHERE status <> 'processed';
+
+ALTER TABLE public.keka_webhook_events ENABLE ROW LEVEL SECURITY;
+
+-- RLS Policy: Only the backend (service role) records webhook events
+CREATE POLICY "Service role can manage webhook events"
+ON public.keka_webhook_events
+FOR ALL
+USING (auth.role() = 'service_role');
+
+COMMENT ON TABLE public.keka_webhook_events IS 'Received Keka webhook events, for de-duplication and auditing';
@@ -1,15 +1,13 @@
 # This is the main FastAPI application module (main:app)
 # For WSGI/Gunicorn deployments, this should be imported as "main:app"
 import os
-import time
-from collections import defaultdict
-from typing import Dict, List, Tuple
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
-from app.routers import auth, chat, knowledge, feedback, hr
+from app.routers import auth, chat, knowledge, feedback, hr, keka_webhooks
 from app.db.init_db import init_db
+from app.services.rate_limit_service import rate_limit_service
 
 # Load environment variables
 load_dotenv()
@@ -89,31 +87,10 @@ async def set_security_headers(request: Request, call_next):
         response.headers.setdefault("Strict-Transport-Security", "max-age=31536000; includeSubDomains")
     return response
 
-# Simple in-memory rate limiter for sensitive endpoints (per IP)
-RATE_LIMITS: Dict[str, Tuple[int, int]] = {
-    "/api/auth/token": (30, 10 * 60),  # max 30 requests per 10 minutes
-}
-rate_store: Dict[Tuple[str, str], List[float]] = defaultdict(list)
-
+# Sliding-window rate limits per route, shared across workers (see rate_limit_service)
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
-    path = request.url.path
-    client_ip = (request.client.host if request.client else "unknown") or "unknown"
-    # Skip preflight requests
-    if request.method == "OPTIONS":
-        return await call_next(request)
-    if path in RATE_LIMITS:
-        max_requests, window_seconds = RATE_LIMITS[path]
-        key = (client_ip, path)
-        now = time.time()
-        window_start = now - window_seconds
-        # prune old timestamps
-        recent = [ts for ts in rate_store[key] if ts >= window_start]
-        rate_store[key] = recent
-        if len(recent) >= max_requests:
-            return Response(status_code=429, content="Too Many Requests")
-        rate_store[key].append(now)
-    return await call_next(request)
+    return await rate_limit_service.dispatch(request, call_next)
 
 # Add a simple public test endpoint
 @app.get("/api/test")
@@ -142,6 +119,11 @@ async def get_mock_embeddings_status():
 @app.post("/api/chat/public")
 async def public_chat_endpoint(request: Request):
     """A public chat endpoint that doesn't require authentication."""
+    from app.services.chat_admission_service import chat_admission_service
+
+    # Overload answers 429/503 rather than the error body below
+    client_ip = request.client.host if request.client else "unknown"
+    ticket = await chat_admission_service.admit(f"ip:{client_ip}")
     # Parse the request body
     try:
         from app.services import chat_service
@@ -161,7 +143,8 @@ async def public_chat_endpoint(request: Request):
         )
         
         # Process the request through the real chat service
-        response = await chat_service.process_chat_request(chat_request)
+        with ticket.tracking():
+            response = await chat_service.process_chat_request(chat_request)
         
         return {
             "response": response.message,
@@ -178,6 +161,36 @@ async def public_chat_endpoint(request: Request):
             "message": "There was an error processing your request. Please try again.",
             "traceback": traceback_str if "DEBUG" in os.environ else None
         }
+    finally:
+        ticket.release()
+
+# Release the pooled OpenAI connections on shutdown
+@app.on_event("shutdown")
+async def _close_llm_gateway():
+    from app.utils.llm_gateway import llm_gateway
+    await llm_gateway.aclose()
+
+# Open the shared Keka connection pool on startup, close it on shutdown
+@app.on_event("startup")
+async def _start_keka_http():
+    from app.utils.keka_http import keka_http
+    await keka_http.start()
+
+@app.on_event("shutdown")
+async def _close_keka_http():
+    from app.utils.keka_http import keka_http
+    await keka_http.aclose()
+
+# Fire scheduled Keka syncs from whichever worker holds the leader lease
+@app.on_event("startup")
+async def _start_keka_sync_cron():
+    from app.services.keka_sync_cron_service import keka_sync_cron_service
+    keka_sync_cron_service.start()
+
+@app.on_event("shutdown")
+async def _stop_keka_sync_cron():
+    from app.services.keka_sync_cron_service import keka_sync_cron_service
+    await keka_sync_cron_service.stop()
 
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
@@ -185,6 +198,7 @@ app.include_router(chat.router, prefix="/api/chat", tags=["Chat"])
 app.include_router(knowledge.router, prefix="/api/knowledge", tags=["Knowledge"])
 app.include_router(feedback.router, prefix="/api/v1/feedback", tags=["Feedback"])
 app.include_router(hr.router, prefix="/api/hr", tags=["HR"])
+app.include_router(keka_webhooks.router, prefix="/api/webhooks", tags=["Webhooks"])
 print("--- DEBUG: Included feedback router with prefix /api/v1/feedback ---")
 print("--- DEBUG: Included HR router with prefix /api/hr (Direct API Key Method) ---")
 
@@ -0,0 +1,97 @@
+-- Inbound Rate Limit Schema
+-- Sliding-window counters shared by every backend worker, so a route's
+-- request limit holds across the whole deployment rather than per worker
+-- Run this in your Supabase SQL editor or psql
+
+-- One row per (policy, client): the current and previous fixed windows.
+-- The sliding estimate is previous * (share of it still in the window) + current.
+CREATE TABLE IF NOT EXISTS public.rate_limit_counters (
+    counter_key TEXT PRIMARY KEY,
+    window_start TIMESTAMPTZ NOT NULL,
+    window_seconds INTEGER NOT NULL,
+    current_count INTEGER NOT NULL DEFAULT 0,
+    previous_count INTEGER NOT NULL DEFAULT 0,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_counters_expires_at ON public.rate_limit_counters(expires_at);
+
+ALTER TABLE public.rate_limit_counters ENABLE ROW LEVEL SECURITY;
+
+-- RLS Policy: Only the backend (service role) touches the counters
+CREATE POLICY "Service role can manage rate limit counters"
+ON public.rate_limit_counters
+FOR ALL
+USING (auth.role() = 'service_role');
+
+-- Count one request against p_key if the sliding window has room.
+-- Returns {allowed, remaining, retry_after} with retry_after in seconds.
+-- A transaction-scoped advisory lock serializes callers per key; now and
+-- then a call also deletes counters idle for two windows.
+CREATE OR REPLACE FUNCTION public.rate_limit_hit(
+    p_key TEXT,
+    p_limit INTEGER,
+    p_window_seconds INTEGER
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_now TIMESTAMPTZ := clock_timestamp();
+    v_epoch DOUBLE PRECISION := EXTRACT(EPOCH FROM v_now);
+    v_window_start TIMESTAMPTZ := to_timestamp(v_epoch - (v_epoch::NUMERIC % p_window_seconds)::DOUBLE PRECISION);
+    v_row public.rate_limit_counters%ROWTYPE;
+    v_current INTEGER := 0;
+    v_previous INTEGER := 0;
+    v_weight DOUBLE PRECISION;
+    v_estimate DOUBLE PRECISION;
+    v_allowed BOOLEAN;
+    v_retry_after DOUBLE PRECISION := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('rate_limit:' || p_key));
+
+    SELECT * INTO v_row FROM public.rate_limit_counters WHERE counter_key = p_key;
+    IF FOUND THEN
+        IF v_row.window_start = v_window_start THEN
+            v_current := v_row.current_count;
+            v_previous := v_row.previous_count;
+        ELSIF v_row.window_start = v_window_start - make_interval(secs => p_window_seconds) THEN
+            v_previous := v_row.current_count;
+        END IF;
+    END IF;
+
+    v_weight := 1 - EXTRACT(EPOCH FROM (v_now - v_window_start)) / p_window_seconds;
+    v_estimate := v_previous * v_weight + v_current;
+    v_allowed := v_estimate + 1 <= p_limit;
+
+    IF v_allowed THEN
+        v_current := v_current + 1;
+    ELSIF v_previous > 0 AND v_current + 1 <= p_limit THEN
+        -- Wait until enough of the previous window has slid out
+        v_retry_after := GREATEST(0, (v_weight - (p_limit - v_current - 1)::DOUBLE PRECISION / v_previous) * p_window_seconds);
+    ELSE
+        v_retry_after := EXTRACT(EPOCH FROM (v_window_start + make_interval(secs => p_window_seconds) - v_now));
+    END IF;
+
+    INSERT INTO public.rate_limit_counters (counter_key, window_start, window_seconds, current_count, previous_count, expires_at)
+    VALUES (p_key, v_window_start, p_window_seconds, v_current, v_previous, v_window_start + make_interval(secs => 2 * p_window_seconds))
+    ON CONFLICT (counter_key) DO UPDATE
+    SET window_start = EXCLUDED.window_start,
+        window_seconds = EXCLUDED.window_seconds,
+        current_count = EXCLUDED.current_count,
+        previous_count = EXCLUDED.previous_count,
+        expires_at = EXCLUDED.expires_at;
+
+    -- Idle-key eviction, spread across callers
+    IF random() < 0.01 THEN
+        DELETE FROM public.rate_limit_counters WHERE expires_at < v_now;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'allowed', v_allowed,
+        'remaining', GREATEST(0, floor(p_limit - v_estimate - 1))::INTEGER,
+        'retry_after', v_retry_after
+    );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+COMMENT ON TABLE public.rate_limit_counters IS 'Sliding-window request counters for inbound API rate limits';
+COMMENT ON FUNCTION public.rate_limit_hit IS 'Atomically count a request against a rate limit key; returns allowed, remaining and retry_after';
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Test script for the Keka request scheduler's queue handling
+"""
+
+import asyncio
+import os
+import sys
+
+# Add the app directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.keka_request_scheduler import (
+    KekaRequestScheduler,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+)
+
+
+def _slow_rpc_scheduler() -> KekaRequestScheduler:
+    """Scheduler whose token call always succeeds after a 50 ms round trip"""
+    scheduler = KekaRequestScheduler()
+    scheduler.enabled = True
+    scheduler.max_wait = 2.0
+
+    async def _take_token(reserve: float) -> float:
+        await asyncio.sleep(0.05)
+        return 0.0
+
+    scheduler._take_token = _take_token
+    return scheduler
+
+
+def test_waiter_arriving_during_token_call_is_served():
+    """An interactive call queued while the pump awaits the RPC must not be dropped"""
+
+    async def _run():
+        scheduler = _slow_rpc_scheduler()
+        background = asyncio.create_task(scheduler.acquire(PRIORITY_BACKGROUND))
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(scheduler.acquire(PRIORITY_INTERACTIVE))
+        await asyncio.wait_for(asyncio.gather(background, interactive), timeout=1.0)
+        return scheduler.get_stats()
+
+    stats = asyncio.run(_run())
+    assert stats["granted_interactive"] == 1
+    assert stats["granted_background"] == 1
+    assert stats["timed_out"] == 0
+    assert stats["queued"] == 0
+
+
+def test_interactive_served_before_queued_background():
+    """Tokens go to interactive callers ahead of background ones already waiting"""
+
+    async def _run():
+        scheduler = _slow_rpc_scheduler()
+        order = []
+
+        async def _call(name, priority):
+            await scheduler.acquire(priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(_call(f"background-{i}", PRIORITY_BACKGROUND)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.create_task(_call("interactive", PRIORITY_INTERACTIVE)))
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=1.0)
+        return order
+
+    order = asyncio.run(_run())
+    assert order[0] == "interactive"
+    assert sorted(order[1:]) == ["background-0", "background-1", "background-2"]
+
+
+if __name__ == "__main__":
+    test_waiter_arriving_during_token_call_is_served()
+    test_interactive_served_before_queued_background()
+    print("✅ Keka request scheduler tests passed")
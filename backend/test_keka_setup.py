@@ -163,10 +163,10 @@ async def test_hr_data_service():
     print("\n🧪 Testing HR Data Service...")
     
     try:
-        from app.services.hr_data_service import hr_data_service
+        from app.services.hr_data_service import hr_data_service as hr_data_service_global
         
-        # Set authenticated user
-        hr_data_service.set_authenticated_user("john.doe@company.com")
+        # Request-scoped service for the test user
+        hr_data_service = hr_data_service_global.for_user("john.doe@company.com")
         
         # Test profile retrieval
         profile = await hr_data_service.get_my_profile()
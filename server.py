@@ -23,9 +23,6 @@ print(f"Server.py - Files in app: {os.listdir(app_path)}")
 import fastapi
 from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, List, Tuple
-import time
-from collections import defaultdict
 from dotenv import load_dotenv
 
 # Create a new FastAPI app
@@ -79,29 +76,12 @@ async def set_security_headers(request: Request, call_next):
         response.headers.setdefault("Strict-Transport-Security", "max-age=31536000; includeSubDomains")
     return response
 
-# Simple in-memory rate limiter for auth token route
-RATE_LIMITS: Dict[str, Tuple[int, int]] = {
-    "/api/auth/token": (30, 10 * 60),
-}
-rate_store: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+# Sliding-window rate limits per route, shared across workers (see rate_limit_service)
+from backend.app.services.rate_limit_service import rate_limit_service
 
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
-    if request.method == "OPTIONS":
-        return await call_next(request)
-    path = request.url.path
-    client_ip = (request.client.host if request.client else "unknown") or "unknown"
-    if path in RATE_LIMITS:
-        max_requests, window_seconds = RATE_LIMITS[path]
-        key = (client_ip, path)
-        now = time.time()
-        window_start = now - window_seconds
-        recent = [ts for ts in rate_store[key] if ts >= window_start]
-        rate_store[key] = recent
-        if len(recent) >= max_requests:
-            return fastapi.Response(status_code=429, content="Too Many Requests")
-        rate_store[key].append(now)
-    return await call_next(request)
+    return await rate_limit_service.dispatch(request, call_next)
 
 # Import our backend modules
 # We need to import these modules after setting up the path